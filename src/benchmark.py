@@ -0,0 +1,527 @@
+import argparse
+import json
+import math
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from statistics import mean, median
+from typing import Callable
+
+import sqlalchemy
+from sqlalchemy import create_engine, delete, event, func, select, text
+from sqlalchemy.engine import make_url
+
+from school_management import Group, Course, Student, create_app, create_database_connection, API_VERSION
+from school_management.api import encode_cursor
+from school_management.db import get_loading_plan
+from school_management.orm import AssignedCourse
+from school_management.run import get_connection_string
+from school_management.serializers import get_serializer
+from school_management.generators import BULK_CHUNK_SIZE, GROUP_MAX_SIZE, MIN_COURSES_PER_STUDENT
+
+BENCHMARK_DATABASE = "school_management_benchmark"
+
+# students quantity of one generated group on average
+STUDENTS_PER_GROUP = 25
+
+# students added by one bulk request
+BULK_STUDENTS = 1000
+
+PREFIX = f"/api/v{API_VERSION}"
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Measure latency, throughput and SQL statements quantity of the API resources "
+                    "and DataAccessLayer methods on generated datasets, results are written as JSON")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000],
+                        help="students quantities of the generated datasets")
+    parser.add_argument("--requests", type=int, default=50,
+                        help="measured calls of each case")
+    parser.add_argument("--scan-requests", type=int, default=3,
+                        help="measured calls of cases reading all students (streaming and export)")
+    parser.add_argument("--warmup", type=int, default=3,
+                        help="calls of each case before the measurement")
+    parser.add_argument("--seed", type=int, default=1,
+                        help="random seed of the generated data and the case parameters")
+    parser.add_argument("--database", default=BENCHMARK_DATABASE,
+                        help="PostgreSQL database created for the benchmark on the configured server, "
+                             "it is dropped and created again for each dataset")
+    parser.add_argument("--reuse", action="store_true",
+                        help="keep the database if it already contains the dataset of the same size")
+    parser.add_argument("--only", default=None,
+                        help="measure only cases with names containing the text")
+    parser.add_argument("--output", default="benchmark.json",
+                        help="JSON results file, '-' - standard output")
+    parser.add_argument("--compare", default=None,
+                        help="JSON results file of a previous run, p50 latency changes are printed")
+    return parser.parse_args()
+
+
+def percentile(values: list, share: float) -> float:
+    """
+    Nearest-rank percentile
+    :param values: measured values
+    :param share: percentile from 0 to 1
+    :return: value
+
+    """
+    ordered = sorted(values)
+    return ordered[max(math.ceil(share * len(ordered)) - 1, 0)]
+
+
+def get_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class StatementCounter:
+    """Counts SQL statements executed by the engines"""
+    def __init__(self):
+        self.count = 0
+        self.engines = []
+
+    def watch(self, engine) -> None:
+        if engine not in self.engines:
+            event.listen(engine, "before_cursor_execute", self.count_statement)
+            self.engines.append(engine)
+
+    def count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def close(self) -> None:
+        for engine in self.engines:
+            event.remove(engine, "before_cursor_execute", self.count_statement)
+        self.engines = []
+
+
+class Case:
+    """
+    Measured operation
+    prepare() is called before each call, its result is passed to the call arguments and to cleanup(),
+    prepare() and cleanup() are not measured
+
+    """
+    def __init__(
+            self,
+            name: str,
+            kind: str,
+            call: Callable,
+            rows: Callable = len,
+            prepare: Callable = None,
+            cleanup: Callable = None,
+            scan: bool = False):
+        """
+        :param name: case name
+        :param kind: "api" - a request to the application, "dal" - a DataAccessLayer method call
+        :param call: measured function
+        :param rows: function returning the quantity of rows in the call result
+        :param prepare: function returning a tuple of the call arguments
+        :param cleanup: function reverting the call changes, called with the call arguments
+        :param scan: the case reads all students, it is measured scan-requests times
+
+        """
+        self.name = name
+        self.kind = kind
+        self.call = call
+        self.rows = rows
+        self.prepare = prepare
+        self.cleanup = cleanup
+        self.scan = scan
+
+
+class Benchmark:
+    """Generates datasets and measures the cases on them"""
+    def __init__(self, arguments: argparse.Namespace):
+        self.arguments = arguments
+        self.server_url = make_url(get_connection_string())
+        self.connection_string = str(self.server_url.set(database=arguments.database))
+        self.rng = random.Random(arguments.seed)
+        self.counter = StatementCounter()
+        self.db = None
+        self.app = None
+        self.client = None
+        self.size = 0
+        self.courses = []
+        self.groups = []
+        self.max_id = 0
+        self.created = 0
+
+    # datasets
+
+    def prepare_dataset(self, size: int) -> dict:
+        """
+        Create the benchmark database with the dataset of size students
+        :param size: students quantity
+        :return: dataset description
+
+        """
+        start = time.perf_counter()
+        # connections of the previous dataset are closed, the database may be dropped
+        if self.db is not None:
+            self.db.engine.dispose()
+        if self.app is not None:
+            self.app.database.engine.dispose()
+
+        reused = self.arguments.reuse and self.get_students_qty() == size
+        if not reused:
+            self.recreate_database()
+            db = create_database_connection(self.connection_string, {})
+            db.create_tables()
+            db.bulk_fill_database(size, max(size // STUDENTS_PER_GROUP, 1), self.arguments.seed, BULK_CHUNK_SIZE)
+            db.engine.dispose()
+            # fresh planner statistics make the query plans reproducible
+            with create_engine(self.connection_string, isolation_level="AUTOCOMMIT").connect() as connection:
+                connection.execute(text("VACUUM ANALYZE"))
+
+        self.db = create_database_connection(self.connection_string, {})
+        self.counter.watch(self.db.engine)
+        self.size = size
+        self.courses = self.db.Session.execute(select(Course.name).order_by(Course.id)).scalars().all()
+        self.groups = self.db.Session.execute(select(Group.name).order_by(Group.id)).scalars().all()
+        self.max_id = self.db.Session.execute(select(func.max(Student.id))).scalar()
+        self.db.remove_session()
+
+        # the application of each dataset starts with empty caches and connects to the benchmark database
+        self.app = create_app({"PG_DATABASE": self.arguments.database, "API_DOCS": False})
+        self.client = self.app.test_client()
+        self.counter.watch(self.app.database.engine)
+
+        return {
+            "students": size,
+            "groups": len(self.groups),
+            "courses": len(self.courses),
+            "reused": reused,
+            "seed_seconds": round(time.perf_counter() - start, 3)
+        }
+
+    def get_students_qty(self) -> int | None:
+        engine = create_engine(self.connection_string)
+        try:
+            with engine.connect() as connection:
+                return connection.execute(select(func.count()).select_from(Student)).scalar()
+        except sqlalchemy.exc.SQLAlchemyError:
+            return None
+        finally:
+            engine.dispose()
+
+    def recreate_database(self) -> None:
+        engine = create_engine(str(self.server_url), isolation_level="AUTOCOMMIT")
+        with engine.connect() as connection:
+            connection.execute(text("SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE datname = :name"),
+                               {"name": self.arguments.database})
+            connection.execute(text(f"DROP DATABASE IF EXISTS {self.arguments.database}"))
+            connection.execute(text(f"CREATE DATABASE {self.arguments.database}"))
+        engine.dispose()
+
+    def close(self) -> None:
+        self.counter.close()
+        if self.db is not None:
+            self.db.engine.dispose()
+        if self.app is not None:
+            self.app.database.engine.dispose()
+
+    # measurement
+
+    def measure(self, case: Case) -> dict:
+        """
+        Measure the case
+        :param case: case
+        :return: case results: latency percentiles in milliseconds, rows per second, statements per call
+
+        """
+        requests = self.arguments.scan_requests if case.scan else self.arguments.requests
+        latencies = []
+        statements = []
+        rows = 0
+        for index in range(self.arguments.warmup + requests):
+            args = case.prepare() if case.prepare is not None else ()
+            self.db.remove_session()
+
+            self.counter.count = 0
+            start = time.perf_counter()
+            result = case.call(*args)
+            elapsed = time.perf_counter() - start
+            count = self.counter.count
+
+            call_rows = case.rows(result)
+            self.db.remove_session()
+            if case.cleanup is not None:
+                case.cleanup(*args)
+                self.db.remove_session()
+
+            if index >= self.arguments.warmup:
+                latencies.append(elapsed)
+                statements.append(count)
+                rows += call_rows
+
+        return {
+            "name": case.name,
+            "kind": case.kind,
+            "requests": requests,
+            "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+            "mean_ms": round(mean(latencies) * 1000, 3),
+            "rows_per_sec": round(rows / sum(latencies), 1),
+            "statements": median(statements),
+            "max_statements": max(statements)
+        }
+
+    def request(self, method: str, path: str, **kwargs) -> bytes:
+        """Make a request to the application, the response is read completely"""
+        res = self.client.open(f"{PREFIX}{path}", method=method, **kwargs)
+        data = res.get_data()
+        if res.status_code != 200:
+            raise RuntimeError(f"{method} {path}: {res.status_code} {data[:200]!r}")
+        return data
+
+    # case parameters
+
+    def random_id(self) -> int:
+        return self.rng.randint(1, self.max_id)
+
+    def random_offset(self) -> int:
+        return self.rng.randint(0, max(self.size - 50, 0))
+
+    def random_course(self) -> str:
+        return self.rng.choice(self.courses)
+
+    def random_group(self) -> str:
+        return self.rng.choice(self.groups)
+
+    def new_student(self, courses: list = ()) -> int:
+        """Add a student with the courses, the student is removed by delete_students()"""
+        self.created += 1
+        student = {"first_name": f"benchmark {self.created}", "last_name": "benchmark", "courses": list(courses)}
+        added, errors = self.db.add_students([student])
+        if errors:
+            raise RuntimeError(errors)
+        return added[0]
+
+    def delete_students(self, *args) -> None:
+        """Remove students added by the benchmark"""
+        ids = select(Student.id).where(Student.last_name == "benchmark").scalar_subquery()
+        with self.db.engine.begin() as connection:
+            connection.execute(delete(AssignedCourse).where(AssignedCourse.student_id.in_(ids)))
+            connection.execute(delete(Student).where(Student.last_name == "benchmark"))
+
+    def new_course(self) -> tuple[int, str]:
+        """Add a course without students, the course is removed by delete_course()"""
+        self.created += 1
+        course = Course(name=f"benchmark course {self.created}")
+        self.db.Session.add(course)
+        self.db.Session.commit()
+        return course.id, course.name
+
+    def delete_course(self, course_id: int, *args) -> None:
+        with self.db.engine.begin() as connection:
+            connection.execute(delete(AssignedCourse).where(AssignedCourse.course_id == course_id))
+            connection.execute(delete(Course).where(Course.id == course_id))
+        self.db.reference_cache.clear()
+
+    # cases
+
+    def get_api_cases(self) -> list:
+        def page(data: bytes) -> int:
+            return len(next(iter(json.loads(data).values())))
+
+        def lines(data: bytes) -> int:
+            return data.count(b"\n")
+
+        def one(result) -> int:
+            return 1
+
+        new_students = list({"first_name": f"bulk {index}", "last_name": "benchmark",
+                             "group": self.groups[index % len(self.groups)],
+                             "courses": self.courses[:MIN_COURSES_PER_STUDENT]} for index in range(BULK_STUDENTS))
+
+        return [
+            Case("GET students offset page", "api",
+                 lambda: self.request("GET", f"/students/?offset={self.random_offset()}"), page),
+            Case("GET students cursor page", "api",
+                 lambda: self.request("GET", f"/students/?cursor={encode_cursor(self.random_id())}"), page),
+            Case("GET students page with exact total", "api",
+                 lambda: self.request("GET", f"/students/?offset={self.random_offset()}&total=exact"), page),
+            Case("GET students page with estimated total", "api",
+                 lambda: self.request("GET", f"/students/?offset={self.random_offset()}&total=estimate"), page),
+            Case("GET students sparse fieldset page", "api",
+                 lambda: self.request("GET", f"/students/?offset={self.random_offset()}&fields=id,first_name"), page),
+            Case("GET students XML page", "api",
+                 lambda: self.request("GET", f"/students/?offset={self.random_offset()}",
+                                      headers={"Accept": "application/xml"}),
+                 lambda data: data.count(b"\n\t<item>")),
+            Case("GET students streamed", "api",
+                 lambda: self.request("GET", "/students/?limit=0&fields=id,first_name,last_name"),
+                 lambda data: data.count(b'"first_name":'), scan=True),
+            Case("GET students export NDJSON", "api",
+                 lambda: self.request("GET", "/students/export/"), lines, scan=True),
+            Case("GET students export CSV", "api",
+                 lambda: self.request("GET", "/students/export/?format=csv"),
+                 lambda data: lines(data) - 1, scan=True),
+            Case("GET students_by_course page", "api",
+                 lambda: self.request(
+                     "GET", f"/students_by_course/{self.random_course()}/?offset={self.random_offset() // 10}"),
+                 page),
+            Case("GET groups_by_count page", "api",
+                 lambda: self.request("GET", f"/groups_by_count/{self.rng.randint(0, GROUP_MAX_SIZE)}/"), page),
+            Case("GET groups_by_group page", "api",
+                 lambda: self.request("GET", f"/groups_by_group/{self.random_group()}/"), page),
+            Case("POST students", "api",
+                 lambda: self.request("POST", "/students/", json={"first_name": "new", "last_name": "benchmark"}),
+                 one, cleanup=self.delete_students),
+            Case("POST students bulk", "api",
+                 lambda: self.request("POST", "/students/bulk/", json=new_students),
+                 lambda data: len(json.loads(data)["result"]["created"]), cleanup=self.delete_students),
+            Case("DELETE student", "api",
+                 lambda student_id: self.request("DELETE", f"/students/{student_id}"), one,
+                 prepare=lambda: (self.new_student(self.courses[:1]),), cleanup=self.delete_students),
+            Case("PUT students_add_to_courses", "api",
+                 lambda student_id: self.request(
+                     "PUT", f"/students_add_to_courses/{student_id}/",
+                     query_string={"courses": self.courses[:MIN_COURSES_PER_STUDENT + 1]}), one,
+                 prepare=lambda: (self.new_student(),), cleanup=self.delete_students),
+            Case("PUT students_del_from_course", "api",
+                 lambda student_id: self.request(
+                     "PUT", f"/students_del_from_course/{student_id}/", query_string={"course_name": self.courses[0]}),
+                 one, prepare=lambda: (self.new_student(self.courses[:2]),), cleanup=self.delete_students),
+            Case("POST enrollments of a group", "api",
+                 lambda course_id, course_name, group_name: self.request(
+                     "POST", "/enrollments/", json={"courses": [course_name], "groups": [group_name]}),
+                 lambda data: json.loads(data)["result"]["enrolled"],
+                 prepare=lambda: (*self.new_course(), self.random_group()), cleanup=self.delete_course)
+        ]
+
+    def get_dal_cases(self) -> list:
+        db = self.db
+        complete = get_loading_plan(Student, get_serializer(Student).fields)
+        group_plan = get_loading_plan(Group, get_serializer(Group).fields)
+
+        def one(result) -> int:
+            return 1
+
+        return [
+            Case("get_students offset page", "dal",
+                 lambda: db.get_students(limit=50, offset=self.random_offset(), loading=complete)),
+            Case("get_students cursor page", "dal",
+                 lambda: db.get_students(limit=50, after=self.random_id(), loading=complete)),
+            Case("get_students without relationships", "dal",
+                 lambda: db.get_students(limit=50, offset=self.random_offset())),
+            Case("get_students streamed", "dal",
+                 lambda: sum(1 for _ in db.get_students(stream=True)), lambda qty: qty, scan=True),
+            Case("get_students exact total", "dal", lambda: db.get_students(total="exact"), one),
+            Case("get_students estimated total", "dal", lambda: db.get_students(total="estimate"), one),
+            Case("get_students_by_course page", "dal",
+                 lambda: db.get_students_by_course(self.random_course(), limit=50,
+                                                   offset=self.random_offset() // 10, loading=complete)),
+            Case("get_groups_with_less_equals_students page", "dal",
+                 lambda: db.get_groups_with_less_equals_students(
+                     self.rng.randint(0, GROUP_MAX_SIZE), limit=50, loading=group_plan)),
+            Case("export_students", "dal", lambda: sum(1 for _ in db.export_students()), lambda qty: qty, scan=True),
+            Case("get_student_by_id", "dal", lambda: db.get_student_by_id(self.random_id()), one),
+            Case("get_complete_student_by_id", "dal", lambda: db.get_complete_student_by_id(self.random_id()), one),
+            Case("get_group_by_name", "dal", lambda: db.get_group_by_name(self.random_group()), one),
+            Case("get_course_by_name", "dal", lambda: db.get_course_by_name(self.random_course()), one),
+            Case("resolve_names of courses", "dal", lambda: db.resolve_names(Course, self.courses)),
+            Case("get_data_versions", "dal",
+                 lambda: db.get_data_versions(("students", "groups", "courses", "assigned_courses"))),
+            Case("add_student", "dal",
+                 lambda: db.add_student({"first_name": "new", "last_name": "benchmark"}), one,
+                 cleanup=self.delete_students),
+            Case("add_students", "dal",
+                 lambda: db.add_students(list({"first_name": f"bulk {index}", "last_name": "benchmark",
+                                               "courses": self.courses[:MIN_COURSES_PER_STUDENT]}
+                                              for index in range(BULK_STUDENTS)))[0],
+                 cleanup=self.delete_students),
+            Case("delete_student_by_id", "dal", lambda student_id: db.delete_student_by_id(student_id), one,
+                 prepare=lambda: (self.new_student(self.courses[:1]),), cleanup=self.delete_students),
+            Case("add_student_to_courses", "dal",
+                 lambda student_id, course_ids: db.add_student_to_courses(student_id, course_ids), one,
+                 prepare=lambda: (self.new_student(), self.course_ids()), cleanup=self.delete_students),
+            Case("delete_student_from_course", "dal",
+                 lambda student_id, course_ids: db.delete_student_from_course(student_id, course_ids[0]), one,
+                 prepare=lambda: (self.new_student(self.courses[:2]), self.course_ids()), cleanup=self.delete_students),
+            Case("enroll_students of a group", "dal",
+                 lambda course_id, course_name, group_id: db.enroll_students([course_id], group_ids=[group_id]),
+                 lambda enrolled: enrolled,
+                 prepare=lambda: (*self.new_course(), self.rng.randint(1, len(self.groups))),
+                 cleanup=self.delete_course)
+        ]
+
+    def course_ids(self) -> list:
+        return list(self.db.resolve_names(Course, self.courses[:MIN_COURSES_PER_STUDENT + 1]).values())
+
+    def run(self) -> dict:
+        """
+        Measure all cases on all datasets
+        :return: results
+
+        """
+        results = {
+            "commit": get_commit(),
+            "started": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlalchemy": sqlalchemy.__version__,
+            "server": None,
+            "arguments": vars(self.arguments),
+            "datasets": []
+        }
+        try:
+            for size in self.arguments.sizes:
+                dataset = self.prepare_dataset(size)
+                print(f"{size} students, seeded in {dataset['seed_seconds']} s", file=sys.stderr)
+                with self.db.engine.connect() as connection:
+                    results["server"] = connection.execute(text("SHOW server_version")).scalar()
+
+                dataset["cases"] = []
+                for case in self.get_api_cases() + self.get_dal_cases():
+                    if self.arguments.only is not None and self.arguments.only not in case.name:
+                        continue
+                    result = self.measure(case)
+                    dataset["cases"].append(result)
+                    print(f"  {case.kind:3} {case.name:45} p50 {result['p50_ms']:9.2f} ms  "
+                          f"p99 {result['p99_ms']:9.2f} ms  {result['rows_per_sec']:12,.0f} rows/sec  "
+                          f"{result['statements']:5} statements", file=sys.stderr)
+                results["datasets"].append(dataset)
+        finally:
+            self.close()
+        return results
+
+
+def compare(results: dict, baseline: dict) -> None:
+    """
+    Print p50 latency and statements changes of the cases measured in both runs
+    :param results: results of this run
+    :param baseline: results of a previous run
+
+    """
+    previous = {(dataset["students"], case["kind"], case["name"]): case
+                for dataset in baseline["datasets"] for case in dataset["cases"]}
+    print(f"Compared with {baseline['commit']}:", file=sys.stderr)
+    for dataset in results["datasets"]:
+        for case in dataset["cases"]:
+            old = previous.get((dataset["students"], case["kind"], case["name"]), None)
+            if old is None:
+                continue
+            change = (case["p50_ms"] / old["p50_ms"] - 1) * 100 if old["p50_ms"] else 0
+            print(f"  {dataset['students']:8} {case['kind']:3} {case['name']:45} p50 {change:+7.1f} %  "
+                  f"statements {old['statements']} -> {case['statements']}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    results = Benchmark(arguments).run()
+
+    if arguments.output == "-":
+        json.dump(results, sys.stdout, indent=2)
+    else:
+        with open(arguments.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+    if arguments.compare is not None:
+        with open(arguments.compare, encoding="utf-8") as file:
+            compare(results, json.load(file))
@@ -0,0 +1,85 @@
+import argparse
+import random
+import time
+from typing import Callable
+
+from flask_restful import marshal
+
+from school_management import Group, Course, Student
+from school_management.generators import generate_courses, generate_students_stream, generate_bulk_group_name, \
+    MIN_COURSES_PER_STUDENT, MAX_COURSES_PER_STUDENT, GROUP_MAX_SIZE
+from school_management.serializers import get_serializer
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare compiled serializers with flask_restful marshal")
+    parser.add_argument("--students", type=int, default=10000,
+                        help="serialized students quantity")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="measurements quantity, the best one is reported")
+    parser.add_argument("--seed", type=int, default=1,
+                        help="random seed of the generated students")
+    return parser.parse_args()
+
+
+def make_students(qty: int, seed: int) -> list:
+    """
+    Make students with groups and courses in memory, like loaded with the eager loading plan
+    :param qty: students quantity
+    :param seed: random seed
+    :return: list of Student
+
+    """
+    rng = random.Random(seed)
+    courses = list(Course(id=index + 1, **course) for index, course in enumerate(generate_courses()))
+    groups = list(Group(id=index + 1, name=generate_bulk_group_name(index))
+                  for index in range(qty // GROUP_MAX_SIZE + 1))
+
+    students = []
+    for chunk in generate_students_stream(rng, qty):
+        for student in chunk:
+            students.append(Student(
+                id=len(students) + 1,
+                group=rng.choice(groups + [None]),
+                courses=rng.sample(courses, rng.randint(MIN_COURSES_PER_STUDENT, MAX_COURSES_PER_STUDENT)),
+                **student))
+    return students
+
+
+def measure(serialize: Callable, rows: list, repeat: int) -> float:
+    """
+    Measure serialization speed
+    :param serialize: function serializing a list of rows
+    :param rows: rows
+    :param repeat: measurements quantity
+    :return: the best speed, rows per second
+
+    """
+    best = min(timeit(serialize, rows) for _ in range(repeat))
+    return len(rows) / best
+
+
+def timeit(serialize: Callable, rows: list) -> float:
+    start = time.perf_counter()
+    serialize(rows)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+
+    students = make_students(arguments.students, arguments.seed)
+    data_fields = Student.get_complete_fields()
+    serializer = get_serializer(Student)
+
+    if marshal(students, data_fields) != list(map(serializer, students)):
+        raise SystemExit("Compiled serializer output differs from marshal")
+
+    results = {
+        "marshal": measure(lambda rows: marshal(rows, Student.get_complete_fields()), students, arguments.repeat),
+        "compiled": measure(lambda rows: list(map(serializer, rows)), students, arguments.repeat)
+    }
+
+    for name, speed in results.items():
+        print(f"{name:>10}: {speed:12,.0f} rows/sec")
+    print(f"   speedup: {results['compiled'] / results['marshal']:12.1f}x")
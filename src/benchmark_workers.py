@@ -0,0 +1,148 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from statistics import mean
+
+from benchmark import percentile, get_commit
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Measure the application throughput served by gunicorn with different workers quantities, "
+                    "the configured database is used (fill it before, e.g. fill_database.py --bulk)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4],
+                        help="measured workers quantities")
+    parser.add_argument("--mode", choices=("sync", "gthread", "gevent"), default="gthread",
+                        help="serving mode, see serving.py")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="threads of a gthread worker, the pool size by default")
+    parser.add_argument("--preload", action="store_true",
+                        help="preload the application in the master process")
+    parser.add_argument("--concurrency", type=int, default=16,
+                        help="concurrent client connections")
+    parser.add_argument("--duration", type=float, default=10,
+                        help="seconds of the load for each workers quantity")
+    parser.add_argument("--path", action="append", default=None,
+                        help="requested paths, requested in turn, default: a students page")
+    parser.add_argument("--port", type=int, default=8089,
+                        help="port of the started gunicorn")
+    parser.add_argument("--output", default="benchmark_workers.json",
+                        help="JSON results file, '-' - standard output")
+    return parser.parse_args()
+
+
+class Server:
+    """gunicorn started with gunicorn.conf.py and the given serving settings"""
+    def __init__(self, arguments: argparse.Namespace, workers: int):
+        self.url = f"http://127.0.0.1:{arguments.port}"
+        env = dict(os.environ,
+                   WEB_BIND=f"127.0.0.1:{arguments.port}",
+                   WEB_SERVING_MODE=arguments.mode,
+                   WEB_WORKERS=str(workers),
+                   WEB_PRELOAD="true" if arguments.preload else "",
+                   REQUEST_LOG="false")
+        if arguments.threads is not None:
+            env["WEB_THREADS"] = str(arguments.threads)
+        directory = os.path.dirname(os.path.abspath(__file__))
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "wsgi:app"],
+            cwd=directory, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def wait_ready(self, timeout: float = 30) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with code {self.process.returncode}")
+            try:
+                with urllib.request.urlopen(f"{self.url}/readyz", timeout=5) as response:
+                    if response.status == 200:
+                        return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError("gunicorn is not ready")
+
+    def stop(self) -> None:
+        self.process.terminate()
+        self.process.wait()
+
+
+def run_load(url: str, paths: list, concurrency: int, duration: float) -> dict:
+    """
+    Request the paths from concurrent threads for the duration
+    :return: requests per second, latency percentiles in milliseconds and errors quantity
+
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(index: int) -> None:
+        own_latencies = []
+        own_errors = 0
+        request_index = index
+        while time.monotonic() < deadline:
+            path = paths[request_index % len(paths)]
+            request_index += 1
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(f"{url}{path}", timeout=30) as response:
+                    response.read()
+                own_latencies.append(time.perf_counter() - start)
+            except OSError:
+                own_errors += 1
+        with lock:
+            latencies.extend(own_latencies)
+            errors.append(own_errors)
+
+    start = time.perf_counter()
+    threads = list(threading.Thread(target=client, args=(index,)) for index in range(concurrency))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "requests": len(latencies),
+        "errors": sum(errors),
+        "requests_per_sec": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        "mean_ms": round(mean(latencies) * 1000, 3) if latencies else None
+    }
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    paths = arguments.path or ["/api/v1/students/?limit=50"]
+
+    results = {
+        "commit": get_commit(),
+        "cpu_count": os.cpu_count(),
+        "arguments": vars(arguments),
+        "runs": []
+    }
+    for workers in arguments.workers:
+        server = Server(arguments, workers)
+        try:
+            server.wait_ready()
+            # the first requests of each worker connect to the database
+            run_load(server.url, paths, arguments.concurrency, 1)
+            result = dict(workers=workers, **run_load(server.url, paths, arguments.concurrency, arguments.duration))
+        finally:
+            server.stop()
+        results["runs"].append(result)
+        print(f"{workers:3} workers: {result['requests_per_sec']:10,.1f} requests/sec  "
+              f"p50 {result['p50_ms']} ms  p99 {result['p99_ms']} ms  {result['errors']} errors", file=sys.stderr)
+
+    if arguments.output == "-":
+        json.dump(results, sys.stdout, indent=2)
+    else:
+        with open(arguments.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,21 @@
+import sys
+
+from school_management import create_database_connection
+
+
+if __name__ == "__main__":
+    db = create_database_connection()
+    db.create_tables()
+
+    for name in db.create_indexes():
+        print(f"Index {name} was created")
+
+    result = db.validate_indexes()
+    for name in result["unexpected"]:
+        print(f"Index {name} is not declared in the schema")
+    for name in result["missing"]:
+        print(f"Index {name} does not exist!")
+
+    if result["missing"]:
+        sys.exit(1)
+    print("Indexes are valid!")
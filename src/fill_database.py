@@ -1,8 +1,40 @@
+import argparse
+import sys
+import time
+
 from school_management import create_database_connection
+from school_management.generators import GROUPS_QTY, STUDENTS_QTY, BULK_CHUNK_SIZE
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Fill the database with random data")
+    parser.add_argument("--bulk", action="store_true",
+                        help="generate a large dataset with bulk inserts")
+    parser.add_argument("--students", type=int, default=STUDENTS_QTY,
+                        help="students quantity (bulk mode)")
+    parser.add_argument("--groups", type=int, default=GROUPS_QTY,
+                        help="groups quantity (bulk mode)")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="random seed to generate the same data (bulk mode)")
+    parser.add_argument("--chunk-size", type=int, default=BULK_CHUNK_SIZE,
+                        help="rows quantity loaded at once (bulk mode)")
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
+    arguments = parse_arguments()
+
     db = create_database_connection()
     db.create_tables()
-    db.fill_database()
-    print("Database was filled with random data!")
+
+    if arguments.bulk:
+        start = time.perf_counter()
+        try:
+            loaded = db.bulk_fill_database(arguments.students, arguments.groups, arguments.seed, arguments.chunk_size)
+        except ValueError as error:
+            sys.exit(str(error))
+        print(f"Database was filled with random data in {time.perf_counter() - start:.1f} s: "
+              + ", ".join(f"{qty} {table}" for table, qty in loaded.items()))
+    else:
+        db.fill_database()
+        print("Database was filled with random data!")
@@ -0,0 +1,68 @@
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from serving import get_worker_settings_from_env  # noqa: E402
+
+bind = os.environ.get("WEB_BIND", "") or "0.0.0.0:80"
+
+# WEB_SERVING_MODE (sync, gthread, gevent), WEB_WORKERS and WEB_THREADS, derived from CPUs and the pool size by default
+worker_settings = get_worker_settings_from_env()
+worker_class = worker_settings["worker_class"]
+workers = worker_settings["workers"]
+threads = worker_settings["threads"]
+worker_connections = worker_settings["worker_connections"]
+
+# the application is imported once by the master, workers share its memory
+preload_app = os.environ.get("WEB_PRELOAD", "").lower() in ("1", "true", "yes", "on")
+
+# worker metrics are written to files and aggregated by /metrics,
+# the directory must exist before the application is imported, it's cleared by on_starting()
+metrics_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "school_management_metrics"))
+os.makedirs(metrics_dir, exist_ok=True)
+
+
+def get_preloaded_app():
+    """The application created by wsgi.py in the master process, None without preloading"""
+    return getattr(sys.modules.get("wsgi", None), "app", None)
+
+
+def on_starting(server):
+    # metrics of the previous run are removed once, this file is executed again by a reload (SIGHUP),
+    # which keeps the metrics of the live workers
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def when_ready(server):
+    # the master doesn't serve requests, connections opened by the preloaded application are closed before forks
+    app = get_preloaded_app()
+    if app is not None:
+        app.database.engine.dispose()
+
+
+def post_fork(server, worker):
+    if worker_class == "gevent":
+        # psycopg2 waits for the database cooperatively
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+    # the preloaded application is warmed up in the master, the worker opens its own pool before the first request
+    app = get_preloaded_app()
+    if app is not None:
+        from school_management.run import warm_up_database
+
+        app.database.engine.dispose(close=False)
+        warm_up_database(app)
+
+
+def child_exit(server, worker):
+    # prometheus_client is imported after PROMETHEUS_MULTIPROC_DIR is set, it selects the storage on import
+    from prometheus_client import multiprocess
+
+    # gauges of a stopped worker are removed from the live workers sums
+    multiprocess.mark_process_dead(worker.pid)
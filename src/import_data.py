@@ -0,0 +1,57 @@
+import argparse
+import time
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from school_management import create_database_connection
+from school_management.generators import BULK_CHUNK_SIZE
+from school_management.importer import Importer, ImportDataError, IMPORT_COLUMNS
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Import groups, courses, students and enrollments from CSV or NDJSON files. "
+                    "Groups and courses are referenced by names, CSV lists are separated by ';'. "
+                    "After a failure run the same command again to continue from the last committed batch")
+    parser.add_argument("--groups", help="groups file, columns: name")
+    parser.add_argument("--courses", help="courses file, columns: name, description")
+    parser.add_argument("--students", help="students file, columns: first_name, last_name, group, courses")
+    parser.add_argument("--enrollments", help="enrollments file, columns: student_id, course")
+    parser.add_argument("--format", choices=("csv", "ndjson"), default=None,
+                        help="files format, by the file extensions by default")
+    parser.add_argument("--batch-size", type=int, default=BULK_CHUNK_SIZE,
+                        help="rows quantity imported in one transaction")
+    parser.add_argument("--checkpoint", default="import_checkpoint.json",
+                        help="file with the import progress, removed after a completed import")
+    parser.add_argument("--restart", action="store_true",
+                        help="ignore the progress of a previous import")
+    return parser.parse_args()
+
+
+def report(kind: str, imported: int, batch: int, seconds: float) -> None:
+    print(f"{kind}: {imported} rows imported, batch of {batch} rows at {batch / seconds:,.0f} rows/sec")
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+
+    db = create_database_connection()
+    db.create_tables()
+
+    importer = Importer(db, arguments.batch_size, arguments.checkpoint, report)
+    if arguments.restart:
+        importer.remove_checkpoint()
+
+    try:
+        for kind in IMPORT_COLUMNS:
+            path = getattr(arguments, kind)
+            if path is None:
+                continue
+            start = time.perf_counter()
+            imported = importer.import_file(kind, path, arguments.format)
+            elapsed = time.perf_counter() - start
+            print(f"{kind} were imported in {elapsed:.1f} s: {imported} rows")
+    except (ImportDataError, SQLAlchemyError) as error:
+        raise SystemExit(f"Import failed: {error}\nRun the same command to continue from the last committed batch")
+
+    importer.remove_checkpoint()
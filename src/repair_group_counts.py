@@ -0,0 +1,8 @@
+from school_management import create_database_connection
+
+
+if __name__ == "__main__":
+    db = create_database_connection()
+    db.create_tables()
+    fixed = db.repair_group_counts()
+    print(f"Group students counters were checked, {fixed} groups fixed!")
@@ -4,6 +4,6 @@ provides students list, groups list, courses list
 include postgres database support
 
 """
-from .run import app, create_database_connection, API_VERSION
+from .run import create_app, create_database_connection, get_config, API_VERSION
 from .db import DataAccessLayer
 from .orm import Group, Student, Course
@@ -1,29 +1,185 @@
+import binascii
+import hashlib
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from functools import lru_cache, wraps
 from typing import Callable
 
-from flask import request, jsonify, make_response, current_app
-from flask_restful import Resource, marshal, abort
+from flask import Response, request, jsonify, make_response, current_app, g
+from flask_restful import Resource, abort
 from sqlalchemy.exc import NoResultFound
 
-from .orm import Group, Student
+from .orm import Base, Group, Student, Course
+from .db import get_loading_plan, COUNT_MODES
+from .serializers import get_serializer
+from .export import EXPORT_FORMATS
+from .instrumentation import measure_serialization
 
 
-def get_data_with_pagination(data_fields: dict, getter: Callable, *args, **kwargs) -> list | dict:
+def conditional(*tables: str) -> Callable:
+    """
+    Conditional GET decorator for resource methods
+    The response ETag is made from the request and data versions of the tables used by the response,
+    if the request If-None-Match contains it, 304 is returned without data reading and serialization.
+    Representations set the ETag (g.etag) to the response
+    :param tables: names of the tables used by the response
+    :return: decorator
+
+    """
+    def decorator(method: Callable) -> Callable:
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            versions = current_app.database.get_data_versions(tables)
+            # the same data has different representations for different Accept headers
+            token = json.dumps([request.full_path, str(request.accept_mimetypes), sorted(versions.items())])
+            etag = hashlib.sha1(token.encode()).hexdigest()
+
+            if request.if_none_match.contains(etag):
+                response = make_response("", 304)
+                response.set_etag(etag)
+                return response
+
+            g.etag = etag
+            return method(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def encode_cursor(last_id: int) -> str:
+    """
+    Make an opaque pagination cursor
+    :param last_id: id of the last element on the page
+    :return: cursor
+
+    """
+    return urlsafe_b64encode(json.dumps({"id": last_id}).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> int | None:
+    """
+    Get the last element id from a pagination cursor
+    If the cursor is invalid, exception ValueError will be raised
+    :param cursor: cursor, empty cursor means the first page
+    :return: id of the last element on the previous page
+
+    """
+    if cursor == "":
+        return None
+
+    try:
+        last_id = json.loads(urlsafe_b64decode(cursor.encode()))["id"]
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError, TypeError, KeyError) as error:
+        raise ValueError(f"Invalid cursor: '{cursor}'") from error
+
+    if not isinstance(last_id, int):
+        raise ValueError(f"Invalid cursor: '{cursor}'")
+    return last_id
+
+
+def get_field_names(entity: type[Base]) -> tuple | None:
+    """
+    Get names of the fields requested by "fields" argument (sparse fieldset) like "fields=id,first_name"
+    If the request contains unknown field names, 400 is sent
+    :param entity: ORM class
+    :return: tuple of field names in the order of the entity fields, None if all fields are requested
+
+    """
+    fields_argument = request.args.get("fields", default=None)
+    if fields_argument is None:
+        return None
+
+    available = get_serializer(entity).fields
+    requested = set(name.strip() for name in fields_argument.split(",")) - {""}
+    if len(requested) == 0 or requested - available.keys():
+        send_error_response(400, f"Invalid fields: '{fields_argument}', available fields: {', '.join(available)}.")
+    return tuple(name for name in available if name in requested)
+
+
+@lru_cache(maxsize=None)
+def get_fields_loading_plan(entity: type[Base], field_names: tuple = None) -> list:
+    """
+    Get loader options for the serialized fields of the entity, they are built once for each fieldset
+    :param entity: ORM class
+    :param field_names: names of the serialized fields, None - all fields
+    :return: list of loader options for the select statement, see get_loading_plan()
+
+    """
+    return get_loading_plan(entity, get_serializer(entity, field_names=field_names).fields)
+
+
+def get_data_with_pagination(entity: type[Base], getter: Callable, *args, **kwargs) -> dict:
     """
     Gets data from the database with pagination
-    :param data_fields:  dict of fields for a response marshalling
+    Only the fields requested by "fields" argument are read and serialized, all fields by default.
+    Relationships used by the fields are eager loaded, so a page is served by a fixed number of queries
+    Offset pagination is used by default, if the request contains "cursor" argument,
+    keyset pagination is used and the result contains a cursor for the next page.
+    If the request contains "total" argument ("exact" or "estimate"), the result contains the total quantity
+    Without a limit (limit=0) data is a lazy iterator, rows are read from the database and serialized
+    while the response is streamed
+    :param entity: ORM class returned by the getter
     :param getter: function - data getter
-    :return: data
+    :return: dict {"data": data}, "next_cursor" for the keyset pagination and "total" if it's requested
 
     """
-    data = marshal(getter(
+    limit = request.args.get("limit", default=50, type=int)
+    cursor = request.args.get("cursor", default=None)
+    total = request.args.get("total", default=None)
+    if total is not None and total not in COUNT_MODES:
+        send_error_response(400, f"Invalid total: '{total}', expected one of: {', '.join(COUNT_MODES)}.")
+
+    after = None
+    if cursor is not None:
+        try:
+            after = decode_cursor(cursor)
+        except ValueError as error:
+            send_error_response(400, str(error))
+
+    field_names = get_field_names(entity)
+    serializer = get_serializer(entity, field_names=field_names)
+
+    result = {}
+    if total is not None:
+        # counted before the rows are read, a streamed response can't wait for the count
+        result["total"] = getter(*args, total=total, **kwargs)
+
+    stream = limit <= 0
+    rows = getter(
         *args,
-        limit=request.args.get("limit", default=50, type=int),
+        limit=limit,
         offset=request.args.get("offset", default=0, type=int),
+        after=after,
+        loading=get_fields_loading_plan(entity, field_names),
+        stream=stream,
         **kwargs
-    ),
-        data_fields)
+    )
+
+    if stream:
+        result["data"] = map(serializer, rows)
+    else:
+        with measure_serialization():
+            result["data"] = list(map(serializer, rows))
+
+    if cursor is not None:
+        # a short page is the last one
+        result["next_cursor"] = None if stream or len(rows) < limit else encode_cursor(rows[-1].id)
 
-    return data
+    return result
+
+
+def is_list_of(value, item_type: type) -> bool:
+    """
+    Check the value from a request body is a list of item_type values
+    :param value: value
+    :param item_type: type of the list items
+    :return: check result
+
+    """
+    # bool is a subclass of int, but true and false are not ids
+    return isinstance(value, list) \
+        and all(isinstance(item, item_type) and not isinstance(item, bool) for item in value)
 
 
 def send_error_response(code: int, message: str) -> None:
@@ -37,11 +193,90 @@ def send_error_response(code: int, message: str) -> None:
     abort(response)
 
 
+# NDJSON body mimetypes of bulk requests
+NDJSON_MIMETYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+# maximal students quantity of a bulk create request
+BULK_MAX_STUDENTS = 10000
+# fields of students in a bulk create request
+BULK_STUDENT_FIELDS = {"first_name", "last_name", "group", "courses"}
+
+# tables used by student representations
+STUDENT_TABLES = ("students", "groups", "courses", "assigned_courses")
+# tables used by group representations
+GROUP_TABLES = ("groups", "students")
+
+
+def read_bulk_items(max_items: int) -> list:
+    """
+    Read items of a bulk request body: JSON array or NDJSON (a JSON value per line, empty lines are skipped)
+    If the body can't be read, 400 is sent. NDJSON lines with invalid JSON are returned as ValueError
+    :param max_items: maximal items quantity
+    :return: list of items
+
+    """
+    if request.mimetype in NDJSON_MIMETYPES:
+        items = []
+        for number, line in enumerate(request.get_data(as_text=True).splitlines(), start=1):
+            if line.strip() == "":
+                continue
+            try:
+                items.append(json.loads(line))
+            except json.JSONDecodeError as error:
+                items.append(ValueError(f"Invalid JSON at line {number}: {error.msg}"))
+    else:
+        items = request.get_json(silent=True)
+        if not isinstance(items, list):
+            send_error_response(400, "A JSON array or NDJSON body expected.")
+
+    if len(items) == 0:
+        send_error_response(400, "No items.")
+    if len(items) > max_items:
+        send_error_response(400, f"Too many items: {len(items)}, maximum is {max_items}.")
+    return items
+
+
+def validate_bulk_student(item) -> str | None:
+    """
+    Validate a student of the bulk create request
+    :param item: student dict like {"first_name": first_name, "last_name": last_name,
+        "group": group name, "courses": list of course names}, "group" and "courses" are optional
+    :return: error message, None for a valid student
+
+    """
+    if isinstance(item, ValueError):
+        return str(item)
+    if not isinstance(item, dict):
+        return f"Invalid student: '{item}'."
+
+    unknown = item.keys() - BULK_STUDENT_FIELDS
+    if unknown:
+        return f"Unknown fields: {', '.join(sorted(unknown))}."
+
+    for name in ("first_name", "last_name"):
+        value = item.get(name, None)
+        if not isinstance(value, str) or value == "":
+            return f"Field '{name}' must be a non-empty string."
+        if len(value) > getattr(Student, name).type.length:
+            return f"Field '{name}' is too long."
+
+    if item.get("group", None) is not None and not isinstance(item["group"], str):
+        return "Field 'group' must be a group name."
+
+    courses = item.get("courses", None)
+    if courses is not None and not is_list_of(courses, str):
+        return "Field 'courses' must be a list of course names."
+
+    return None
+
+
 class Students(Resource):
     """Contains methods for getting a students list and student create"""
+    @conditional(*STUDENT_TABLES)
     def get(self):
-        data = get_data_with_pagination(Student.get_complete_fields(), current_app.database.get_students)
-        return {"data": data, "root_name": "students"}
+        page = get_data_with_pagination(
+            Student,
+            current_app.database.get_students)
+        return dict(page, root_name="students")
 
     def post(self):
         # If parsing is unsuccessful, there is no error thrown. Instead, "Bad Request" is returned to the client.
@@ -52,10 +287,54 @@ class Students(Resource):
                 or new_student.get("last_name", None) is None:
             send_error_response(400, f"Invalid data fields: '{new_student}'.")
 
-        data = marshal(current_app.database.add_student(new_student), Student.get_complete_fields())
+        data = get_serializer(Student)(current_app.database.add_student(new_student))
         return {"data": data, "root_name": "student"}
 
 
+class StudentsBulk(Resource):
+    """Contains a method for creating many students at once"""
+    def post(self):
+        items = read_bulk_items(BULK_MAX_STUDENTS)
+
+        errors = {}
+        students = {}
+        for index, item in enumerate(items):
+            error = validate_bulk_student(item)
+            if error is None:
+                students[index] = item
+            else:
+                errors[index] = error
+
+        indexes = list(students.keys())
+        added, not_added = current_app.database.add_students(list(students.values()))
+        errors.update((indexes[index], message) for index, message in not_added.items())
+
+        data = {
+            "created": list({"index": indexes[index], "id": student_id} for index, student_id in added.items()),
+            "errors": list({"index": index, "message": errors[index]} for index in sorted(errors))
+        }
+        return {"data": data, "root_name": "result"}
+
+
+class StudentsExport(Resource):
+    """Contains a method for exporting all students with their group and courses ids in one streamed response"""
+    def get(self):
+        export_format = request.args.get("format", default=None)
+        if export_format is None:
+            # format by Accept header, NDJSON by default: the first of equally accepted types, e.g. for */*
+            mimetype = request.accept_mimetypes.best_match(["application/x-ndjson", "text/csv"])
+            export_format = "csv" if mimetype == "text/csv" else "ndjson"
+        if export_format not in EXPORT_FORMATS:
+            send_error_response(
+                400, f"Invalid format: '{export_format}', expected one of: {', '.join(EXPORT_FORMATS)}.")
+
+        mimetype, writer = EXPORT_FORMATS[export_format]
+        # rows are read with a separate connection while the response is streamed
+        response = Response(writer(current_app.database.export_students()), mimetype=mimetype)
+        response.headers["Content-Disposition"] = f"attachment; filename=students.{export_format}"
+        return response
+
+
 class StudentsDelete(Resource):
     """Contains a method for the student delete"""
     def delete(self, student_id: int):
@@ -69,15 +348,16 @@ class StudentsDelete(Resource):
 
 class StudentsByCourse(Resource):
     """Contain a method for getting all students related to the course with a given name"""
+    @conditional(*STUDENT_TABLES)
     def get(self, course_name):
         try:
-            data = get_data_with_pagination(
-                Student.get_complete_fields(),
+            page = get_data_with_pagination(
+                Student,
                 current_app.database.get_students_by_course,
                 course_name)
         except NoResultFound:
             send_error_response(404, f"Course named '{course_name}' not found")
-        return {"data": data, "root_name": "students"}
+        return dict(page, root_name="students")
 
 
 class StudentsAddToCourses(Resource):
@@ -87,19 +367,48 @@ class StudentsAddToCourses(Resource):
         if len(courses) == 0:
             send_error_response(404, f"Courses not listed")
 
-        try:
-            courses_list = []
-            for course_name in courses:
-                courses_list.append(current_app.database.get_course_by_name(course_name))
-        except NoResultFound:
-            send_error_response(404, f"Course named '{course_name}' not found")
+        course_ids = current_app.database.resolve_names(Course, courses)
+        for course_name in courses:
+            if course_name not in course_ids:
+                send_error_response(404, f"Course named '{course_name}' not found")
 
         try:
-            data = marshal(current_app.database.add_student_to_courses(student_id, courses_list),
-                           Student.get_complete_fields())
+            student = current_app.database.add_student_to_courses(student_id, list(course_ids.values()))
         except NoResultFound:
             send_error_response(404, f"Student with ID '{student_id}' does not exist.")
-        return {"data": data, "root_name": "student"}
+        return {"data": get_serializer(Student)(student), "root_name": "student"}
+
+
+class Enrollments(Resource):
+    """Contains a method for enrolling many students into many courses at once"""
+    def post(self):
+        enrollment = request.get_json(silent=True)
+        if not isinstance(enrollment, dict) or enrollment.keys() - {"courses", "students", "groups"}:
+            send_error_response(400, f"Invalid data fields: '{enrollment}'.")
+
+        courses = enrollment.get("courses", None)
+        students = enrollment.get("students", [])
+        groups = enrollment.get("groups", [])
+        if not is_list_of(courses, str) or len(courses) == 0:
+            send_error_response(400, "Field 'courses' must be a non-empty list of course names.")
+        if not is_list_of(students, int) or not is_list_of(groups, str) or len(students) + len(groups) == 0:
+            send_error_response(400, "Students ids list 'students' or group names list 'groups' expected.")
+
+        course_ids = current_app.database.resolve_names(Course, courses)
+        for course_name in courses:
+            if course_name not in course_ids:
+                send_error_response(404, f"Course named '{course_name}' not found")
+
+        group_ids = current_app.database.resolve_names(Group, groups)
+        for group_name in groups:
+            if group_name not in group_ids:
+                send_error_response(404, f"Group '{group_name}' does not exist.")
+
+        enrolled = current_app.database.enroll_students(
+            list(course_ids.values()),
+            student_ids=list(set(students)),
+            group_ids=list(group_ids.values()))
+        return {"data": {"enrolled": enrolled}, "root_name": "result"}
 
 
 class StudentsDeleteFromCourse(Resource):
@@ -109,14 +418,12 @@ class StudentsDeleteFromCourse(Resource):
         if course_name is None:
             send_error_response(404, f"Course not specified")
 
-        try:
-            course = current_app.database.get_course_by_name(course_name)
-        except NoResultFound:
+        course_id = current_app.database.resolve_names(Course, [course_name]).get(course_name, None)
+        if course_id is None:
             send_error_response(404, f"Course named '{course_name}' not found")
 
         try:
-            data = marshal(current_app.database.delete_student_from_course(student_id, course),
-                           Student.get_complete_fields())
+            data = get_serializer(Student)(current_app.database.delete_student_from_course(student_id, course_id))
         except ValueError:
             send_error_response(404, f"Student with ID '{student_id}' not assigned to course '{course_name}'.")
         except NoResultFound:
@@ -126,21 +433,27 @@ class StudentsDeleteFromCourse(Resource):
 
 class GroupsByCount(Resource):
     """Contains a method for finding all groups with less or equal student count."""
+    @conditional(*GROUP_TABLES)
     def get(self, count):
-        data = get_data_with_pagination(
-            Group.get_complete_fields(),
+        return self.get_groups(count)
+
+    @staticmethod
+    def get_groups(count):
+        page = get_data_with_pagination(
+            Group,
             current_app.database.get_groups_with_less_equals_students,
             count
         )
-        return {"data": data, "root_name": "groups"}
+        return dict(page, root_name="groups")
 
 
 class GroupsByGroup(GroupsByCount):
     """Contains a method for finding all groups with less or equal student count than in the given group"""
+    @conditional(*GROUP_TABLES)
     def get(self, group_name):
         try:
             # also check group with group_name exists
             group = current_app.database.get_group_by_name(group_name)
         except NoResultFound:
             send_error_response(404, f"Group '{group_name}' does not exist.")
-        return super().get(len(group.students))
+        return self.get_groups(group.student_count)
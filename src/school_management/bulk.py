@@ -0,0 +1,90 @@
+import csv
+from io import StringIO
+
+from sqlalchemy import Table, Column, select, func, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import DBAPIError
+
+# NULL marker for COPY, keeps empty strings distinct from NULL
+NULL = "\\N"
+
+
+class IdAllocator:
+    """
+    Allocates primary key values for bulk inserted rows, so the ids are known without reading them back
+    PostgreSQL sequences are used when the column has one, otherwise ids continue from the current maximum.
+    In this case the table is locked against other writers on PostgreSQL until the transaction ends,
+    so concurrent loaders don't get the same ids, on other databases the loader must be the only writer.
+    The allocator is used within one transaction of the connection
+
+    """
+    def __init__(self, connection: Connection, column: Column):
+        self.connection = connection
+        self.column = column
+        self.next_id = None
+
+    def allocate(self, qty: int) -> list:
+        """
+        Allocate qty ids
+        :param qty: ids quantity
+        :return: list of ids
+
+        """
+        if qty == 0:
+            return []
+
+        sequence = self.column.default
+        if self.connection.dialect.name == "postgresql" and sequence is not None and sequence.is_sequence:
+            stmt = select(func.nextval(sequence.name)).select_from(func.generate_series(1, qty))
+            return self.connection.execute(stmt).scalars().all()
+
+        if self.next_id is None:
+            if self.connection.dialect.name == "postgresql":
+                # SHARE ROW EXCLUSIVE conflicts with itself and with writes, reads are not blocked
+                table = self.connection.dialect.identifier_preparer.format_table(self.column.table)
+                self.connection.execute(text(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE"))
+            max_id = self.connection.execute(select(func.max(self.column))).scalar()
+            self.next_id = (max_id or 0) + 1
+
+        ids = list(range(self.next_id, self.next_id + qty))
+        self.next_id += qty
+        return ids
+
+
+def insert_rows(connection: Connection, table: Table, rows: list) -> int:
+    """
+    Insert rows into the table with a single round trip
+    COPY is used on PostgreSQL, executemany on other databases.
+    Database errors of COPY are raised as SQLAlchemy exceptions (e.g. IntegrityError), like the executed statements
+    :param connection: database connection
+    :param table: table to insert into
+    :param rows: list of dict like {column_name: value}, all rows must have the same keys
+    :return: inserted rows quantity
+
+    """
+    if len(rows) == 0:
+        return 0
+
+    columns = list(rows[0].keys())
+
+    if connection.dialect.name != "postgresql":
+        connection.execute(table.insert(), rows)
+        return len(rows)
+
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow((NULL if row[column] is None else row[column]) for column in columns)
+    buffer.seek(0)
+
+    statement = f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '{NULL}')"
+    dbapi = connection.dialect.dbapi
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(statement, buffer)
+    except dbapi.Error as error:
+        raise DBAPIError.instance(statement, None, error, dbapi.Error, dialect=connection.dialect) from error
+    finally:
+        cursor.close()
+
+    return len(rows)
@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Iterable
+
+
+class ReferenceCache:
+    """
+    Thread safe in-process cache with LRU eviction and time to live of entries
+    Used for rarely changed reference data like courses and groups
+
+    """
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        """
+        :param maxsize: maximum quantity of entries, the least recently used entries are evicted
+        :param ttl: entry time to live in seconds, 0 disables the cache
+
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_many(self, keys: Iterable[Hashable]) -> dict:
+        """
+        Get cached values
+        :param keys: keys
+        :return: dict {key: value} for found and not expired keys
+
+        """
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key, None)
+                if entry is None:
+                    continue
+                expires, value = entry
+                if expires <= now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = value
+        return found
+
+    def get(self, key: Hashable, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def set_many(self, values: dict) -> None:
+        """
+        Put values into the cache
+        :param values: dict {key: value}
+
+        """
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for key, value in values.items():
+                self._entries[key] = (expires, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def set(self, key: Hashable, value) -> None:
+        self.set_many({key: value})
+
+    def clear(self) -> None:
+        """Invalidate all entries"""
+        with self._lock:
+            self._entries.clear()
@@ -1,101 +1,616 @@
 import random
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack
+from typing import Iterator
 
-from sqlalchemy import create_engine, select, func
-from sqlalchemy.orm import sessionmaker, scoped_session, aliased
+from flask_restful import fields
+from sqlalchemy import create_engine, select, insert, update, delete, exists, true, or_, cast, func, inspect, text, \
+    event, bindparam, Integer, Table
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql.util import find_tables
+from sqlalchemy.exc import NoResultFound
+from sqlalchemy.orm import Session, sessionmaker, scoped_session, selectinload, joinedload, load_only, \
+    make_transient_to_detached
+from sqlalchemy.pool import QueuePool
 
-from .orm import Base, Group, Student, Course
+from .orm import Base, Group, Student, Course, AssignedCourse, TableVersion, GROUP_STUDENT_COUNT_DDL, \
+    TABLE_VERSION_DDL, TABLE_VERSION_TRIGGERS
+from .bulk import IdAllocator, insert_rows
+from .cache import ReferenceCache
 from .generators import (
     generate_groups,
     generate_students,
     generate_courses,
+    generate_groups_stream,
+    generate_students_stream,
+    GROUPS_QTY,
+    STUDENTS_QTY,
     GROUP_MIN_SIZE,
     GROUP_MAX_SIZE,
     MIN_COURSES_PER_STUDENT,
-    MAX_COURSES_PER_STUDENT
+    MAX_COURSES_PER_STUDENT,
+    BULK_CHUNK_SIZE
 )
 
+# QueuePool max_overflow default, reported by get_pool_status() when the option is not set
+DEFAULT_MAX_OVERFLOW = 10
+
+# reference data cache defaults
+REFERENCE_CACHE_SIZE = 1024
+REFERENCE_CACHE_TTL = 300.0
+
+# cached reference entities and their cached columns, groups.student_count changes too often to be cached
+REFERENCE_COLUMNS = {
+    Group: ("id", "name"),
+    Course: ("id", "name", "description")
+}
+
+# insert constructs with ON CONFLICT DO NOTHING support by dialect names
+UPSERT_DIALECTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert
+}
+
+# total count modes of paginated selects, see DataAccessLayer.count()
+COUNT_MODES = ("exact", "estimate")
+
+# rows quantity fetched at once by streaming selects
+STREAM_CHUNK_SIZE = 1000
+
+# relationship loader for every loading strategy, "none" keeps lazy loading
+LOADING_STRATEGIES = {
+    "selectin": selectinload,
+    "joined": joinedload,
+    "none": None
+}
+
+
+def get_loading_plan(entity, data_fields: dict, strategy: str = "selectin") -> list:
+    """
+    Build loader options for the marshalling fields: only the columns used by the fields are selected
+    and all relationships used by the fields are eager loaded,
+    so the related objects are loaded with a fixed number of queries instead of lazy loading per row
+    :param entity: ORM class the fields are applied to
+    :param data_fields: dict of fields for a response marshalling
+    :param strategy: loading strategy - "selectin", "joined" or "none"
+    :return: list of loader options for the select statement
+
+    """
+    loader = LOADING_STRATEGIES[strategy]
+    mapper = inspect(entity)
+    relationships = mapper.relationships
+
+    # primary key is required for identity and pagination, foreign keys - for loading of the relationships
+    columns = set(column.key for column in mapper.primary_key)
+    plan = []
+    for key, field in data_fields.items():
+        # a list is read by its own attribute, its container formats the items
+        attribute = key if field.attribute is None else field.attribute
+        if isinstance(field, fields.List):
+            field = field.container
+
+        if attribute in mapper.column_attrs:
+            columns.add(attribute)
+            continue
+        if attribute not in relationships:
+            # unknown attributes may use any column
+            columns = None
+            continue
+
+        relationship = relationships[attribute]
+        if columns is not None:
+            columns.update(mapper.get_property_by_column(column).key for column in relationship.local_columns)
+        if not isinstance(field, fields.Nested) or loader is None:
+            continue
+
+        option = loader(getattr(entity, attribute))
+        nested_plan = get_loading_plan(relationship.mapper.class_, field.nested, strategy)
+        if nested_plan:
+            option = option.options(*nested_plan)
+        plan.append(option)
+
+    if columns is not None and len(columns) < len(mapper.column_attrs):
+        plan.append(load_only(*(getattr(entity, column) for column in sorted(columns))))
+    return plan
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool which measures the time spent waiting for a free connection on checkouts,
+    the time of opening new connections is not included
+
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        # connections opening time of the current checkout in each thread, None out of a checkout
+        self._checkout = threading.local()
+        self.checkouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def _do_get(self):
+        if getattr(self._checkout, "connect_time", None) is not None:
+            # QueuePool retries the checkout by a recursive call
+            return super()._do_get()
+
+        self._checkout.connect_time = 0.0
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            wait_time = time.perf_counter() - start - self._checkout.connect_time
+            self._checkout.connect_time = None
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_time += wait_time
+                self.max_wait_time = max(self.max_wait_time, wait_time)
+
+    def _create_connection(self):
+        start = time.perf_counter()
+        try:
+            return super()._create_connection()
+        finally:
+            if getattr(self._checkout, "connect_time", None) is not None:
+                self._checkout.connect_time += time.perf_counter() - start
+
 
 class DataAccessLayer:
-    def __init__(self, connection_string):
+    def __init__(
+            self,
+            connection_string,
+            engine_options: dict = None,
+            cache_size: int = REFERENCE_CACHE_SIZE,
+            cache_ttl: float = REFERENCE_CACHE_TTL):
+        """
+        :param connection_string: database connection string
+        :param engine_options: create_engine() keyword arguments like pool_size, max_overflow, pool_timeout,
+            pool_recycle, pool_pre_ping and statement_timeout - PostgreSQL statement timeout in milliseconds
+        :param cache_size: maximum quantity of cached courses and groups, the same for cached totals
+        :param cache_ttl: courses, groups and totals cache time to live in seconds, 0 disables the caches
+
+        """
         self.engine = None
         self.Session = None
         self.connection_string = connection_string
+        self.engine_options = {} if engine_options is None else dict(engine_options)
+        self.reference_cache = ReferenceCache(cache_size, cache_ttl)
+        # keys contain data versions, so the entries expire only to free the memory
+        self.count_cache = ReferenceCache(cache_size, cache_ttl)
 
     @staticmethod
     def _execute_select_with_pagination(function):
         """Pagination decorator"""
-        def wrapper(self, *args, limit: int = 0, offset: int = 0, **kwargs):
+        def wrapper(
+                self,
+                *args,
+                limit: int = 0,
+                offset: int = 0,
+                after: int = None,
+                loading: list = None,
+                stream: bool = False,
+                total: str = None,
+                **kwargs):
             """
             Make select execution with pagination
             :param limit: - quantity of elements in the output
             :param offset: - offset for the output
+            :param after: - keyset pagination, output only elements with id greater than after, offset is ignored
+            :param loading: - relationship loader options, see get_loading_plan()
+            :param stream: - return an iterator fetching the result by STREAM_CHUNK_SIZE rows with a server side cursor,
+                joined loading of collections can't be used with it
+            :param total: - return the total quantity of elements instead of them, pagination is ignored,
+                see count() for the modes
             :return: query result
 
             """
-            stmt = function(self, *args, **kwargs).offset(offset)
+            stmt = function(self, *args, **kwargs)
+            if total is not None:
+                return self.count(stmt, total)
+            if after is None:
+                stmt = stmt.offset(offset)
+            else:
+                # all paginated selects are ordered by id, so the page starts right after the last seen id
+                entity = stmt.column_descriptions[0]["entity"]
+                stmt = stmt.where(entity.id > after)
             if limit > 0:
                 stmt = stmt.limit(limit)
-            return self.Session.execute(stmt).scalars().all()
+            if loading:
+                stmt = stmt.options(*loading)
+            if stream:
+                # eager loads are made for each fetched chunk
+                return self.Session.execute(stmt.execution_options(yield_per=STREAM_CHUNK_SIZE)).scalars()
+            # unique() is required by joined loading of collections
+            return self.Session.execute(stmt).scalars().unique().all()
 
         return wrapper
 
     def connect(self) -> None:
-        self.engine = create_engine(self.connection_string)
-        self.Session = scoped_session(sessionmaker(bind=self.engine))
+        """
+        Create the engine and the session factory, only PostgreSQL databases are supported:
+        groups students counters and tables data versions are maintained by PostgreSQL triggers,
+        without them students_by_group queries, ETags and cached totals would return wrong results
+
+        """
+        backend = make_url(self.connection_string).get_backend_name()
+        if backend != "postgresql":
+            raise ValueError(f"Unsupported database: '{backend}', PostgreSQL is required")
+
+        options = dict(self.engine_options)
+        statement_timeout = options.pop("statement_timeout", None)
+        if statement_timeout is not None:
+            # libpq options set by connect_args are kept
+            connect_args = options["connect_args"] = dict(options.get("connect_args", {}))
+            connect_args["options"] = " ".join(
+                item for item in (connect_args.get("options", ""), f"-c statement_timeout={int(statement_timeout)}")
+                if item)
+
+        options.setdefault("poolclass", InstrumentedQueuePool)
+
+        self.engine = create_engine(self.connection_string, **options)
+        session_factory = sessionmaker(bind=self.engine)
+        event.listen(session_factory, "after_flush", self._mark_reference_data_written)
+        event.listen(session_factory, "after_commit", self._invalidate_reference_cache_after_transaction)
+        event.listen(session_factory, "after_soft_rollback", self._invalidate_reference_cache_after_transaction)
+        self.Session = scoped_session(session_factory)
+
+    @staticmethod
+    def _mark_reference_data_written(session, flush_context) -> None:
+        """Mark the transaction writing courses or groups by the ORM, the cache is invalidated when it ends"""
+        if any(type(instance) in REFERENCE_COLUMNS for instance in (*session.new, *session.dirty, *session.deleted)):
+            session.info["reference_data_written"] = True
+
+    def _invalidate_reference_cache_after_transaction(self, session, *args) -> None:
+        """
+        Invalidate the reference data cache after the transaction writing courses or groups is committed
+        or rolled back, the transaction could cache its own uncommitted rows for the old data version
+
+        """
+        if session.info.pop("reference_data_written", False):
+            self.reference_cache.clear()
+
+    def count(self, stmt, mode: str = "exact") -> int:
+        """
+        Count rows of a select, counts are cached for the data versions of the tables used by the select
+        :param stmt: select
+        :param mode: "exact" - COUNT of the select,
+            "estimate" - PostgreSQL planner statistics for selects of a whole table, COUNT for other selects
+        :return: rows quantity
+
+        """
+        if mode not in COUNT_MODES:
+            raise ValueError(f"Unknown count mode: '{mode}'")
+
+        stmt = stmt.order_by(None)
+        tables = {table.name
+                  for table in find_tables(stmt, include_crud=False, include_aliases=True, check_columns=True)
+                  if isinstance(table, Table)}
+        compiled = stmt.compile(self.engine)
+        key = (str(compiled), tuple(sorted(compiled.params.items())), mode,
+               tuple(sorted(self.get_data_versions(tuple(tables)).items())))
+
+        total = self.count_cache.get(key, None)
+        if total is None:
+            total = None if mode == "exact" else self._estimate_count(stmt)
+            if total is None:
+                total = self.Session.execute(select(func.count()).select_from(stmt.subquery())).scalar()
+            self.count_cache.set(key, total)
+        return total
+
+    def _estimate_count(self, stmt) -> int | None:
+        """
+        Estimate rows quantity of a select of a whole table by PostgreSQL planner statistics
+        :param stmt: select
+        :return: estimated rows quantity, None if the select is filtered or the table has no statistics
+
+        """
+        froms = stmt.get_final_froms()
+        if self.engine.dialect.name != "postgresql" or stmt.whereclause is not None \
+                or len(froms) != 1 or not isinstance(froms[0], Table):
+            return None
+
+        # reltuples is -1 for tables never vacuumed or analyzed
+        reltuples = self.Session.execute(
+            text("SELECT reltuples FROM pg_class WHERE oid = CAST(:table AS regclass)"),
+            {"table": froms[0].name}
+        ).scalar()
+        if reltuples is None or reltuples < 0:
+            return None
+        return int(reltuples)
+
+    def get_pool_status(self) -> dict:
+        """
+        Get connection pool utilisation
+        :return: dict with the pool size, checked in, checked out and overflow connections quantity
+            and, for the instrumented pool, checkouts quantity, total and maximum time in seconds
+            waiting for a free connection, without opening new connections
+
+        """
+        pool = self.engine.pool
+        if not isinstance(pool, QueuePool):
+            return {"class": pool.__class__.__name__}
+
+        status = {
+            "class": pool.__class__.__name__,
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": max(pool.overflow(), 0),
+            "max_overflow": self.engine_options.get("max_overflow", DEFAULT_MAX_OVERFLOW)
+        }
+        if isinstance(pool, InstrumentedQueuePool):
+            status.update({
+                "checkouts": pool.checkouts,
+                "wait_time": pool.wait_time,
+                "max_wait_time": pool.max_wait_time
+            })
+        return status
+
+    def ping(self, timeout: float = None) -> None:
+        """
+        Check the database is available: check out a pool connection and execute SELECT 1
+        Raises SQLAlchemyError if the database is not available
+        :param timeout: PostgreSQL statement timeout in seconds, None - the engine statement timeout
+
+        """
+        with self.engine.connect() as connection:
+            with connection.begin():
+                if timeout is not None and connection.dialect.name == "postgresql":
+                    # the timeout is local to the transaction, the pooled connection keeps its own
+                    connection.execute(select(func.set_config("statement_timeout", f"{int(timeout * 1000)}", True)))
+                connection.execute(text("SELECT 1"))
+
+    def warm_up(self, connections: int = None) -> int:
+        """
+        Open pool connections before the first requests, the first connection also initializes the dialect
+        Connections are checked out together, so the pool keeps all of them
+        :param connections: connections quantity, None - the pool size, it's never exceeded
+        :return: opened connections quantity
+
+        """
+        size = self.get_pool_status().get("size", 1)
+        connections = size if connections is None else min(connections, size)
+        with ExitStack() as stack:
+            for _ in range(connections):
+                stack.enter_context(self.engine.connect())
+        return max(connections, 0)
 
     def remove_session(self) -> None:
         self.Session.remove()
 
     def create_tables(self) -> None:
+        """
+        Create missing tables and the table versions triggers, create_all() doesn't alter existing ones,
+        so a database created before groups.student_count is upgraded by repair_group_counts()
+
+        """
         Base.metadata.create_all(self.engine)
+        columns = set(column["name"] for column in inspect(self.engine).get_columns(Group.__tablename__))
+        if "student_count" not in columns:
+            self.repair_group_counts()
+
+        with self.engine.begin() as connection:
+            stmt = text("SELECT tgname FROM pg_trigger WHERE tgname IN :names").bindparams(
+                bindparam("names", expanding=True))
+            installed = set(connection.execute(stmt, {"names": list(TABLE_VERSION_TRIGGERS)}).scalars())
+            if installed != set(TABLE_VERSION_TRIGGERS):
+                for ddl in TABLE_VERSION_DDL:
+                    connection.execute(ddl)
+
+    def get_data_versions(self, tables: tuple) -> dict:
+        """
+        Get data versions of the tables, a version changes after each write to the table
+        :param tables: table names
+        :return: dict {table name: version}
+
+        """
+        stmt = select(TableVersion.table_name, TableVersion.version).where(TableVersion.table_name.in_(tables))
+        return dict(self.Session.execute(stmt).all())
+
+    def create_indexes(self) -> list:
+        """
+        Create indexes declared in the ORM schema which don't exist in the database.
+        Indexes are created one at a time with CREATE INDEX CONCURRENTLY out of a transaction,
+        so the tables stay writable while a live database is indexed. An invalid index left
+        by a failed concurrent build is dropped and created again
+        :return: names of the created indexes
+
+        """
+        created = []
+        with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            # a concurrent build of a large table outlasts the statement timeout of the application
+            connection.execute(text("SET statement_timeout = 0"))
+            try:
+                existing = self._get_database_indexes(connection)
+                invalid = self._get_invalid_indexes(connection)
+                for table in Base.metadata.sorted_tables:
+                    for index in sorted(table.indexes, key=lambda item: item.name):
+                        if index.name in invalid:
+                            connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"'))
+                        elif index.name in existing.get(table.name, set()):
+                            continue
+                        # the option is set for this statement only, create_all() creates indexes in a transaction
+                        options = index.dialect_options["postgresql"]
+                        options["concurrently"] = True
+                        try:
+                            index.create(connection)
+                        finally:
+                            options["concurrently"] = False
+                        created.append(index.name)
+            finally:
+                connection.execute(text("RESET statement_timeout"))
+        return created
+
+    def validate_indexes(self) -> dict:
+        """
+        Compare indexes declared in the ORM schema with the database indexes
+        Unique constraint and primary key indexes are not compared
+        :return: dict {"missing": [names of declared indexes not existing in the database],
+            "unexpected": [names of the database indexes not declared in the schema]}
+
+        """
+        with self.engine.connect() as connection:
+            existing = self._get_database_indexes(connection)
+
+        result = {"missing": [], "unexpected": []}
+        for table in Base.metadata.sorted_tables:
+            declared = set(index.name for index in table.indexes)
+            result["missing"].extend(sorted(declared - existing.get(table.name, set())))
+            result["unexpected"].extend(sorted(existing.get(table.name, set()) - declared))
+        return result
+
+    @staticmethod
+    def _get_invalid_indexes(connection) -> set:
+        """
+        Get names of invalid indexes, which are left by failed CREATE INDEX CONCURRENTLY and are not used by queries
+        :param connection: database connection
+        :return: set of index names
+
+        """
+        stmt = text("""
+            SELECT index_class.relname FROM pg_index
+            JOIN pg_class AS index_class ON index_class.oid = pg_index.indexrelid
+            WHERE NOT pg_index.indisvalid AND pg_table_is_visible(index_class.oid)
+        """)
+        return set(connection.execute(stmt).scalars())
+
+    @classmethod
+    def _get_database_indexes(cls, connection) -> dict:
+        """
+        Get names of existing valid indexes (except unique constraints) for all schema tables
+        :param connection: database connection
+        :return: dict {table name: set of index names}
+
+        """
+        invalid = cls._get_invalid_indexes(connection)
+        inspector = inspect(connection)
+        existing_tables = set(inspector.get_table_names())
+        indexes = {}
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            unique_constraints = set(item["name"] for item in inspector.get_unique_constraints(table.name))
+            indexes[table.name] = set(
+                item["name"] for item in inspector.get_indexes(table.name)
+                if item["name"] not in unique_constraints and item["name"] not in invalid
+            )
+        return indexes
+
+    def repair_group_counts(self) -> int:
+        """
+        Recount students of all groups and fix groups.student_count, on PostgreSQL also (re)creates
+        the column, its index and the triggers maintaining it, so the method also upgrades an existing database
+        :return: quantity of the fixed groups
+
+        """
+        with self.engine.begin() as connection:
+            if connection.dialect.name == "postgresql":
+                connection.execute(text(
+                    "ALTER TABLE groups ADD COLUMN IF NOT EXISTS student_count INTEGER NOT NULL DEFAULT 0"))
+                connection.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_groups_student_count ON groups (student_count)"))
+                for ddl in GROUP_STUDENT_COUNT_DDL:
+                    connection.execute(ddl)
+
+            actual_count = (
+                select(func.count(Student.id))
+                .where(Student.group_id == Group.id)
+                .scalar_subquery()
+            )
+            result = connection.execute(
+                update(Group.__table__)
+                .where(Group.student_count != actual_count)
+                .values(student_count=actual_count)
+            )
+        return result.rowcount
 
     def assign_students_to_groups(self, a: int = GROUP_MIN_SIZE, b: int = GROUP_MAX_SIZE) -> None:
         """
-        Randomly assigns students to groups. Each group could contain from a to b students
+        Randomly assigns students without a group to groups without students. Each group could contain from a to b students
         Some groups may be without students or students without groups
+        Assignment is made by one statement on the database side:
+        unassigned students are randomly numbered, each group gets a random size and takes
+        the next range of student numbers, the last range is shortened to the remaining students.
+        Requires PostgreSQL (generate_series)
 
         :param a: the minimal quantity of students in a group
         :param b: the maximum quantity of students in a group
         """
-        groups = self.Session.execute(select(Group)).scalars()
+        unassigned = (
+            select(Student.id.label("student_id"), func.row_number().over(order_by=func.random()).label("position"))
+            .where(Student.group_id.is_(None))
+        ).cte("unassigned")
 
-        for group in groups:
-            stmt = select(Student).filter_by(group=None)
-            unassigned_students = self.Session.execute(stmt).scalars().all()
+        # CTE with random() is materialized, so each group has the same size in all references
+        sizes = (
+            select(Group.id.label("group_id"), cast(a + func.floor(func.random() * (b - a + 1)), Integer).label("size"))
+            .where(~exists().where(Student.group_id == Group.id))
+        ).cte("sizes")
 
-            # group could contain from a members
-            if len(unassigned_students) < a:
-                break
-
-            random_students = random.sample(
-                unassigned_students, k=random.randint(
-                    a, min(
-                        b, len(unassigned_students))))
+        last_position = func.sum(sizes.c.size).over(order_by=sizes.c.group_id)
+        ranges = select(
+            sizes.c.group_id,
+            (last_position - sizes.c.size + 1).label("first_position"),
+            last_position.label("last_position")
+        ).subquery("ranges")
 
-            for student in random_students:
-                student.group = group
+        unassigned_qty = select(func.count()).select_from(unassigned).scalar_subquery()
 
-            self.Session.add_all(random_students)
-            self.Session.flush()
+        # one row for each place in a group, so students are matched to places by a hash join
+        places = (
+            select(
+                ranges.c.group_id,
+                func.generate_series(ranges.c.first_position, ranges.c.last_position).label("position")
+            )
+            # group could contain from a members
+            .where(ranges.c.first_position + a - 1 <= unassigned_qty)
+        ).subquery("places")
 
+        stmt = (
+            update(Student)
+            .where(Student.id == unassigned.c.student_id)
+            .where(unassigned.c.position == places.c.position)
+            .values(group_id=places.c.group_id)
+            .execution_options(synchronize_session=False)
+        )
+        self.Session.execute(stmt)
         self.Session.commit()
 
     def assign_courses_to_students(self, a: int = MIN_COURSES_PER_STUDENT, b: int = MAX_COURSES_PER_STUDENT) -> None:
         """
-         Randomly assigns from a to b courses for each student
+        Randomly assigns from a to b courses for each student without courses
         (from 1 to 3 by default).
+        Assignment is made by one INSERT ... SELECT statement on the database side:
+        each student gets a random courses quantity and the courses are randomly numbered for each student
         :param a: the minimal quantity of courses for a student
         :param b: the maximum quantity of courses for a student
 
         """
-        students = self.Session.execute(select(Student)).scalars()
-        courses = self.Session.execute(select(Course)).scalars().all()
+        # CTE with random() is materialized, so each student has the same courses quantity in all references
+        wanted = (
+            select(Student.id.label("student_id"), (a + func.floor(func.random() * (b - a + 1))).label("qty"))
+            .where(~Student.courses.any())
+        ).cte("wanted")
 
-        for student in students:
-            random_courses = random.sample(courses, k=random.randint(a, b))
-            student.courses.extend(random_courses)
+        ranked = (
+            select(
+                wanted.c.student_id,
+                wanted.c.qty,
+                Course.id.label("course_id"),
+                func.row_number().over(partition_by=wanted.c.student_id, order_by=func.random()).label("position")
+            )
+            .select_from(wanted)
+            .join(Course, true())
+        ).subquery("ranked")
 
-        self.Session.add_all(students)
+        stmt = insert(AssignedCourse).from_select(
+            ["student_id", "course_id"],
+            select(ranked.c.student_id, ranked.c.course_id).where(ranked.c.position <= ranked.c.qty)
+        )
+        self.Session.execute(stmt)
         self.Session.commit()
 
     def fill_database(self) -> dict:
@@ -122,9 +637,147 @@ class DataAccessLayer:
 
         return {"groups": groups, "students": students, "courses": courses}
 
+    def bulk_fill_database(
+            self,
+            students_qty: int = STUDENTS_QTY,
+            groups_qty: int = GROUPS_QTY,
+            seed: int = None,
+            chunk_size: int = BULK_CHUNK_SIZE) -> dict:
+        """
+        Fill the database with a large quantity of random generated data
+        Data is generated and loaded by chunks with bulk inserts (COPY on PostgreSQL),
+        memory usage doesn't depend on the data quantity.
+        Students are assigned to groups and courses with the same constraints as in fill_database()
+        Generated courses and group names are always the same, so the tables must be empty,
+        otherwise exception ValueError will be raised
+        :param students_qty: generated students quantity
+        :param groups_qty: generated groups quantity
+        :param seed: random seed, the same seed generates the same data
+        :param chunk_size: rows quantity loaded at once
+        :return: loaded rows quantity for each table
+
+        """
+        rng = random.Random(seed)
+        result = {"groups": 0, "students": 0, "courses": 0, "enrollments": 0}
+
+        with self.engine.begin() as connection:
+            filled = [table.name for table in (Group.__table__, Student.__table__, Course.__table__)
+                      if connection.execute(select(exists().select_from(table))).scalar()]
+            if filled:
+                raise ValueError(f"The database is not empty, bulk fill requires empty tables: {', '.join(filled)}")
+
+            group_ids = IdAllocator(connection, Group.__table__.c.id)
+            student_ids = IdAllocator(connection, Student.__table__.c.id)
+
+            courses = generate_courses()
+            for course, course_id in zip(courses, IdAllocator(connection, Course.__table__.c.id).allocate(len(courses))):
+                course["id"] = course_id
+            result["courses"] = insert_rows(connection, Course.__table__, courses)
+            course_ids = list(course["id"] for course in courses)
+
+            groups_stream = generate_groups_stream(groups_qty, chunk_size)
+            # ids of loaded groups without students yet
+            empty_groups = deque()
+
+            def load_groups_chunk() -> bool:
+                groups = next(groups_stream, None)
+                if groups is None:
+                    return False
+                for group, group_id in zip(groups, group_ids.allocate(len(groups))):
+                    group["id"] = group_id
+                result["groups"] += insert_rows(connection, Group.__table__, groups)
+                empty_groups.extend(group["id"] for group in groups)
+                return True
+
+            group_id = None
+            group_places = 0
+            unassigned = students_qty
+
+            for students in generate_students_stream(rng, students_qty, chunk_size):
+                enrollments = []
+                for student, student_id in zip(students, student_ids.allocate(len(students))):
+                    # fill groups one by one, like assign_students_to_groups()
+                    if group_places == 0:
+                        group_id = None
+                        if unassigned >= GROUP_MIN_SIZE and (empty_groups or load_groups_chunk()):
+                            group_id = empty_groups.popleft()
+                            group_places = rng.randint(GROUP_MIN_SIZE, min(GROUP_MAX_SIZE, unassigned))
+
+                    if group_id is not None:
+                        group_places -= 1
+                    unassigned -= 1
+
+                    student["id"] = student_id
+                    student["group_id"] = group_id
+                    enrollments.extend(
+                        {"student_id": student_id, "course_id": course_id}
+                        for course_id in rng.sample(
+                            course_ids, k=rng.randint(MIN_COURSES_PER_STUDENT, MAX_COURSES_PER_STUDENT)))
+
+                result["students"] += insert_rows(connection, Student.__table__, students)
+                result["enrollments"] += insert_rows(connection, AssignedCourse.__table__, enrollments)
+
+            # groups left without students
+            while load_groups_chunk():
+                empty_groups.clear()
+
+        self.reference_cache.clear()
+        return result
+
+    def _get_references(self, entity, names: list) -> dict:
+        """
+        Get cached columns of courses or groups by names
+        Entries are cached for the table data version, so writes of other processes and clients
+        are seen after their commit. Names missing in the cache are loaded with one query
+        :param entity: Course or Group
+        :param names: names
+        :return: dict {name: {column name: value}}, names which don't exist in the database are omitted
+
+        """
+        table_name = entity.__tablename__
+        version = self.get_data_versions((table_name,)).get(table_name, None)
+        found = self.reference_cache.get_many((table_name, version, name) for name in names)
+        result = {key[2]: value for key, value in found.items()}
+
+        missing = set(names) - result.keys()
+        if missing:
+            columns = list(getattr(entity, column) for column in REFERENCE_COLUMNS[entity])
+            loaded = {row.name: dict(row._mapping)
+                      for row in self.Session.execute(select(*columns).where(entity.name.in_(missing)))}
+            self.reference_cache.set_many({(table_name, version, name): value for name, value in loaded.items()})
+            result.update(loaded)
+
+        return result
+
+    def resolve_names(self, entity, names: list) -> dict:
+        """
+        Get ids of courses or groups by names, uses the reference data cache
+        :param entity: Course or Group
+        :param names: names
+        :return: dict {name: id}, names which don't exist in the database are omitted
+
+        """
+        return {name: value["id"] for name, value in self._get_references(entity, names).items()}
+
+    def get_courses_by_names(self, names: list) -> dict:
+        """
+        Get courses by names, uses the reference data cache
+        :param names: Course names
+        :return: dict {name: Course}, names which don't exist in the database are omitted
+
+        """
+        courses = {}
+        for name, values in self._get_references(Course, names).items():
+            course = Course(**values)
+            make_transient_to_detached(course)
+            # cached course becomes persistent in the current session without a query
+            courses[name] = self.Session.merge(course, load=False)
+        return courses
+
     def get_group_by_name(self, name: str) -> Group:
         """
         Get Group from database by name
+        Group is always read from the database to get the actual students count
         If a Group with the given name doesn't exist, exception NoResultFound will be raised
         :param name: Group name
         :return: Found Group
@@ -134,13 +787,16 @@ class DataAccessLayer:
 
     def get_course_by_name(self, name: str) -> Course:
         """
-        Get Course from database by name
+        Get Course by name, uses the reference data cache
         If a Course with the given name doesn't exist, exception NoResultFound will be raised
         :param name: Course name
         :return: Found Course
 
         """
-        return self.Session.execute(select(Course).where(Course.name == name)).one().Course
+        course = self.get_courses_by_names([name]).get(name, None)
+        if course is None:
+            raise NoResultFound(f"Course named '{name}' not found")
+        return course
 
     def get_student_by_id(self, student_id: int) -> Student:
         """
@@ -152,6 +808,21 @@ class DataAccessLayer:
         """
         return self.Session.execute(select(Student).where(Student.id == student_id)).one().Student
 
+    def get_complete_student_by_id(self, student_id: int) -> Student:
+        """
+        Get Student from database by id with the group and courses loaded by one joined select
+        If a Student with the given id doesn't exist, exception NoResultFound will be raised
+        :param student_id: Student id
+        :return: Found Student
+
+        """
+        stmt = (
+            select(Student)
+            .where(Student.id == student_id)
+            .options(*get_loading_plan(Student, Student.get_complete_fields(), "joined"))
+        )
+        return self.Session.execute(stmt).scalars().unique().one()
+
     def add_student(self, student: dict) -> Student:
         """
         Add student to the database
@@ -164,40 +835,174 @@ class DataAccessLayer:
         self.Session.commit()
         return new_student
 
-    def delete_student_by_id(self, student_id: int) -> None:
-        student = self.get_student_by_id(student_id)
-        self.Session.delete(student)
+    def add_students(self, students: list) -> tuple[dict, dict]:
+        """
+        Add students with one multi-row insert in one transaction, groups and courses are given by names
+        Students with unknown group or course names are not added, other students are added
+        :param students: list of dict like
+            {"first_name": first_name, "last_name": last_name, "group": group name, "courses": list of course names},
+            "group" and "courses" are optional
+        :return: tuple (dict {index in students: new student id}, dict {index in students: error message})
+
+        """
+        groups = self.resolve_names(Group, list({item["group"] for item in students if item.get("group")}))
+        courses = self.resolve_names(
+            Course, list({name for item in students for name in item.get("courses", None) or ()}))
+
+        errors = {}
+        valid = []
+        for index, item in enumerate(students):
+            group = item.get("group", None)
+            if group and group not in groups:
+                errors[index] = f"Group '{group}' does not exist."
+                continue
+            missing = list(name for name in item.get("courses", None) or () if name not in courses)
+            if missing:
+                errors[index] = f"Course named '{missing[0]}' not found"
+                continue
+            valid.append(index)
+
+        if len(valid) == 0:
+            return {}, errors
+
+        # ids are allocated before the insert, the order of rows returned by INSERT ... RETURNING is not guaranteed
+        ids = IdAllocator(self.Session.connection(), Student.__table__.c.id).allocate(len(valid))
+        added = dict(zip(valid, ids))
+        rows = list({"id": added[index],
+                     "first_name": students[index]["first_name"],
+                     "last_name": students[index]["last_name"],
+                     "group_id": groups.get(students[index].get("group", None), None)} for index in valid)
+        self.Session.execute(insert(Student).values(rows))
+
+        enrollments = list({"student_id": added[index], "course_id": courses[name]}
+                           for index in valid for name in dict.fromkeys(students[index].get("courses", None) or ()))
+        if enrollments:
+            self.Session.execute(insert(AssignedCourse).values(enrollments))
+
         self.Session.commit()
+        return added, errors
 
-    def add_student_to_courses(self, student_id: int, courses_list: list) -> Student:
+    def delete_student_by_id(self, student_id: int) -> None:
         """
-        Add student to the course from list
+        Delete student and his or her enrollments with DELETE statements, the student is not loaded
+        If a Student with the given id doesn't exist, exception NoResultFound will be raised
         :param student_id: Student id
-        :param courses_list: list of Course - courses
-        :return: Student
 
         """
-        student = self.get_student_by_id(student_id)
-        student.courses.extend(courses_list)
-        self.Session.add(student)
+        # the session is expired by the commit, so the deleted objects are not searched in the session
+        options = {"synchronize_session": False}
+        self.Session.execute(delete(AssignedCourse).where(AssignedCourse.student_id == student_id),
+                             execution_options=options)
+        stmt = delete(Student).where(Student.id == student_id)
+        if self.Session.execute(stmt, execution_options=options).rowcount == 0:
+            self.Session.rollback()
+            raise NoResultFound(f"Student with ID '{student_id}' does not exist.")
+
+        self.Session.commit()
+
+    def enroll_students(self, course_ids: list, student_ids: list = (), group_ids: list = ()) -> int:
+        """
+        Enroll students into courses with one INSERT ... SELECT statement, existing enrollments are kept
+        ON CONFLICT DO NOTHING makes it safe under concurrent enrollments, databases without it
+        skip existing enrollments with NOT EXISTS
+        Students and courses which don't exist are skipped
+        :param course_ids: ids of the courses
+        :param student_ids: ids of the students
+        :param group_ids: ids of the groups, all students of the groups are enrolled
+        :return: quantity of new enrollments
+
+        """
+        pairs = (
+            select(Student.id, Course.id)
+            .join(Course, true())
+            .where(Course.id.in_(course_ids))
+            .where(or_(Student.id.in_(student_ids), Student.group_id.in_(group_ids)))
+        )
+
+        dialect = self.engine.dialect.name
+        if dialect in UPSERT_DIALECTS:
+            stmt = (
+                UPSERT_DIALECTS[dialect](AssignedCourse)
+                .from_select(["student_id", "course_id"], pairs)
+                .on_conflict_do_nothing()
+            )
+        else:
+            pairs = pairs.where(~exists().where(
+                AssignedCourse.student_id == Student.id,
+                AssignedCourse.course_id == Course.id
+            ))
+            stmt = insert(AssignedCourse).from_select(["student_id", "course_id"], pairs)
+
+        enrolled = self.Session.execute(stmt).rowcount
         self.Session.commit()
+        return enrolled
+
+    def add_student_to_courses(self, student_id: int, course_ids: list) -> Student:
+        """
+        Add student to the courses from list, the student keeps the courses he or she is already assigned to
+        If a Student with the given id doesn't exist, exception NoResultFound will be raised
+        :param student_id: Student id
+        :param course_ids: list of the courses ids
+        :return: Student with group and courses loaded
 
-        return student
+        """
+        # a student who doesn't exist is not enrolled
+        self.enroll_students(course_ids, student_ids=[student_id])
+        return self.get_complete_student_by_id(student_id)
 
-    def delete_student_from_course(self, student_id: int, course: Course) -> Student:
+    def delete_student_from_course(self, student_id: int, course_id: int) -> Student:
         """
-        Delete student from the course
+        Delete student from the course with a DELETE statement, the student courses are not loaded
+        If a Student with the given id doesn't exist, exception NoResultFound will be raised,
+        if the student is not assigned to the course, exception ValueError will be raised
         :param student_id: Student id
-        :param course: course
-        :return: Student
+        :param course_id: Course id
+        :return: Student with group and courses loaded
 
         """
-        student = self.get_student_by_id(student_id)
-        student.courses.remove(course)
-        self.Session.add(student)
+        stmt = delete(AssignedCourse).where(
+            AssignedCourse.student_id == student_id,
+            AssignedCourse.course_id == course_id
+        )
+        if self.Session.execute(stmt, execution_options={"synchronize_session": False}).rowcount == 0:
+            self.Session.rollback()
+            # NoResultFound for a student who doesn't exist
+            self.get_student_by_id(student_id)
+            raise ValueError(f"Student with ID '{student_id}' not assigned to course with ID '{course_id}'.")
+
         self.Session.commit()
+        return self.get_complete_student_by_id(student_id)
 
-        return student
+    def export_students(self, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[tuple]:
+        """
+        Read all students with their courses ids in one pass with constant memory use
+        Students and enrollments are read by two server side cursors ordered by student id and merged,
+        both are read in one REPEATABLE READ transaction, so they are consistent
+        The connection is returned to the pool when the iterator is exhausted or closed
+        :param chunk_size: rows quantity fetched at once by each cursor
+        :return: iterator of tuples (id, first_name, last_name, group_id, list of course ids)
+
+        """
+        students = select(Student.id, Student.first_name, Student.last_name, Student.group_id).order_by(Student.id)
+        enrollments = (
+            select(AssignedCourse.student_id, AssignedCourse.course_id)
+            .order_by(AssignedCourse.student_id, AssignedCourse.course_id)
+        )
+
+        with self.engine.connect() as connection:
+            if connection.dialect.name == "postgresql":
+                connection = connection.execution_options(isolation_level="REPEATABLE READ")
+            connection = connection.execution_options(yield_per=chunk_size)
+            with connection.begin():
+                courses = iter(connection.execute(enrollments))
+                enrolled_id, course_id = next(courses, (None, None))
+                for student_id, first_name, last_name, group_id in connection.execute(students):
+                    course_ids = []
+                    # every enrollment has a student because of the foreign key, so no enrollment is skipped
+                    while enrolled_id == student_id:
+                        course_ids.append(course_id)
+                        enrolled_id, course_id = next(courses, (None, None))
+                    yield student_id, first_name, last_name, group_id, course_ids
 
     @_execute_select_with_pagination
     def get_students(self, *args, **kwargs) -> list:
@@ -211,19 +1016,12 @@ class DataAccessLayer:
     @_execute_select_with_pagination
     def get_groups_with_less_equals_students(self, count: int, *args, **kwargs) -> list:
         """
-        Get all groups with fewer or equal students count
+        Get all groups with fewer or equal students count, including groups without students
         :param count: students count
         :return: groups list
 
         """
-        sub = (
-            select([Group, func.count(Group.id).label("group_size")])
-            .join(Student.group)
-            .group_by(Group.id)
-        ).subquery()
-
-        groups = aliased(Group, sub, name="Group")
-        stmt = select(groups).where(sub.c.group_size <= count).order_by("id")
+        stmt = select(Group).where(Group.student_count <= count).order_by(Group.id)
         return stmt
 
     @_execute_select_with_pagination
@@ -1,58 +1,92 @@
-from io import BytesIO
-from xml.etree import ElementTree
+from itertools import chain
+from typing import Iterator, Iterable
 
+XML_DECLARATION = "<?xml version='1.0' encoding='utf-8'?>\n"
 
-def dict_to_element(data, root: ElementTree.Element = None, root_name: str = "root") -> ElementTree:
+
+def escape(text: str) -> str:
+    """
+    Escape xml element text
+    :param text: input text
+    :return: escaped text
+
+    """
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    return text
+
+
+def write_element(output: list, tag: str, data, level: int = 0, indent: str = "\t") -> None:
     """
-    Convert data to ElementTree.Element
+    Convert data to xml element, lists items are "item" elements, dict items are elements named by keys
+    :param output: list to append xml parts to
+    :param tag: element name
     :param data: input data
-    :param root: xml root element
-    :param root_name: name of root element
-    :return: (ElementTree)
+    :param level: element nesting level
+    :param indent: indentation of a nesting level, None - output without indentation
 
     """
-    if root is None:
-        root = ElementTree.Element(root_name)
-    if isinstance(data, list):
-        for item in data:
-            element = ElementTree.SubElement(root, "item")
-            if isinstance(item, list) or isinstance(item, dict):
-                dict_to_element(item, element)
-            else:
-                element.text = str(item)
+    if isinstance(data, list) or isinstance(data, dict):
+        if len(data) == 0:
+            output.append(f"<{tag} />")
+            return
 
-    elif isinstance(data, dict):
-        for key, value in data.items():
-            element = ElementTree.SubElement(root, str(key))
-            if isinstance(value, list) or isinstance(value, dict):
-                dict_to_element(value, element)
-            else:
-                element.text = str(value)
+        children = data.items() if isinstance(data, dict) else (("item", item) for item in data)
+        child_indentation = "" if indent is None else "\n" + indent * (level + 1)
+        output.append(f"<{tag}>")
+        for key, value in children:
+            output.append(child_indentation)
+            write_element(output, str(key), value, level + 1, indent)
+        closing_indentation = "" if indent is None else "\n" + indent * level
+        output.append(f"{closing_indentation}</{tag}>")
+        return
 
-    return ElementTree.ElementTree(root)
+    text = str(data)
+    output.append(f"<{tag}>{escape(text)}</{tag}>" if text else f"<{tag} />")
 
 
-def toXML(tree: ElementTree) -> bytes:
+def iter_xml(data, root_name: str = "root", indent: str = "\t") -> Iterator[str]:
     """
-    Convert ElementTree into xml
-    :param tree: input tree
-    :return: xml
+    Convert data to xml incrementally, one part for each root child.
+    The output is the same as ElementTree writes with an XML declaration after ElementTree.indent()
+    :param data: input data - list, dict or iterator of list items (e.g. rows read from the database)
+    :param root_name: name of root element
+    :param indent: indentation of a nesting level, None - output without indentation
+    :return: iterator of xml parts
 
     """
-    ElementTree.indent(tree, space="\t", level=0)
-    # using write instead tostring to add XML declaration
-    output = BytesIO()
-    tree.write(output, encoding="utf-8", xml_declaration=True)
-    return output.getvalue()
+    if isinstance(data, dict):
+        children = iter(data.items())
+    elif isinstance(data, Iterable) and not isinstance(data, str):
+        children = (("item", item) for item in data)
+    else:
+        children = iter(())
+
+    first = next(children, None)
+    if first is None:
+        yield f"{XML_DECLARATION}<{root_name} />"
+        return
+
+    child_indentation = "" if indent is None else "\n" + indent
+    yield f"{XML_DECLARATION}<{root_name}>"
+    for key, value in chain([first], children):
+        output = [child_indentation]
+        write_element(output, str(key), value, 1, indent)
+        yield "".join(output)
+    yield f"</{root_name}>" if indent is None else f"\n</{root_name}>"
 
 
-def dict_to_xml(data, root_name: str = "root") -> bytes:
+def dict_to_xml(data, root_name: str = "root", indent: str = "\t") -> bytes:
     """
     Convert data to xml string
     :param data: input data
     :param root_name: name of root element
+    :param indent: indentation of a nesting level, None - output without indentation
     :return: xml string
 
     """
-    tree = dict_to_element(data, root_name=root_name)
-    return toXML(tree)
+    return "".join(iter_xml(data, root_name, indent)).encode("utf-8")
@@ -0,0 +1,63 @@
+import csv
+import json
+from io import StringIO
+from typing import Iterator, Iterable
+
+# exported student columns, courses are a list of ids
+STUDENT_EXPORT_COLUMNS = ("id", "first_name", "last_name", "group_id", "course_ids")
+
+# rows quantity joined into one chunk of the streamed export
+EXPORT_CHUNK_ROWS = 1000
+
+
+def iter_ndjson(rows: Iterable[tuple], columns: tuple = STUDENT_EXPORT_COLUMNS) -> Iterator[str]:
+    """
+    Write rows as NDJSON - a JSON object per line
+    :param rows: rows - tuples of the columns values
+    :param columns: column names
+    :return: iterator of chunks of EXPORT_CHUNK_ROWS lines
+
+    """
+    chunk = []
+    for row in rows:
+        chunk.append(json.dumps(dict(zip(columns, row)), separators=(",", ":")))
+        if len(chunk) == EXPORT_CHUNK_ROWS:
+            chunk.append("")
+            yield "\n".join(chunk)
+            chunk = []
+    if chunk:
+        chunk.append("")
+        yield "\n".join(chunk)
+
+
+def iter_csv(rows: Iterable[tuple], columns: tuple = STUDENT_EXPORT_COLUMNS) -> Iterator[str]:
+    """
+    Write rows as CSV with a header, list values are written as space separated items
+    :param rows: rows - tuples of the columns values
+    :param columns: column names
+    :return: iterator of chunks of EXPORT_CHUNK_ROWS lines
+
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(columns)
+
+    lines = 0
+    for row in rows:
+        writer.writerow(" ".join(map(str, value)) if isinstance(value, list) else value for value in row)
+        lines += 1
+        if lines == EXPORT_CHUNK_ROWS:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            lines = 0
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+# export formats: (mimetype, writer)
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", iter_ndjson),
+    "csv": ("text/csv", iter_csv)
+}
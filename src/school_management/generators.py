@@ -1,5 +1,6 @@
 import random
 import string
+from typing import Iterator
 
 GROUPS_QTY = 10
 STUDENTS_QTY = 200
@@ -10,6 +11,9 @@ GROUP_MAX_SIZE = 30
 MIN_COURSES_PER_STUDENT = 1
 MAX_COURSES_PER_STUDENT = 3
 
+# rows quantity generated and loaded at once by the bulk loader
+BULK_CHUNK_SIZE = 10000
+
 student_first_names = [
     "James",
     "John",
@@ -95,9 +99,11 @@ def generate_random_list(generator, *args, k: int = 0) -> list:
 
     """
     result = []
+    generated = set()
     while len(result) < k:
         item = generator(*args)
-        if not(item in result):
+        if item not in generated:
+            generated.add(item)
             result.append(item)
 
     return result
@@ -144,3 +150,55 @@ def generate_courses(courses_list: list = None) -> list:
 
     return list({"name": item[0], "description": item[1]}
                 for item in courses_list)
+
+
+def generate_bulk_group_name(index: int) -> str:
+    """
+    Generate a unique group name like LL_DD for the group number index,
+    numbers get more digits after all 67600 LL_DD names are used
+    :param index: group number
+    :return: group name
+
+    """
+    letters = string.ascii_uppercase
+    prefix = letters[index // len(letters) % len(letters)] + letters[index % len(letters)]
+    return f"{prefix}_{index // len(letters) ** 2:02d}"
+
+
+def generate_groups_stream(qty: int = GROUPS_QTY, chunk_size: int = BULK_CHUNK_SIZE) -> Iterator[list]:
+    """
+    Generate qty groups with unique names by chunks
+    :param qty: generated groups quantity
+    :param chunk_size: groups quantity in a chunk
+    :return: iterator of lists of dict like {"name": group_name}
+
+    """
+    for start in range(0, qty, chunk_size):
+        yield list({"name": generate_bulk_group_name(index)}
+                   for index in range(start, min(start + chunk_size, qty)))
+
+
+def generate_students_stream(
+        rng: random.Random,
+        qty: int = STUDENTS_QTY,
+        chunk_size: int = BULK_CHUNK_SIZE,
+        first_names: list = None,
+        last_names: list = None) -> Iterator[list]:
+    """
+    Generate qty students with random names by chunks, names are not unique
+    :param rng: random generator, seeded for reproducible data
+    :param qty: generated students quantity
+    :param chunk_size: students quantity in a chunk
+    :param first_names: list with available first names
+    :param last_names: list with available second names
+    :return: iterator of lists of dict like {"first_name": first_name, "last_name", last_name}
+
+    """
+    if first_names is None:
+        first_names = student_first_names
+    if last_names is None:
+        last_names = student_last_names
+
+    for start in range(0, qty, chunk_size):
+        yield list({"first_name": rng.choice(first_names), "last_name": rng.choice(last_names)}
+                   for _ in range(min(chunk_size, qty - start)))
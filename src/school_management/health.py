@@ -0,0 +1,77 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from flask import Flask, current_app, jsonify
+from sqlalchemy.exc import SQLAlchemyError
+
+# seconds to wait for the database answer
+READINESS_TIMEOUT = 2.0
+
+# seconds the readiness check result is reused, so frequent probes don't load the database
+READINESS_CACHE_TTL = 1.0
+
+
+class HealthChecks:
+    """
+    Liveness (/healthz) and readiness (/readyz) endpoints for probes
+    Liveness only shows the process serves requests, without any I/O.
+    Readiness checks out a pool connection and executes SELECT 1 within the timeout,
+    the result is cached for a short time, concurrent probes wait for the same check
+
+    """
+    def __init__(self, timeout: float = READINESS_TIMEOUT, cache_ttl: float = READINESS_CACHE_TTL):
+        """
+        :param timeout: seconds to wait for the pool checkout and the database answer
+        :param cache_ttl: seconds the check result is reused, 0 - each probe checks the database
+
+        """
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.lock = threading.Lock()
+        # a check waiting for an exhausted pool or a dead database is not repeated by each probe
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="readiness")
+        self.future = None
+        self.result = None
+        self.checked = 0.0
+
+    def init_app(self, app: Flask) -> None:
+        app.add_url_rule("/healthz", "healthz", self.healthz)
+        app.add_url_rule("/readyz", "readyz", self.readyz)
+
+    @staticmethod
+    def healthz():
+        return jsonify(status="ok")
+
+    def readyz(self):
+        error = self.check()
+        if error is not None:
+            return jsonify(status="unavailable", error=error), 503
+        return jsonify(status="ready")
+
+    def check(self) -> str | None:
+        """
+        Check the database is available, the result is cached for cache_ttl seconds
+        :return: None if the database is available, error description otherwise
+
+        """
+        database = current_app.database
+        with self.lock:
+            if self.result is not None and time.monotonic() - self.checked < self.cache_ttl:
+                return self.result[0]
+            if self.future is None or self.future.done():
+                self.future = self.executor.submit(database.ping, self.timeout)
+            future = self.future
+
+        try:
+            future.result(self.timeout)
+            error = None
+        except TimeoutError:
+            error = f"Database did not answer in {self.timeout} s."
+        except SQLAlchemyError as exception:
+            error = f"Database error: {exception.__class__.__name__}."
+
+        with self.lock:
+            self.result = (error,)
+            self.checked = time.monotonic()
+        return error
@@ -0,0 +1,291 @@
+import csv
+import json
+import os
+import time
+from itertools import islice
+from typing import Callable, Iterator
+
+from sqlalchemy import Table, Column, MetaData, Integer, select, text
+from sqlalchemy.engine import Connection
+
+from .db import DataAccessLayer, UPSERT_DIALECTS
+from .orm import Group, Course, Student, AssignedCourse
+from .bulk import IdAllocator, insert_rows
+from .generators import BULK_CHUNK_SIZE
+
+# separator of list values (student courses) in CSV files
+CSV_LIST_SEPARATOR = ";"
+
+# imported data kinds in the import order: (required columns, optional columns)
+IMPORT_COLUMNS = {
+    "groups": (("name",), ()),
+    "courses": (("name",), ("description",)),
+    "students": (("first_name", "last_name"), ("group", "courses")),
+    "enrollments": (("student_id", "course"), ())
+}
+
+# enrollments of a batch are copied to a temporary table on PostgreSQL, existing enrollments are skipped on insert
+IMPORTED_ENROLLMENTS = Table(
+    "imported_enrollments", MetaData(),
+    Column("student_id", Integer),
+    Column("course_id", Integer)
+)
+
+# file formats by file extensions
+FILE_FORMATS = {
+    ".csv": "csv",
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson"
+}
+
+
+class ImportDataError(ValueError):
+    """Invalid imported data, the message contains the file and line"""
+
+
+def get_file_format(path: str, file_format: str = None) -> str:
+    """
+    Get the imported file format
+    :param path: file path
+    :param file_format: "csv" or "ndjson", None - by the file extension
+    :return: file format
+
+    """
+    if file_format is None:
+        file_format = FILE_FORMATS.get(os.path.splitext(path)[1].lower(), None)
+    if file_format not in FILE_FORMATS.values():
+        raise ImportDataError(f"{path}: unknown file format, use .csv, .ndjson or .jsonl file or set the format")
+    return file_format
+
+
+def read_rows(path: str, file_format: str = None) -> Iterator[tuple[int, dict]]:
+    """
+    Read rows of a CSV file with a header or a NDJSON file - a JSON object per line, empty lines are skipped
+    Each CSV row must have a value for each header column, list values are separated by CSV_LIST_SEPARATOR
+    :param path: file path
+    :param file_format: "csv" or "ndjson", None - by the file extension
+    :return: iterator of tuples (line number, dict {column: value})
+
+    """
+    file_format = get_file_format(path, file_format)
+    with open(path, newline="", encoding="utf-8") as file:
+        if file_format == "csv":
+            reader = csv.DictReader(file)
+            for row in reader:
+                # DictReader sets missing values of a short row to None and puts extra values under None key
+                if None in row or None in row.values():
+                    raise ImportDataError(
+                        f"{path}:{reader.line_num}: {len(reader.fieldnames)} values expected by the header")
+                yield reader.line_num, {key: value for key, value in row.items() if value != ""}
+            return
+
+        for number, line in enumerate(file, start=1):
+            if line.strip() == "":
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as error:
+                raise ImportDataError(f"{path}:{number}: invalid JSON: {error.msg}") from error
+            if not isinstance(row, dict):
+                raise ImportDataError(f"{path}:{number}: JSON object expected")
+            yield number, {key: value for key, value in row.items() if value is not None and value != ""}
+
+
+class Importer:
+    """
+    Loads groups, courses, students and enrollments from files by batches, each batch is one transaction
+    (rows are inserted with COPY on PostgreSQL, executemany on other databases).
+    Groups and courses are referenced by names, which are resolved with in-memory maps.
+    Committed rows quantity of each file is saved in a checkpoint file after each batch,
+    so an import continues after the last committed batch when it's run again after a failure
+
+    """
+    def __init__(
+            self,
+            db: DataAccessLayer,
+            batch_size: int = BULK_CHUNK_SIZE,
+            checkpoint_path: str = None,
+            report: Callable = None):
+        """
+        :param db: connected DataAccessLayer
+        :param batch_size: rows quantity imported in one transaction
+        :param checkpoint_path: checkpoint file path, None - the import is not resumable
+        :param report: function called after each batch with arguments
+            (data kind, imported rows quantity, batch rows quantity, batch time in seconds)
+
+        """
+        self.db = db
+        self.batch_size = batch_size
+        self.checkpoint_path = checkpoint_path
+        self.report = report
+        self.checkpoint = self._load_checkpoint()
+        self.groups = None
+        self.courses = None
+
+    def _load_checkpoint(self) -> dict:
+        if self.checkpoint_path is None or not os.path.exists(self.checkpoint_path):
+            return {}
+        with open(self.checkpoint_path, encoding="utf-8") as file:
+            return json.load(file)
+
+    def _save_checkpoint(self) -> None:
+        if self.checkpoint_path is None:
+            return
+        # the checkpoint is replaced at once, so a failure doesn't leave a broken file
+        temporary_path = f"{self.checkpoint_path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(self.checkpoint, file)
+        os.replace(temporary_path, self.checkpoint_path)
+
+    def remove_checkpoint(self) -> None:
+        """Remove the checkpoint file after a completed import"""
+        self.checkpoint = {}
+        if self.checkpoint_path is not None and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def _load_names(self) -> None:
+        """Load maps of existing groups and courses names to ids"""
+        with self.db.engine.connect() as connection:
+            self.groups = dict(connection.execute(select(Group.name, Group.id)).all())
+            self.courses = dict(connection.execute(select(Course.name, Course.id)).all())
+
+    def import_file(self, kind: str, path: str, file_format: str = None) -> int:
+        """
+        Import a file, rows committed by a previous run with the same checkpoint are skipped
+        :param kind: data kind - "groups", "courses", "students" or "enrollments"
+        :param path: file path
+        :param file_format: "csv" or "ndjson", None - by the file extension
+        :return: quantity of rows read from the file by this and previous runs
+
+        """
+        if kind not in IMPORT_COLUMNS:
+            raise ValueError(f"Unknown data kind: '{kind}', expected one of: {', '.join(IMPORT_COLUMNS)}")
+        if self.groups is None:
+            self._load_names()
+
+        path = os.path.abspath(path)
+        state = self.checkpoint.get(kind, None)
+        if state is None or state["path"] != path:
+            state = self.checkpoint[kind] = {"path": path, "rows": 0}
+
+        rows = islice(read_rows(path, file_format), state["rows"], None)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if len(batch) == 0:
+                return state["rows"]
+
+            start = time.perf_counter()
+            names = {}
+            with self.db.engine.begin() as connection:
+                getattr(self, f"_import_{kind}")(connection, path, batch, names)
+            # names of new groups and courses are used after the commit only
+            if kind == "groups":
+                self.groups.update(names)
+            elif kind == "courses":
+                self.courses.update(names)
+
+            state["rows"] += len(batch)
+            self._save_checkpoint()
+            if self.report is not None:
+                self.report(kind, state["rows"], len(batch), time.perf_counter() - start)
+
+    @staticmethod
+    def _get_values(path: str, number: int, row: dict, kind: str) -> dict:
+        """
+        Check the row columns
+        :return: dict with required and optional columns, missing optional columns are None
+
+        """
+        required, optional = IMPORT_COLUMNS[kind]
+        missing = list(column for column in required if column not in row)
+        if missing:
+            raise ImportDataError(f"{path}:{number}: missing {', '.join(missing)}")
+        return {column: row.get(column, None) for column in required + optional}
+
+    def _import_names(self, connection: Connection, path: str, batch: list, names: dict, entity) -> None:
+        """Import groups or courses, existing names are skipped"""
+        existing = self.groups if entity is Group else self.courses
+        kind = entity.__tablename__
+
+        new_rows = {}
+        for number, row in batch:
+            values = self._get_values(path, number, row, kind)
+            if values["name"] not in existing and values["name"] not in new_rows:
+                new_rows[values["name"]] = values
+
+        rows = list(new_rows.values())
+        for values, new_id in zip(rows, IdAllocator(connection, entity.__table__.c.id).allocate(len(rows))):
+            values["id"] = new_id
+            names[values["name"]] = new_id
+        insert_rows(connection, entity.__table__, rows)
+
+    def _import_groups(self, connection: Connection, path: str, batch: list, names: dict) -> None:
+        self._import_names(connection, path, batch, names, Group)
+
+    def _import_courses(self, connection: Connection, path: str, batch: list, names: dict) -> None:
+        self._import_names(connection, path, batch, names, Course)
+
+    def _get_course_id(self, path: str, number: int, name: str) -> int:
+        course_id = self.courses.get(name, None)
+        if course_id is None:
+            raise ImportDataError(f"{path}:{number}: course named '{name}' not found")
+        return course_id
+
+    def _import_students(self, connection: Connection, path: str, batch: list, names: dict) -> None:
+        students = []
+        enrollments = []
+        student_ids = IdAllocator(connection, Student.__table__.c.id).allocate(len(batch))
+        for (number, row), student_id in zip(batch, student_ids):
+            values = self._get_values(path, number, row, "students")
+
+            group_id = None
+            if values["group"] is not None:
+                group_id = self.groups.get(values["group"], None)
+                if group_id is None:
+                    raise ImportDataError(f"{path}:{number}: group '{values['group']}' does not exist")
+
+            courses = values["courses"] or []
+            if isinstance(courses, str):
+                courses = list(name.strip() for name in courses.split(CSV_LIST_SEPARATOR) if name.strip())
+            for name in dict.fromkeys(courses):
+                enrollments.append({"student_id": student_id, "course_id": self._get_course_id(path, number, name)})
+
+            students.append({
+                "id": student_id,
+                "group_id": group_id,
+                "first_name": values["first_name"],
+                "last_name": values["last_name"]
+            })
+
+        insert_rows(connection, Student.__table__, students)
+        insert_rows(connection, AssignedCourse.__table__, enrollments)
+
+    def _import_enrollments(self, connection: Connection, path: str, batch: list, names: dict) -> None:
+        enrollments = []
+        for number, row in batch:
+            values = self._get_values(path, number, row, "enrollments")
+            try:
+                student_id = int(values["student_id"])
+            except ValueError as error:
+                raise ImportDataError(f"{path}:{number}: invalid student_id '{values['student_id']}'") from error
+            enrollments.append({"student_id": student_id,
+                                "course_id": self._get_course_id(path, number, values["course"])})
+
+        # existing enrollments are skipped, like enroll_students() does,
+        # so enrollments imported by other ways or repeated in the file don't stop the import
+        dialect = connection.dialect.name
+        if dialect == "postgresql":
+            connection.execute(text(
+                f"CREATE TEMPORARY TABLE {IMPORTED_ENROLLMENTS.name} (student_id INTEGER, course_id INTEGER) "
+                f"ON COMMIT DROP"))
+            insert_rows(connection, IMPORTED_ENROLLMENTS, enrollments)
+            connection.execute(
+                UPSERT_DIALECTS[dialect](AssignedCourse.__table__)
+                .from_select(["student_id", "course_id"],
+                             select(IMPORTED_ENROLLMENTS.c.student_id, IMPORTED_ENROLLMENTS.c.course_id).distinct())
+                .on_conflict_do_nothing()
+            )
+        elif dialect in UPSERT_DIALECTS:
+            connection.execute(UPSERT_DIALECTS[dialect](AssignedCourse.__table__).on_conflict_do_nothing(), enrollments)
+        else:
+            insert_rows(connection, AssignedCourse.__table__, enrollments)
@@ -0,0 +1,195 @@
+import json
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator
+
+from flask import Flask, Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# a statement executed more times in one request is reported as a possible N+1 query
+REPEATED_STATEMENT_THRESHOLD = 10
+
+# length of statements written to the log
+LOGGED_STATEMENT_LENGTH = 200
+
+logger = logging.getLogger("school_management.requests")
+
+
+class RequestMetrics:
+    """SQL statements, database time and serialization time of one request"""
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.statements = 0
+        self.db_time = 0.0
+        self.serialization_time = 0.0
+        self.status = None
+        # statements with bound parameters placeholders, so the same query with other values has the same shape
+        self.shapes = Counter()
+
+    def add_statement(self, statement: str, duration: float) -> None:
+        self.statements += 1
+        self.db_time += duration
+        self.shapes[statement] += 1
+
+    def get_repeated(self, threshold: int) -> list:
+        """
+        Get statements executed more than threshold times
+        :param threshold: maximal executions of the same statement
+        :return: list of tuples (statement, executions quantity), the most repeated first
+
+        """
+        return list((statement, qty) for statement, qty in self.shapes.most_common() if qty > threshold)
+
+    def get_server_timing(self, threshold: int) -> str:
+        """
+        Make Server-Timing header value, times are in milliseconds
+        Streamed responses are read and serialized after the header is sent, they are only in the log
+        :param threshold: maximal executions of the same statement
+        :return: header value
+
+        """
+        metrics = [
+            f'db;dur={self.db_time * 1000:.2f};desc="{self.statements} statements"',
+            f"serialize;dur={self.serialization_time * 1000:.2f}",
+            f"total;dur={(time.perf_counter() - self.start) * 1000:.2f}"
+        ]
+        repeated = self.get_repeated(threshold)
+        if repeated:
+            metrics.append(f'repeated;desc="statement executed {repeated[0][1]} times"')
+        return ", ".join(metrics)
+
+
+def get_request_metrics() -> RequestMetrics | None:
+    """Get metrics of the current request, None outside of an instrumented request"""
+    if not has_request_context():
+        return None
+    return g.get("request_metrics", None)
+
+
+@contextmanager
+def measure_serialization():
+    """
+    Add the block time to the request serialization time,
+    statements executed in the block (lazy loads, streamed rows fetching) are counted as database time only
+
+    """
+    metrics = get_request_metrics()
+    if metrics is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    db_time = metrics.db_time
+    try:
+        yield
+    finally:
+        metrics.serialization_time += time.perf_counter() - start - (metrics.db_time - db_time)
+
+
+def iter_measured(parts: Iterator) -> Iterator:
+    """
+    Add the time of producing each part of a streamed response to the request serialization time
+    :param parts: iterator of response parts
+    :return: iterator of the same parts
+
+    """
+    iterator = iter(parts)
+    while True:
+        with measure_serialization():
+            part = next(iterator, None)
+        if part is None:
+            return
+        yield part
+
+
+class RequestInstrumentation:
+    """
+    Counts SQL statements, database time and serialization time of each request,
+    sends them in the Server-Timing header and writes a JSON log line for each request.
+    A request executing the same statement more than repeated_threshold times is logged as a warning,
+    it's usually a lazy load of a relationship in a loop (N+1 queries)
+
+    """
+    def __init__(
+            self,
+            server_timing: bool = True,
+            request_log: bool = True,
+            repeated_threshold: int = REPEATED_STATEMENT_THRESHOLD):
+        """
+        :param server_timing: send Server-Timing header
+        :param request_log: log each request, requests with repeated statements are logged anyway
+        :param repeated_threshold: maximal executions of the same statement in one request
+
+        """
+        self.server_timing = server_timing
+        self.request_log = request_log
+        self.repeated_threshold = repeated_threshold
+
+    def init_app(self, app: Flask) -> None:
+        app.before_request(self.start_request)
+        app.after_request(self.add_server_timing)
+        # streamed responses keep the request context, so the request is finished after the streaming
+        app.teardown_request(self.finish_request)
+
+    @staticmethod
+    def instrument_engine(engine: Engine) -> None:
+        """Count statements executed by the engine in instrumented requests"""
+        if not event.contains(engine, "before_cursor_execute", before_cursor_execute):
+            event.listen(engine, "before_cursor_execute", before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+    @staticmethod
+    def start_request() -> None:
+        g.request_metrics = RequestMetrics()
+
+    def add_server_timing(self, response: Response) -> Response:
+        metrics = get_request_metrics()
+        if metrics is None:
+            return response
+        metrics.status = response.status_code
+        if self.server_timing:
+            response.headers["Server-Timing"] = metrics.get_server_timing(self.repeated_threshold)
+        return response
+
+    def finish_request(self, exception=None) -> None:
+        metrics = g.pop("request_metrics", None)
+        if metrics is None:
+            return
+
+        repeated = metrics.get_repeated(self.repeated_threshold)
+        if not repeated and not self.request_log:
+            return
+
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "status": metrics.status,
+            "duration_ms": round((time.perf_counter() - metrics.start) * 1000, 2),
+            "statements": metrics.statements,
+            "db_ms": round(metrics.db_time * 1000, 2),
+            "serialize_ms": round(metrics.serialization_time * 1000, 2)
+        }
+        if exception is not None:
+            record["error"] = type(exception).__name__
+        if repeated:
+            record["repeated"] = list({"statement": statement[:LOGGED_STATEMENT_LENGTH], "count": qty}
+                                      for statement, qty in repeated)
+            logger.warning(json.dumps(record))
+        else:
+            logger.info(json.dumps(record))
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.instrumentation_start = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics = get_request_metrics()
+    start = getattr(context, "instrumentation_start", None)
+    if metrics is not None and start is not None:
+        metrics.add_statement(statement, time.perf_counter() - start)
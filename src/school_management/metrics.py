@@ -0,0 +1,122 @@
+import os
+import time
+
+from flask import Flask, Response, current_app, g, request
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, \
+    generate_latest, multiprocess
+
+# request duration histogram buckets, seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# response size histogram buckets, bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# resource label of requests which don't match any route
+UNMATCHED_RESOURCE = "none"
+
+
+def is_multiprocess() -> bool:
+    """Metrics of gunicorn workers are written to files in PROMETHEUS_MULTIPROC_DIR and aggregated on scrape"""
+    return "PROMETHEUS_MULTIPROC_DIR" in os.environ or "prometheus_multiproc_dir" in os.environ
+
+
+class PrometheusMetrics:
+    """
+    Collects request counters, latency and response size histograms per flask_restful resource,
+    response codes and database connection pool utilisation, exposes them at /metrics in Prometheus text format.
+    With several worker processes the environment variable PROMETHEUS_MULTIPROC_DIR must be set
+    before the application is imported, the values of all workers are aggregated by each scrape
+
+    """
+    def __init__(self, registry: CollectorRegistry = REGISTRY):
+        self.requests = Counter(
+            "http_requests_total", "Requests quantity by resource, method and response code",
+            ("resource", "method", "status"), registry=registry)
+        self.duration = Histogram(
+            "http_request_duration_seconds", "Request duration, streamed responses are measured till the end",
+            ("resource", "method"), buckets=DURATION_BUCKETS, registry=registry)
+        self.response_size = Histogram(
+            "http_response_size_bytes", "Response size, streamed responses are not measured",
+            ("resource",), buckets=SIZE_BUCKETS, registry=registry)
+        # gauges of the live workers are summed
+        self.pool_size = Gauge(
+            "db_pool_size", "Connection pool size", registry=registry, multiprocess_mode="livesum")
+        self.pool_checked_out = Gauge(
+            "db_pool_checked_out", "Connections used by requests", registry=registry, multiprocess_mode="livesum")
+        self.pool_overflow = Gauge(
+            "db_pool_overflow", "Connections opened over the pool size", registry=registry,
+            multiprocess_mode="livesum")
+        self.pool_wait = Counter(
+            "db_pool_wait_seconds", "Time spent waiting for a free pool connection", registry=registry)
+        self.pool_wait_time = 0.0
+        # labelled children are cached, labels() takes a lock for each call
+        self.children = {}
+
+    def init_app(self, app: Flask) -> None:
+        app.before_request(self.start_request)
+        app.after_request(self.record_response)
+        # streamed responses keep the request context, so the duration is measured after the streaming
+        app.teardown_request(self.finish_request)
+        app.add_url_rule("/metrics", "metrics", self.export)
+
+    def get_child(self, metric, *labels):
+        key = (id(metric), labels)
+        child = self.children.get(key, None)
+        if child is None:
+            child = self.children[key] = metric.labels(*labels)
+        return child
+
+    @staticmethod
+    def get_resource() -> str:
+        """Get the flask_restful resource class name of the request, the endpoint name for other views"""
+        if request.endpoint is None:
+            return UNMATCHED_RESOURCE
+        view = current_app.view_functions[request.endpoint]
+        view_class = getattr(view, "view_class", None)
+        return request.endpoint if view_class is None else view_class.__name__
+
+    @staticmethod
+    def start_request() -> None:
+        g.metrics_start = time.perf_counter()
+
+    def record_response(self, response: Response) -> Response:
+        g.metrics_status = response.status_code
+        if not response.is_streamed:
+            self.get_child(self.response_size, self.get_resource()).observe(response.calculate_content_length() or 0)
+        return response
+
+    def finish_request(self, exception=None) -> None:
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return
+
+        resource = self.get_resource()
+        status = g.pop("metrics_status", 500)
+        self.get_child(self.requests, resource, request.method, str(status)).inc()
+        self.get_child(self.duration, resource, request.method).observe(time.perf_counter() - start)
+        self.update_pool()
+
+    def update_pool(self) -> None:
+        database = getattr(current_app, "database", None)
+        if database is None:
+            return
+        status = database.get_pool_status()
+        if "size" not in status:
+            return
+
+        self.pool_size.set(status["size"])
+        self.pool_checked_out.set(status["checked_out"])
+        self.pool_overflow.set(status["overflow"])
+        wait_time = status.get("wait_time", 0.0)
+        if wait_time > self.pool_wait_time:
+            self.pool_wait.inc(wait_time - self.pool_wait_time)
+            self.pool_wait_time = wait_time
+
+    @staticmethod
+    def export() -> Response:
+        if is_multiprocess():
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
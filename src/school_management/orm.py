@@ -1,5 +1,5 @@
 from sqlalchemy.orm import declarative_base, relationship
-from sqlalchemy import Column, String, Integer, ForeignKey, Sequence
+from sqlalchemy import Column, String, Integer, BigInteger, ForeignKey, Sequence, Index, DDL, event, text
 from flask_restful import fields
 
 Base = declarative_base()
@@ -10,6 +10,8 @@ class Group(Base):
 
     id = Column(Integer, Sequence('group_id_seq'), primary_key=True)
     name = Column(String(15), unique=True)
+    # maintained by database triggers, see GROUP_STUDENT_COUNT_DDL
+    student_count = Column(Integer, nullable=False, default=0, server_default=text("0"), index=True)
     students = relationship("Student", back_populates="group")
 
     @classmethod
@@ -69,8 +71,12 @@ class Course(Base):
 class Student(Base):
     __tablename__ = "students"
 
+    __table_args__ = (
+        Index("ix_students_last_name_first_name", "last_name", "first_name"),
+    )
+
     id = Column(Integer, Sequence('student_id_seq'), primary_key=True, autoincrement=True)
-    group_id = Column(Integer, ForeignKey("groups.id"))
+    group_id = Column(Integer, ForeignKey("groups.id"), index=True)
     first_name = Column(String(150))
     last_name = Column(String(150))
 
@@ -109,6 +115,10 @@ class Student(Base):
 
 class AssignedCourse(Base):
     __tablename__ = "assigned_courses"
+    # the primary key index starts with student_id, this one serves lookups by course
+    __table_args__ = (
+        Index("ix_assigned_courses_course_id_student_id", "course_id", "student_id"),
+    )
 
     student_id = Column(Integer, ForeignKey("students.id"), primary_key=True)
     course_id = Column(Integer, ForeignKey("courses.id"), primary_key=True)
@@ -120,3 +130,154 @@ class AssignedCourse(Base):
 
     def __str__(self):
         return f"student_id={self.student_id}, course_id={self.course_id}"
+
+
+class TableVersion(Base):
+    """Data version of a table, incremented at the commit of each transaction writing the table, see TABLE_VERSION_DDL"""
+    __tablename__ = "table_versions"
+
+    table_name = Column(String(63), primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0, server_default=text("0"))
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(" \
+               f"{self.table_name.__repr__()}, " \
+               f"{self.version.__repr__()})"
+
+    def __str__(self):
+        return f"table_name={self.table_name}, version={self.version}"
+
+
+VERSIONED_TABLES = (
+    Group.__tablename__,
+    Course.__tablename__,
+    Student.__tablename__,
+    AssignedCourse.__tablename__
+)
+
+
+@event.listens_for(TableVersion.__table__, "after_create")
+def insert_table_versions(target, connection, **kwargs):
+    connection.execute(target.insert(), list({"table_name": name, "version": 0} for name in VERSIONED_TABLES))
+
+
+# PostgreSQL statement level triggers keep groups.student_count equal to the group students quantity,
+# they work for ORM, Core and COPY writes.
+# Transition tables can't be used in a trigger with several events, so there is a trigger for each event
+GROUP_STUDENT_COUNT_DDL = [
+    DDL("""
+        CREATE OR REPLACE FUNCTION update_group_student_count() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                UPDATE groups SET student_count = groups.student_count + changes.delta
+                FROM (SELECT group_id, count(*) AS delta FROM new_students GROUP BY group_id) AS changes
+                WHERE groups.id = changes.group_id;
+            ELSIF TG_OP = 'DELETE' THEN
+                UPDATE groups SET student_count = groups.student_count - changes.delta
+                FROM (SELECT group_id, count(*) AS delta FROM old_students GROUP BY group_id) AS changes
+                WHERE groups.id = changes.group_id;
+            ELSE
+                UPDATE groups SET student_count = groups.student_count + changes.delta
+                FROM (
+                    SELECT group_id, sum(delta) AS delta
+                    FROM (
+                        SELECT group_id, 1 AS delta FROM new_students
+                        UNION ALL
+                        SELECT group_id, -1 AS delta FROM old_students
+                    ) AS moves
+                    GROUP BY group_id
+                    HAVING sum(delta) <> 0
+                ) AS changes
+                WHERE groups.id = changes.group_id;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """),
+    DDL("DROP TRIGGER IF EXISTS students_insert_group_student_count ON students"),
+    DDL("""
+        CREATE TRIGGER students_insert_group_student_count
+        AFTER INSERT ON students REFERENCING NEW TABLE AS new_students
+        FOR EACH STATEMENT EXECUTE FUNCTION update_group_student_count()
+    """),
+    DDL("DROP TRIGGER IF EXISTS students_delete_group_student_count ON students"),
+    DDL("""
+        CREATE TRIGGER students_delete_group_student_count
+        AFTER DELETE ON students REFERENCING OLD TABLE AS old_students
+        FOR EACH STATEMENT EXECUTE FUNCTION update_group_student_count()
+    """),
+    DDL("DROP TRIGGER IF EXISTS students_update_group_student_count ON students"),
+    DDL("""
+        CREATE TRIGGER students_update_group_student_count
+        AFTER UPDATE ON students REFERENCING OLD TABLE AS old_students NEW TABLE AS new_students
+        FOR EACH STATEMENT EXECUTE FUNCTION update_group_student_count()
+    """),
+]
+
+for ddl in GROUP_STUDENT_COUNT_DDL:
+    event.listen(Student.__table__, "after_create", ddl.execute_if(dialect="postgresql"))
+
+
+# PostgreSQL triggers increment table_versions of the tables written by a transaction at its commit,
+# so ORM, Core, COPY and SQL writes of any client change the versions.
+# The first row change of each table in a transaction marks the table in a transaction local setting
+# and queues one deferred constraint trigger event (WHEN is evaluated when the row is changed),
+# the event at the commit locks the version rows of all marked tables in the table names order and increments them.
+# So the hot version rows are locked only while the transaction commits and always in the same order,
+# after all changed data rows, writers don't deadlock on them
+TABLE_VERSION_DDL = [
+    DDL("""
+        CREATE OR REPLACE FUNCTION mark_table_changed(name text) RETURNS boolean AS $$
+        BEGIN
+            IF current_setting('school_management.changed_' || name, true) = 'true' THEN
+                RETURN false;
+            END IF;
+            PERFORM set_config('school_management.changed_' || name, 'true', true);
+            RETURN true;
+        END;
+        $$ LANGUAGE plpgsql
+    """),
+    DDL(f"""
+        CREATE OR REPLACE FUNCTION increment_table_versions() RETURNS trigger AS $$
+        DECLARE
+            changed text[];
+        BEGIN
+            SELECT array_agg(name ORDER BY name) INTO changed
+            FROM unnest(ARRAY[{", ".join(f"'{name}'" for name in VERSIONED_TABLES)}]) AS name
+            WHERE current_setting('school_management.changed_' || name, true) = 'true';
+            IF changed IS NULL THEN
+                RETURN NULL;
+            END IF;
+            PERFORM set_config('school_management.changed_' || name, 'false', true) FROM unnest(changed) AS name;
+            PERFORM 1 FROM table_versions WHERE table_name = ANY(changed) ORDER BY table_name FOR UPDATE;
+            UPDATE table_versions SET version = version + 1 WHERE table_name = ANY(changed);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """),
+    DDL("""
+        CREATE OR REPLACE FUNCTION increment_truncated_table_version() RETURNS trigger AS $$
+        BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE table_name = TG_TABLE_NAME;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """),
+]
+for name in VERSIONED_TABLES:
+    TABLE_VERSION_DDL.extend([
+        DDL(f"DROP TRIGGER IF EXISTS {name}_table_version ON {name}"),
+        DDL(f"""
+            CREATE CONSTRAINT TRIGGER {name}_table_version
+            AFTER INSERT OR UPDATE OR DELETE ON {name} DEFERRABLE INITIALLY DEFERRED
+            FOR EACH ROW WHEN (mark_table_changed('{name}')) EXECUTE FUNCTION increment_table_versions()
+        """),
+        DDL(f"DROP TRIGGER IF EXISTS {name}_truncate_table_version ON {name}"),
+        DDL(f"""
+            CREATE TRIGGER {name}_truncate_table_version
+            AFTER TRUNCATE ON {name} FOR EACH STATEMENT EXECUTE FUNCTION increment_truncated_table_version()
+        """),
+    ])
+
+TABLE_VERSION_TRIGGERS = tuple(
+    trigger for name in VERSIONED_TABLES for trigger in (f"{name}_table_version", f"{name}_truncate_table_version"))
@@ -1,110 +1,421 @@
 import os
 import json
+import logging
+import time
+from collections import ChainMap
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Iterator, Mapping
 
-from flask import Flask, make_response, current_app
+from flask import Flask, Config, Response, make_response, current_app, g, stream_with_context
 from flask_restful import Api
 from flasgger import Swagger
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import configure_mappers
 
 from .db import DataAccessLayer
+from .orm import Group, Student
 from .api import (
     Students,
     GroupsByCount,
     GroupsByGroup,
     StudentsByCourse,
+    StudentsBulk,
+    StudentsExport,
     StudentsDelete,
     StudentsAddToCourses,
-    StudentsDeleteFromCourse
+    StudentsDeleteFromCourse,
+    Enrollments,
+    get_fields_loading_plan
 )
-from .dict_to_xml import dict_to_xml
+from .dict_to_xml import dict_to_xml, iter_xml
+from .instrumentation import RequestInstrumentation, measure_serialization, iter_measured
+from .metrics import PrometheusMetrics
+from .health import HealthChecks
 
 API_VERSION = 1
 
 IS_DOCKER = 'IS_DOCKER' in os.environ
 
-app = Flask(__name__)
+# config names of database engine options: (DataAccessLayer engine option, type)
+ENGINE_OPTIONS = {
+    "PG_POOL_SIZE": ("pool_size", int),
+    "PG_MAX_OVERFLOW": ("max_overflow", int),
+    "PG_POOL_TIMEOUT": ("pool_timeout", float),
+    "PG_POOL_RECYCLE": ("pool_recycle", int),
+    "PG_POOL_PRE_PING": ("pool_pre_ping", bool),
+    "PG_STATEMENT_TIMEOUT": ("statement_timeout", int)
+}
+
+# config names of reference data cache options: (DataAccessLayer option, type)
+CACHE_OPTIONS = {
+    "REFERENCE_CACHE_SIZE": ("cache_size", int),
+    "REFERENCE_CACHE_TTL": ("cache_ttl", float)
+}
+
+# config names of request instrumentation options: (RequestInstrumentation option, type)
+INSTRUMENTATION_OPTIONS = {
+    "SERVER_TIMING": ("server_timing", bool),
+    "REQUEST_LOG": ("request_log", bool),
+    "REPEATED_STATEMENT_THRESHOLD": ("repeated_threshold", int)
+}
+
+# config names of health checks options: (HealthChecks option, type)
+HEALTH_OPTIONS = {
+    "READINESS_TIMEOUT": ("timeout", float),
+    "READINESS_CACHE_TTL": ("cache_ttl", float)
+}
+
+# config names of application startup options: (create_app option, type)
+STARTUP_OPTIONS = {
+    "API_DOCS": ("api_docs", bool),
+    "PG_POOL_WARM_UP": ("warm_up_connections", int),
+    "STARTUP_TIME_BUDGET": ("startup_time_budget", float)
+}
 
-if not IS_DOCKER:
-    app.config.from_pyfile(os.path.join(".", "../../.env"))
+# seconds an application start may take, a longer start is logged as a warning
+STARTUP_TIME_BUDGET = 5.0
 
-api = Api(app, default_mediatype="application/json")
+# minimal size of streamed response chunks
+STREAM_BUFFER_SIZE = 64 * 1024
 
+# response metadata fields and their headers for representations without a place for metadata
+RESPONSE_META_FIELDS = {
+    "next_cursor": "X-Next-Cursor",
+    "total": "X-Total-Count"
+}
+
+ENV_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".env")
+
+SWAGGER_CONFIG = {
+    "headers": [
+    ],
+    "specs": [
+        {
+            "endpoint": 'specifications',
+            "route": '/specifications.json',
+            "rule_filter": lambda rule: True,  # all in
+            "model_filter": lambda tag: True,  # all in
+        }
+    ],
+    "static_url_path": "/",
+    "specs_route": "/"
+}
+
+# process wide, its collectors are registered once in the prometheus_client registry
+metrics = PrometheusMetrics()
+
+startup_logger = logging.getLogger("school_management.startup")
+
+
+@lru_cache(maxsize=None)
+def load_env_config() -> Config:
+    """Load ".env" file of the local deployment once"""
+    config = Config(os.path.dirname(os.path.abspath(__file__)))
+    config.from_pyfile(ENV_FILE)
+    return config
+
+
+def get_config(app: Flask = None) -> Mapping:
+    """
+    Get the configuration source: the application config, it contains ".env" file values (local deployment)
+    and the values given to create_app(), in docker the environment is used for other names
+    :param app: application, None - ".env" file of the local deployment or the environment (docker)
+    :return: mapping of config names to values
+
+    """
+    if app is None:
+        return os.environ if IS_DOCKER else load_env_config()
+    return ChainMap(app.config, os.environ) if IS_DOCKER else app.config
+
+
+def get_connection_string(config: Mapping = None) -> str:
+    if config is None:
+        config = get_config()
 
-def get_connection_string() -> str:
     if IS_DOCKER:
-        connection_string = (f"postgresql://{os.environ.get('PG_USER')}:"
-                             f"{os.environ.get('PG_PASSWD')}@"
-                             f"{os.environ.get('PG_DATABASE_ADDRESS')}/"
-                             f"{os.environ.get('PG_DATABASE')}")
+        connection_string = (f"postgresql://{config.get('PG_USER')}:"
+                             f"{config.get('PG_PASSWD')}@"
+                             f"{config.get('PG_DATABASE_ADDRESS')}/"
+                             f"{config.get('PG_DATABASE')}")
 
     else:
-        connection_string = (f"postgresql://{app.config['PG_USER']}:"
-                             f"{app.config['PG_PASSWD']}@"
-                             f"{app.config['DATABASE_ADDRESS']}/"
-                             f"{app.config['PG_DATABASE']}")
+        connection_string = (f"postgresql://{config['PG_USER']}:"
+                             f"{config['PG_PASSWD']}@"
+                             f"{config['DATABASE_ADDRESS']}/"
+                             f"{config['PG_DATABASE']}")
     return connection_string
 
 
-@app.before_first_request
-def init_db():
-    current_app.database = create_database_connection(get_connection_string())
+def get_options(names: dict, config: Mapping = None) -> dict:
+    """
+    Get options from the environment (docker) or the application config, only the options set are returned
+    :param names: dict {config name: (option, type)}
+    :param config: configuration source, see get_config(), None - ".env" file of the local deployment
+    :return: dict {option: value}
+
+    """
+    if config is None:
+        config = get_config()
+
+    options = {}
+    for name, (option, option_type) in names.items():
+        value = config.get(name, None)
+        if value is None or value == "":
+            continue
+        if option_type is bool and isinstance(value, str):
+            value = value.lower() in ("1", "true", "yes", "on")
+        options[option] = option_type(value)
+    return options
+
+
+def get_engine_options(config: Mapping = None) -> dict:
+    """
+    Get database engine and connection pool options from the environment (docker) or the application config
+    Only the options set are returned, other options have SQLAlchemy defaults
+    :return: dict of DataAccessLayer engine options
+
+    """
+    return get_options(ENGINE_OPTIONS, config)
+
+
+def get_cache_options(config: Mapping = None) -> dict:
+    """
+    Get reference data cache options from the environment (docker) or the application config
+    :return: dict of DataAccessLayer cache options
+
+    """
+    return get_options(CACHE_OPTIONS, config)
+
+
+def get_instrumentation_options(config: Mapping = None) -> dict:
+    """
+    Get request instrumentation options from the environment (docker) or the application config
+    :return: dict of RequestInstrumentation options
+
+    """
+    return get_options(INSTRUMENTATION_OPTIONS, config)
+
+
+def get_health_options(config: Mapping = None) -> dict:
+    """
+    Get readiness check options from the environment (docker) or the application config
+    :return: dict of HealthChecks options
+
+    """
+    return get_options(HEALTH_OPTIONS, config)
+
+
+def get_startup_options(config: Mapping = None) -> dict:
+    """
+    Get application startup options from the environment (docker) or the application config
+    :return: dict of create_app startup options
+
+    """
+    return get_options(STARTUP_OPTIONS, config)
+
+
+def set_etag(resp) -> None:
+    """Set ETag made by the conditional GET decorator to the response"""
+    etag = g.get("etag", None)
+    if etag is not None and resp.status_code == 200:
+        resp.set_etag(etag)
+        resp.vary.add("Accept")
+
+
+def buffer_chunks(parts: Iterator[str]) -> Iterator[str]:
+    """
+    Join small parts of a streamed response into chunks of at least STREAM_BUFFER_SIZE characters
+    :param parts: iterator of response parts
+    :return: iterator of response chunks
+
+    """
+    chunk = []
+    size = 0
+    for part in parts:
+        chunk.append(part)
+        size += len(part)
+        if size >= STREAM_BUFFER_SIZE:
+            yield "".join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield "".join(chunk)
+
+
+def iter_json(data: dict) -> Iterator[str]:
+    """
+    Serialize response data with a lazy items iterator to compact JSON by parts
+    :param data: response data {"data": items iterator, "root_name": root name} and metadata fields
+    :return: iterator of JSON parts
+
+    """
+    yield f"{{{json.dumps(data['root_name'])}:["
+    for index, item in enumerate(data["data"]):
+        item_json = json.dumps(item, separators=(",", ":"))
+        yield f",{item_json}" if index else item_json
+
+    yield "]"
+    yield from (f",{json.dumps(key)}:{json.dumps(data[key])}" for key in RESPONSE_META_FIELDS if key in data)
+    yield "}"
 
 
-@api.representation('application/json')
 def json_response(data, code, headers):
-    resp = make_response(json.dumps({data["root_name"]: data["data"]}, indent="\t"), code)
+    if isinstance(data.get("data", None), Iterator):
+        # the request context keeps the database session until the response is streamed
+        resp = Response(stream_with_context(iter_measured(buffer_chunks(iter_json(data)))), code,
+                        mimetype="application/json")
+    else:
+        output = {data["root_name"]: data["data"]}
+        output.update((key, data[key]) for key in RESPONSE_META_FIELDS if key in data)
+        with measure_serialization():
+            body = json.dumps(output, indent="\t")
+        resp = make_response(body, code)
     resp.headers.extend(headers)
+    set_etag(resp)
     return resp
 
 
-@api.representation('application/xml')
 def xml_response(data, code, headers):
-    resp = make_response(dict_to_xml(data["data"], data["root_name"]), code)
+    if isinstance(data.get("data", None), Iterator):
+        # rows are written to the response as they are read from the database
+        xml = iter_measured(buffer_chunks(iter_xml(data["data"], data["root_name"])))
+        resp = Response(stream_with_context(xml), code, mimetype="application/xml")
+    else:
+        with measure_serialization():
+            body = dict_to_xml(data["data"], data["root_name"])
+        resp = make_response(body, code)
     resp.headers.extend(headers)
+    set_etag(resp)
+    # XML output format has no place for metadata, so it is sent in headers
+    for key, header in RESPONSE_META_FIELDS.items():
+        if data.get(key) is not None:
+            resp.headers[header] = str(data[key])
     return resp
 
 
-@app.teardown_request
 def shutdown_session(exception=None):
     current_app.database.Session.remove()
 
 
-def create_database_connection(connection_string: str = None) -> DataAccessLayer:
+def create_database_connection(
+        connection_string: str = None,
+        engine_options: dict = None,
+        config: Mapping = None) -> DataAccessLayer:
     """Create DataAccessLayer and make database connection"""
     if connection_string is None:
         connection_string = get_connection_string()
+    if engine_options is None:
+        engine_options = get_engine_options()
 
-    db = DataAccessLayer(connection_string)
+    db = DataAccessLayer(connection_string, engine_options, **get_cache_options(config))
     db.connect()
     return db
 
 
-api.add_resource(Students, f"/api/v{API_VERSION}/students/")
-api.add_resource(StudentsDelete, f"/api/v{API_VERSION}/students/<int:student_id>")
-api.add_resource(StudentsByCourse, f"/api/v{API_VERSION}/students_by_course/<string:course_name>/")
-api.add_resource(StudentsAddToCourses, f"/api/v{API_VERSION}/students_add_to_courses/<int:student_id>/")
-api.add_resource(StudentsDeleteFromCourse, f"/api/v{API_VERSION}/students_del_from_course/<int:student_id>/")
+def add_resources(api: Api) -> None:
+    api.add_resource(Students, f"/api/v{API_VERSION}/students/")
+    api.add_resource(StudentsBulk, f"/api/v{API_VERSION}/students/bulk/")
+    api.add_resource(StudentsExport, f"/api/v{API_VERSION}/students/export/")
+    api.add_resource(StudentsDelete, f"/api/v{API_VERSION}/students/<int:student_id>")
+    api.add_resource(StudentsByCourse, f"/api/v{API_VERSION}/students_by_course/<string:course_name>/")
+    api.add_resource(StudentsAddToCourses, f"/api/v{API_VERSION}/students_add_to_courses/<int:student_id>/")
+    api.add_resource(StudentsDeleteFromCourse, f"/api/v{API_VERSION}/students_del_from_course/<int:student_id>/")
+    api.add_resource(Enrollments, f"/api/v{API_VERSION}/enrollments/")
 
-api.add_resource(GroupsByCount, f"/api/v{API_VERSION}/groups_by_count/<int:count>/")
-api.add_resource(GroupsByGroup, f"/api/v{API_VERSION}/groups_by_group/<string:group_name>/")
+    api.add_resource(GroupsByCount, f"/api/v{API_VERSION}/groups_by_count/<int:count>/")
+    api.add_resource(GroupsByGroup, f"/api/v{API_VERSION}/groups_by_group/<string:group_name>/")
 
-app.config['SWAGGER'] = {"openapi": "3.0.3"}
 
-swagger_config = {
-    "headers": [
-    ],
-    "specs": [
-        {
-            "endpoint": 'specifications',
-            "route": '/specifications.json',
-            "rule_filter": lambda rule: True,  # all in
-            "model_filter": lambda tag: True,  # all in
-        }
-    ],
-    "static_url_path": "/",
-    "specs_route": "/"
-}
+def warm_up_database(app: Flask) -> int:
+    """
+    Open the connection pool of the application before the first requests
+    The database may be unavailable at startup, it's logged and reported by /readyz
+    :param app: application
+    :return: opened connections quantity
+
+    """
+    connections = get_startup_options(get_config(app)).get("warm_up_connections", None)
+    try:
+        return app.database.warm_up(connections)
+    except SQLAlchemyError as error:
+        startup_logger.warning("The connection pool is not opened: %s", error)
+        return 0
+
+
+@contextmanager
+def measure_phase(timings: dict, phase: str) -> Iterator[None]:
+    """Add the duration of the startup phase in seconds to the timings"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = round(time.perf_counter() - start, 4)
+
+
+def create_app(config: dict = None) -> Flask:
+    """
+    Create the application, the connection pool, response serializers, loading plans
+    and the API specification are prepared at startup instead of the first requests of a worker.
+    The startup time is logged to "school_management.startup" logger,
+    a start longer than STARTUP_TIME_BUDGET seconds is logged as a warning
+    :param config: config values overriding ".env" file values or the environment (docker),
+        e.g. {"PG_DATABASE": "test"}
+    :return: application with "database" (DataAccessLayer) and "startup_timings" attributes
+
+    """
+    start = time.perf_counter()
+    timings = {}
+
+    with measure_phase(timings, "config"):
+        app = Flask(__name__)
+        if not IS_DOCKER:
+            app.config.from_mapping(load_env_config())
+        app.config.update(config or {})
+        options = get_config(app)
+        startup_options = get_startup_options(options)
+
+    with measure_phase(timings, "routes"):
+        api = Api(app, default_mediatype="application/json")
+        api.representation('application/json')(json_response)
+        api.representation('application/xml')(xml_response)
+        add_resources(api)
+
+        instrumentation = RequestInstrumentation(**get_instrumentation_options(options))
+        instrumentation.init_app(app)
+        metrics.init_app(app)
+        health = HealthChecks(**get_health_options(options))
+        health.init_app(app)
+        app.extensions["instrumentation"] = instrumentation
+        app.extensions["health"] = health
+        app.teardown_request(shutdown_session)
+
+    with measure_phase(timings, "database"):
+        app.database = create_database_connection(
+            get_connection_string(options), get_engine_options(options), options)
+        instrumentation.instrument_engine(app.database.engine)
+        warm_up_database(app)
+
+    with measure_phase(timings, "serializers"):
+        configure_mappers()
+        for entity in (Group, Student):
+            get_fields_loading_plan(entity)
+
+    if startup_options.get("api_docs", True):
+        with measure_phase(timings, "api_docs"):
+            app.config['SWAGGER'] = {"openapi": "3.0.3"}
+            swagger = Swagger(app, template_file="apidocs.yaml", config=SWAGGER_CONFIG)
+            with app.app_context():
+                swagger.get_apispecs("specifications")
+
+    total = round(time.perf_counter() - start, 4)
+    budget = startup_options.get("startup_time_budget", STARTUP_TIME_BUDGET)
+    message = json.dumps({"startup_seconds": total, "budget_seconds": budget, "phases": timings})
+    startup_logger.log(logging.WARNING if total > budget else logging.INFO, message)
+
+    app.startup_timings = dict(timings, total=total)
+    return app
 
-swagger = Swagger(app, template_file="apidocs.yaml", config=swagger_config)
 
 if __name__ == "__main__":
-    app.run()
+    create_app().run()
@@ -0,0 +1,219 @@
+from functools import lru_cache
+from typing import Callable
+
+from flask_restful import fields
+
+from .orm import Base
+
+
+class SerializerCompiler:
+    """
+    Compiles a dict of flask_restful fields into a specialized python function
+    The function returns the same data as flask_restful.marshal, but reads each attribute once with getattr
+    instead of walking field objects for each attribute of each row.
+    Works with objects having attributes: ORM instances and Core result rows.
+    Integer, String and Raw fields, Nested fields and Lists of them are compiled,
+    other fields are called as in marshal
+
+    """
+    def __init__(self):
+        self.lines = []
+        self.namespace = {}
+        self.functions = 0
+        self.variables = 0
+
+    def constant(self, value) -> str:
+        """
+        Make a name for a value used by the compiled code
+        :param value: value
+        :return: name in the compiled code namespace
+
+        """
+        name = f"const_{len(self.namespace)}"
+        self.namespace[name] = value
+        return name
+
+    def variable(self) -> str:
+        self.variables += 1
+        return f"value_{self.variables}"
+
+    def compile_function(self, data_fields: dict) -> str:
+        """
+        Generate a function converting an object to a dict
+        :param data_fields: dict of fields
+        :return: function name
+
+        """
+        name = f"serialize_{self.functions}"
+        self.functions += 1
+
+        body = []
+        items = []
+        for key, field in data_fields.items():
+            if isinstance(field, dict):
+                # marshal applies nested dicts of fields to the same object
+                items.append(f"{key!r}: {self.compile_function(field)}(obj)")
+                continue
+            if isinstance(field, type):
+                field = field()
+            items.append(f"{key!r}: {self.compile_field(body, key, field)}")
+
+        self.lines.append(f"def {name}(obj):")
+        self.lines.extend(f"    {line}" for line in body)
+        self.lines.append("    return {")
+        self.lines.extend(f"        {item}," for item in items)
+        self.lines.append("    }")
+        self.lines.append("")
+        return name
+
+    def compile_value(self, body: list, key, field: fields.Raw, obj: str = "obj") -> str | None:
+        """
+        Generate reading of a field value to a variable
+        :param body: function body lines
+        :param key: field key
+        :param field: field
+        :param obj: name of the variable with the object
+        :return: name of the variable with the value, None if the value can't be read with getattr
+
+        """
+        attribute = key if field.attribute is None else field.attribute
+        if not isinstance(attribute, str) or not all(part.isidentifier() for part in attribute.split(".")):
+            return None
+
+        value = obj
+        for part in attribute.split("."):
+            value = f"getattr({value}, {part!r}, None)"
+        variable = self.variable()
+        body.append(f"{variable} = {value}")
+        return variable
+
+    def compile_format(self, field: fields.Raw, value: str) -> str | None:
+        """
+        Generate an expression formatting a not None value as the field does
+        :param field: field
+        :param value: value expression
+        :return: expression, None if the field can't be compiled
+
+        """
+        field_type = type(field)
+        if field_type is fields.Integer:
+            return f"int({value})"
+        if field_type is fields.String:
+            return f"str({value})"
+        if field_type is fields.Raw:
+            return value
+        if field_type is fields.Nested:
+            return f"{self.compile_function(field.nested)}({value})"
+        return None
+
+    def compile_field(self, body: list, key, field: fields.Raw) -> str:
+        """
+        Generate an expression returning the field value for the object "obj"
+        :param body: function body lines
+        :param key: field key
+        :param field: field
+        :return: expression
+
+        """
+        fallback = f"{self.constant(field)}.output({key!r}, obj)"
+        value = self.compile_value(body, key, field)
+        if value is None:
+            return fallback
+
+        field_type = type(field)
+        if field_type is fields.Nested:
+            return self.compile_nested(field, value, self.compile_format(field, value))
+
+        if field_type is fields.List:
+            container = field.container
+            if container.attribute is not None and type(container) is not fields.Nested:
+                return fallback
+            item_format = self.compile_format(container, "item")
+            if item_format is None:
+                return fallback
+            if type(container) is fields.Nested:
+                item_value = self.compile_nested(container, "item", item_format)
+            else:
+                item_value = f"{self.constant(container.default)} if item is None else {item_format}"
+            # sets, dicts and other values are marshalled by the field itself
+            return (f"{self.constant(field.default)} if {value} is None "
+                    f"else [{item_value} for item in {value}] if isinstance({value}, (list, tuple)) "
+                    f"else {fallback}")
+
+        formatted = self.compile_format(field, value)
+        if formatted is None:
+            return fallback
+        return f"{self.constant(field.default)} if {value} is None else {formatted}"
+
+    def compile_nested(self, field: fields.Nested, value: str, formatted: str) -> str:
+        """
+        Generate an expression for a Nested field value, which may be None
+        marshal of None returns defaults of the nested fields, unless the field allows null or has a default
+        :param field: Nested field
+        :param value: value expression
+        :param formatted: expression formatting the value
+        :return: expression
+
+        """
+        if field.allow_null:
+            return f"None if {value} is None else {formatted}"
+        if field.default is not None:
+            return f"{self.constant(field.default)} if {value} is None else {formatted}"
+        return formatted
+
+    def compile(self, data_fields: dict) -> Callable:
+        """
+        Compile the fields
+        :param data_fields: dict of fields for marshal
+        :return: function converting an object to a dict
+
+        """
+        name = self.compile_function(data_fields)
+        source = "\n".join(self.lines)
+        exec(compile(source, f"<serializer {name}>", "exec"), self.namespace)
+
+        serializer = self.namespace[name]
+        serializer.fields = data_fields
+        serializer.source = source
+        return serializer
+
+
+def compile_serializer(data_fields: dict) -> Callable:
+    """
+    Compile a dict of flask_restful fields into a serializer function
+    The function has attributes "fields" - the compiled fields and "source" - the generated code
+    :param data_fields: dict of fields for marshal
+    :return: function converting an object to a dict
+
+    """
+    return SerializerCompiler().compile(data_fields)
+
+
+def get_entity_fields(entity: type[Base], complete: bool = True) -> dict:
+    """
+    Get the fields specification of the entity
+    :param entity: ORM class
+    :param complete: True - fields with relationships (get_complete_fields), False - basic fields (get_fields)
+    :return: dict of fields for marshal
+
+    """
+    if complete and hasattr(entity, "get_complete_fields"):
+        return entity.get_complete_fields()
+    return entity.get_fields()
+
+
+@lru_cache(maxsize=None)
+def get_serializer(entity: type[Base], complete: bool = True, field_names: tuple = None) -> Callable:
+    """
+    Get the compiled serializer for the entity fields, serializers are compiled once
+    :param entity: ORM class
+    :param complete: True - fields with relationships (get_complete_fields), False - basic fields (get_fields)
+    :param field_names: names of the serialized fields (sparse fieldset), None - all fields,
+        unknown names are ignored
+    :return: serializer function
+
+    """
+    data_fields = get_entity_fields(entity, complete)
+    if field_names is not None:
+        data_fields = {key: field for key, field in data_fields.items() if key in field_names}
+    return compile_serializer(data_fields)
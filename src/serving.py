@@ -0,0 +1,105 @@
+"""
+Gunicorn serving mode and worker sizing, used by gunicorn.conf.py
+Doesn't import the application, so the master process stays light without preloading
+
+"""
+import os
+from importlib.util import find_spec
+
+# gunicorn worker classes by serving modes
+WORKER_CLASSES = {
+    "sync": "sync",
+    "gthread": "gthread",
+    "gevent": "gevent"
+}
+
+DEFAULT_SERVING_MODE = "gthread"
+
+# packages required by the serving modes, they are not in requirements.txt
+MODE_REQUIREMENTS = {
+    "gevent": ("gevent", "psycogreen")
+}
+
+# SQLAlchemy QueuePool defaults, used when the pool options are not set
+DEFAULT_POOL_SIZE = 5
+DEFAULT_MAX_OVERFLOW = 10
+
+# connections all workers may open, PostgreSQL default max_connections is 100 and some are kept for maintenance
+DEFAULT_MAX_CONNECTIONS = 90
+
+
+def get_env_int(name: str, default: int | None) -> int | None:
+    value = os.environ.get(name, "")
+    return default if value == "" else int(value)
+
+
+def get_worker_settings(
+        mode: str = DEFAULT_SERVING_MODE,
+        cpu_count: int = 1,
+        workers: int = None,
+        threads: int = None,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        max_overflow: int = DEFAULT_MAX_OVERFLOW,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS) -> dict:
+    """
+    Get gunicorn worker settings for the serving mode
+    sync - (2 * CPUs + 1) single threaded workers, a slow query blocks only its worker;
+    gthread - (CPUs + 1) workers with a thread per pooled connection;
+    gevent - (CPUs + 1) workers with a greenlet per pool and overflow connection (requires gevent and psycogreen,
+    ValueError is raised if they are not installed).
+    Concurrent requests of a worker don't exceed its pool connections, more requests would wait for the pool.
+    Derived workers quantity is reduced, so all workers don't open more than max_connections database connections
+    :param mode: "sync", "gthread" or "gevent"
+    :param cpu_count: CPUs quantity
+    :param workers: workers quantity, None - derived from CPUs quantity
+    :param threads: threads of a gthread worker, None - the pool size
+    :param pool_size: database connection pool size of a worker
+    :param max_overflow: connections a worker pool opens over the pool size
+    :param max_connections: database connections budget of all workers
+    :return: dict of gunicorn settings: worker_class, workers, threads and worker_connections
+
+    """
+    if mode not in WORKER_CLASSES:
+        raise ValueError(f"Unknown serving mode: '{mode}', expected one of: {', '.join(WORKER_CLASSES)}")
+    # gunicorn stops at the configuration loading instead of crashing workers
+    missing = list(name for name in MODE_REQUIREMENTS.get(mode, ()) if find_spec(name) is None)
+    if missing:
+        raise ValueError(f"Serving mode '{mode}' requires packages which are not installed: {', '.join(missing)}, "
+                         f"install them with: pip install {' '.join(missing)}")
+
+    pool_connections = max(pool_size + max_overflow, 1)
+    settings = {"worker_class": WORKER_CLASSES[mode], "threads": 1, "worker_connections": pool_connections}
+    if mode == "sync":
+        derived_workers = 2 * cpu_count + 1
+        concurrency = 1
+    elif mode == "gthread":
+        derived_workers = cpu_count + 1
+        concurrency = settings["threads"] = max(min(threads or pool_size, pool_connections), 1)
+    else:
+        derived_workers = cpu_count + 1
+        concurrency = pool_connections
+
+    if workers is None:
+        # streamed exports and readiness checks use one more connection
+        worker_max_connections = min(concurrency + 1, pool_connections)
+        workers = max(min(derived_workers, max_connections // worker_max_connections), 1)
+    settings["workers"] = workers
+    return settings
+
+
+def get_worker_settings_from_env() -> dict:
+    """
+    Get gunicorn worker settings from the environment variables:
+    WEB_SERVING_MODE, WEB_WORKERS, WEB_THREADS, PG_POOL_SIZE, PG_MAX_OVERFLOW and DB_MAX_CONNECTIONS
+    :return: dict of gunicorn settings
+
+    """
+    return get_worker_settings(
+        mode=os.environ.get("WEB_SERVING_MODE", "") or DEFAULT_SERVING_MODE,
+        cpu_count=os.cpu_count() or 1,
+        workers=get_env_int("WEB_WORKERS", None),
+        threads=get_env_int("WEB_THREADS", None),
+        pool_size=get_env_int("PG_POOL_SIZE", DEFAULT_POOL_SIZE),
+        max_overflow=get_env_int("PG_MAX_OVERFLOW", DEFAULT_MAX_OVERFLOW),
+        max_connections=get_env_int("DB_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS)
+    )
@@ -1,4 +1,6 @@
-from school_management.run import app
+from school_management import create_app
+
+app = create_app()
 
 if __name__ == "__main__":
     app.run()
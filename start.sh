@@ -3,9 +3,10 @@
 cd src
 
 python create_tables.py
+python create_indexes.py
 
 if [ "${FILL_DATABASE}" == "fill" ]; then
   python fill_database.py
 fi
 
-gunicorn --bind 0.0.0.0:80 -w 1 wsgi:app
+gunicorn -c gunicorn.conf.py wsgi:app
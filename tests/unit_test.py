@@ -1,28 +1,57 @@
+import csv
+import json
+import os
+import queue
+import random
+import tempfile
+import threading
+import time
 import unittest
+from io import StringIO
+from unittest.mock import patch
 from xml.etree import ElementTree
 from flask_restful import marshal, fields
-from sqlalchemy import create_engine, select, func
-from sqlalchemy.exc import NoResultFound
+from sqlalchemy import create_engine, select, update, func, event, text, Table, Column, MetaData, Integer
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import NoResultFound, OperationalError, IntegrityError
+from sqlalchemy.pool import QueuePool
 from parameterized import parameterized
-from school_management import Group, Course, Student, app, create_database_connection, API_VERSION
+from prometheus_client.parser import text_string_to_metric_families
+from school_management import Group, Course, Student, create_app, create_database_connection, get_config, \
+    API_VERSION
+from school_management import db as db_module
+from school_management.db import get_loading_plan
+from school_management.cache import ReferenceCache
+from school_management.dict_to_xml import dict_to_xml, iter_xml
+from school_management.export import iter_ndjson, iter_csv, EXPORT_CHUNK_ROWS
+from school_management.bulk import IdAllocator, insert_rows
+from school_management.importer import Importer, ImportDataError
+from school_management.serializers import compile_serializer, get_serializer
+from serving import get_worker_settings
 from school_management.generators import GROUPS_QTY, STUDENTS_QTY, \
     GROUP_MIN_SIZE, GROUP_MAX_SIZE, \
-    MIN_COURSES_PER_STUDENT, MAX_COURSES_PER_STUDENT
+    MIN_COURSES_PER_STUDENT, MAX_COURSES_PER_STUDENT, \
+    generate_groups_stream, generate_students_stream
 
 TEST_DATABASE = "school_management_test_123"
 
-test_database_connection_string = (f"postgresql://{app.config['PG_USER']}:"
-                                   f"{app.config['PG_PASSWD']}@"
-                                   f"{app.config['DATABASE_ADDRESS']}/"
+config = get_config()
+
+test_database_connection_string = (f"postgresql://{config['PG_USER']}:"
+                                   f"{config['PG_PASSWD']}@"
+                                   f"{config['DATABASE_ADDRESS']}/"
                                    f"{TEST_DATABASE}")
 
-postgres_connection_string = (f"postgresql://{app.config['PG_USER']}:"
-                              f"{app.config['PG_PASSWD']}@"
-                              f"{app.config['DATABASE_ADDRESS']}/"
-                              f"{app.config['PG_DATABASE']}")
+postgres_connection_string = (f"postgresql://{config['PG_USER']}:"
+                              f"{config['PG_PASSWD']}@"
+                              f"{config['DATABASE_ADDRESS']}/"
+                              f"{config['PG_DATABASE']}")
 
 test_data = {}
 
+# the application is created when the test database exists
+app = None
+
 
 def setUpModule():
     unittest.TestLoader.sortTestMethodsUsing = None
@@ -49,8 +78,13 @@ def setUpModule():
 
     db.engine.dispose()
 
+    global app
+    app = create_app({"PG_DATABASE": TEST_DATABASE})
+
 
 def tearDownModule():
+    app.database.engine.dispose()
+
     engine = create_engine(postgres_connection_string)
     connection = engine.connect()
 
@@ -67,11 +101,14 @@ def tearDownModule():
 class BaseTest(unittest.TestCase):
     def setUp(self):
         self.db = create_database_connection(test_database_connection_string)
-        app.config["PG_DATABASE"] = TEST_DATABASE
         self.app = app.test_client()
 
+        # tests write courses and groups with their own connection, bypassing the application cache
+        app.database.reference_cache.clear()
+
     def tearDown(self):
         self.db.remove_session()
+        self.db.engine.dispose()
 
 
 class TestTestData(BaseTest):
@@ -125,6 +162,205 @@ class TestTestData(BaseTest):
         self.assertTrue(len(unassigned_students) <= max_unassigned_students)
 
 
+class TestEngineOptions(unittest.TestCase):
+    def setUp(self):
+        self.db = create_database_connection(test_database_connection_string, {
+            "pool_size": 2,
+            "max_overflow": 1,
+            "pool_pre_ping": True,
+            "statement_timeout": 100
+        })
+
+    def tearDown(self):
+        self.db.engine.dispose()
+
+    def test_pool_status(self):
+        with self.db.engine.connect():
+            status = self.db.get_pool_status()
+            self.assertEqual(status["size"], 2)
+            self.assertEqual(status["max_overflow"], 1)
+            self.assertEqual(status["checked_out"], 1)
+            self.assertEqual(status["checkouts"], 1)
+
+        self.assertEqual(self.db.get_pool_status()["checked_out"], 0)
+
+    def test_pool_wait_time(self):
+        # opening a new connection is not waiting for a free one
+        create_connection = QueuePool._create_connection
+
+        def slow_create_connection(pool):
+            time.sleep(0.2)
+            return create_connection(pool)
+
+        with patch.object(QueuePool, "_create_connection", slow_create_connection):
+            with self.db.engine.connect():
+                pass
+        status = self.db.get_pool_status()
+        self.assertEqual(status["checkouts"], 1)
+        self.assertLess(status["max_wait_time"], 0.1)
+
+    def test_statement_timeout(self):
+        with self.db.engine.connect() as connection:
+            with self.assertRaises(OperationalError):
+                connection.execute(select(func.pg_sleep(1)))
+
+    def test_connect_args_options(self):
+        db = create_database_connection(test_database_connection_string, {
+            "statement_timeout": 100,
+            "connect_args": {"options": "-c lock_timeout=200"}
+        })
+        try:
+            with db.engine.connect() as connection:
+                self.assertEqual(connection.execute(text("SHOW lock_timeout")).scalar(), "200ms")
+                self.assertEqual(connection.execute(text("SHOW statement_timeout")).scalar(), "100ms")
+        finally:
+            db.engine.dispose()
+
+    def test_unsupported_database(self):
+        with self.assertRaisesRegex(ValueError, "Unsupported database: 'sqlite'"):
+            create_database_connection("sqlite://")
+
+
+class TestWorkerSettings(unittest.TestCase):
+    @parameterized.expand([
+        ("sync", 2, None, None, {"worker_class": "sync", "workers": 5, "threads": 1}),
+        ("gthread", 2, None, None, {"worker_class": "gthread", "workers": 3, "threads": 5}),
+        ("gthread", 2, None, 50, {"worker_class": "gthread", "workers": 3, "threads": 15}),
+        ("gevent", 2, None, None, {"worker_class": "gevent", "workers": 3, "worker_connections": 15}),
+        ("sync", 2, 7, None, {"worker_class": "sync", "workers": 7}),
+    ])
+    def test_worker_settings(self, mode, cpu_count, workers, threads, expected):
+        # gevent mode packages are installed
+        with patch("serving.find_spec", return_value=object()):
+            settings = get_worker_settings(mode, cpu_count, workers, threads)
+        self.assertEqual(expected, {key: settings[key] for key in expected})
+
+    def test_missing_mode_requirements(self):
+        with patch("serving.find_spec", return_value=None), \
+                self.assertRaisesRegex(ValueError, "pip install gevent psycogreen"):
+            get_worker_settings("gevent")
+
+    def test_connections_budget(self):
+        # a gthread worker uses up to 5 threads + 1 connections
+        settings = get_worker_settings("gthread", cpu_count=16, max_connections=30)
+        self.assertEqual(settings["workers"], 5)
+
+        settings = get_worker_settings("gthread", cpu_count=16, max_connections=3)
+        self.assertEqual(settings["workers"], 1)
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            get_worker_settings("eventlet")
+
+
+class TestReferenceCache(BaseTest):
+    def setUp(self):
+        super().setUp()
+        self.statements = []
+        event.listen(self.db.engine, "before_cursor_execute", self.count_statement)
+
+    def tearDown(self):
+        event.remove(self.db.engine, "before_cursor_execute", self.count_statement)
+        super().tearDown()
+
+    def count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def test_batch_resolution(self):
+        # each resolution reads the courses data version
+        names = ["Art", "Physics", "Biology", "wrong course"]
+        self.assertEqual(len(self.db.resolve_names(Course, names)), 3)
+        self.assertEqual(len(self.statements), 2)
+
+        # cached names are not queried
+        courses = self.db.get_courses_by_names(names[:3])
+        self.assertEqual(len(self.statements), 3)
+        self.assertEqual(courses["Physics"].name, "Physics")
+
+        # the missing name is queried again
+        self.assertEqual(len(self.db.resolve_names(Course, names)), 3)
+        self.assertEqual(len(self.statements), 5)
+
+    def test_invalidation_by_other_writer(self):
+        course = Course(name="test course 1")
+        self.db.Session.add(course)
+        self.db.Session.commit()
+        self.assertEqual(self.db.resolve_names(Course, ["test course 1"]), {"test course 1": course.id})
+
+        # the course is renamed by another process
+        with self.db.engine.begin() as connection:
+            connection.execute(update(Course).where(Course.id == course.id).values(name="test course 2"))
+        self.assertEqual(self.db.resolve_names(Course, ["test course 1"]), {})
+
+        self.db.Session.delete(course)
+        self.db.Session.commit()
+
+    def test_invalidation_on_write(self):
+        self.db.get_course_by_name("Art")
+        self.assertEqual(len(self.db.reference_cache), 1)
+
+        course = Course(name="test course 1")
+        self.db.Session.add(course)
+        self.db.Session.flush()
+        # a concurrent request caches the course before the commit
+        self.db.get_courses_by_names(["Art"])
+        self.assertEqual(len(self.db.reference_cache), 1)
+
+        self.db.Session.commit()
+        self.assertEqual(len(self.db.reference_cache), 0)
+
+        self.db.Session.delete(course)
+        self.db.Session.commit()
+
+    def test_invalidation_on_rollback(self):
+        course = Course(name="test course 1")
+        self.db.Session.add(course)
+        self.db.Session.flush()
+        # the uncommitted course is cached by the transaction
+        self.assertEqual(len(self.db.resolve_names(Course, ["test course 1"])), 1)
+
+        self.db.Session.rollback()
+        self.assertEqual(len(self.db.reference_cache), 0)
+        self.assertEqual(self.db.resolve_names(Course, ["test course 1"]), {})
+
+    def test_cache_eviction(self):
+        cache = ReferenceCache(maxsize=2, ttl=60)
+        cache.set_many({1: "a", 2: "b"})
+        cache.get(1)
+        cache.set(3, "c")
+        self.assertEqual(cache.get_many([1, 2, 3]), {1: "a", 3: "c"})
+
+        cache = ReferenceCache(maxsize=2, ttl=0)
+        cache.set(1, "a")
+        self.assertIsNone(cache.get(1))
+
+
+class TestBulkGenerators(unittest.TestCase):
+    def test_students_stream(self):
+        chunks = list(generate_students_stream(random.Random(1), qty=2500, chunk_size=1000))
+        self.assertEqual(list(len(chunk) for chunk in chunks), [1000, 1000, 500])
+
+        # the same seed generates the same data
+        self.assertEqual(chunks, list(generate_students_stream(random.Random(1), qty=2500, chunk_size=1000)))
+
+    def test_groups_stream(self):
+        names = list(group["name"] for chunk in generate_groups_stream(qty=100000, chunk_size=30000)
+                     for group in chunk)
+        self.assertEqual(len(names), 100000)
+        self.assertEqual(len(set(names)), 100000)
+        self.assertTrue(max(len(name) for name in names) <= Group.name.type.length)
+
+
+class TestBulkFill(BaseTest):
+    def test_not_empty_database(self):
+        students_qty = self.db.Session.execute(select(func.count()).select_from(Student)).scalar()
+        with self.assertRaises(ValueError) as context:
+            self.db.bulk_fill_database(100, 5)
+        self.assertIn("courses", str(context.exception))
+        # nothing is loaded
+        self.assertEqual(self.db.Session.execute(select(func.count()).select_from(Student)).scalar(), students_qty)
+
+
 class TestPagination(BaseTest):
     def test_pagination(self):
         res = self.app.get(f"/api/v{API_VERSION}/students/?limit=20&offset=5")
@@ -133,6 +369,601 @@ class TestPagination(BaseTest):
         self.assertEqual(res.json["students"][0]["id"], 6)
 
 
+class TestCursorPagination(BaseTest):
+    def test_cursor_pagination(self):
+        res = self.app.get(f"/api/v{API_VERSION}/students/?limit=20&cursor=")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.json["students"]), 20)
+        self.assertEqual(res.json["students"][0]["id"], 1)
+
+        res = self.app.get(f"/api/v{API_VERSION}/students/?limit=20&cursor={res.json['next_cursor']}")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json["students"][0]["id"], 21)
+
+    def test_cursor_pagination_whole_table(self):
+        ids = []
+        cursor = ""
+        while cursor is not None:
+            res = self.app.get(f"/api/v{API_VERSION}/students/?limit=30&cursor={cursor}")
+            ids.extend(item["id"] for item in res.json["students"])
+            cursor = res.json["next_cursor"]
+
+        res = self.app.get(f"/api/v{API_VERSION}/students/?limit=0")
+        self.assertEqual(ids, list(item["id"] for item in res.json["students"]))
+
+    def test_cursor_xml_header(self):
+        self.app.environ_base["HTTP_ACCEPT"] = "application/xml"
+        res = self.app.get(f"/api/v{API_VERSION}/students/?limit=20&cursor=")
+        self.assertEqual(res.status_code, 200)
+        self.assertIn("X-Next-Cursor", res.headers)
+
+    def test_no_cursor_without_cursor_mode(self):
+        res = self.app.get(f"/api/v{API_VERSION}/students/?limit=20")
+        self.assertNotIn("next_cursor", res.json)
+
+    def test_wrong_cursor(self):
+        res = self.app.get(f"/api/v{API_VERSION}/students/?cursor=wrong")
+        self.assertEqual(res.status_code, 400)
+        self.assertIn("Invalid cursor", res.text)
+
+
+class StatementCounter:
+    """Context manager collecting SQL statements executed by all engines"""
+    def __init__(self):
+        self.statements = []
+
+    def __enter__(self):
+        event.listen(Engine, "before_cursor_execute", self.count_statement)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        event.remove(Engine, "before_cursor_execute", self.count_statement)
+
+    def count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+class TestLoadingPlan(BaseTest):
+    def get_statements_count(self, route):
+        with StatementCounter() as counter:
+            res = self.app.get(route)
+        self.assertEqual(res.status_code, 200)
+        return len(counter.statements)
+
+    # the first statement reads the data versions for ETag
+    @parameterized.expand([
+        ("students", f"/api/v{API_VERSION}/students/", 4),
+        ("groups by count", f"/api/v{API_VERSION}/groups_by_count/{GROUP_MAX_SIZE}/", 3),
+        # the course is taken from the reference data cache after its data version check
+        ("students by course", f"/api/v{API_VERSION}/students_by_course/Art/", 5)
+    ])
+    def test_statements_count_does_not_depend_on_page_size(self, name, route, expected):
+        # warm up the application database connection
+        self.app.get(route)
+
+        self.assertEqual(self.get_statements_count(f"{route}?limit=5"), expected)
+        self.assertEqual(self.get_statements_count(f"{route}?limit=100"), expected)
+
+    def test_list_attribute(self):
+        # the list key differs from the relationship it's read from
+        data_fields = {"id": fields.Integer(), "members": fields.List(fields.Nested(Student.get_fields()),
+                                                                     attribute="students")}
+        plan = get_loading_plan(Group, data_fields)
+        self.assertEqual(len(plan), 2)
+        self.assertEqual(plan[0].path[0].key, "students")
+
+
+class TestTotal(BaseTest):
+    @parameterized.expand([
+        ("students", f"/api/v{API_VERSION}/students/", "students"),
+        ("students by course", f"/api/v{API_VERSION}/students_by_course/Art/", "students"),
+        ("groups by count", f"/api/v{API_VERSION}/groups_by_count/{GROUP_MAX_SIZE}/", "groups")
+    ])
+    def test_exact_total(self, name, route, root_name):
+        res = self.app.get(f"{route}?limit=5&total=exact")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.json[root_name]), 5)
+        self.assertEqual(res.json["total"], len(self.app.get(f"{route}?limit=0").json[root_name]))
+
+    def test_estimated_total(self):
+        connection = self.db.engine.connect()
+        connection.execute("COMMIT")
+        connection.execute("ANALYZE students")
+        connection.close()
+
+        res = self.app.get(f"/api/v{API_VERSION}/students/?limit=5&total=estimate")
+        self.assertEqual(res.json["total"], STUDENTS_QTY)
+
+    def test_cached_total(self):
+        route = f"/api/v{API_VERSION}/students_by_course/Art/?limit=5&total=exact"
+        with StatementCounter() as counter:
+            total = self.app.get(route).json["total"]
+        self.assertTrue(any("count(*)" in statement for statement in counter.statements))
+
+        with StatementCounter() as counter:
+            self.assertEqual(self.app.get(route).json["total"], total)
+        self.assertFalse(any("count(*)" in statement for statement in counter.statements))
+
+        # a new data version is counted again
+        student = Student(first_name="test student1", last_name="test student 1")
+        self.db.Session.add(student)
+        self.db.Session.commit()
+        res = self.app.put(f"/api/v{API_VERSION}/students_add_to_courses/{student.id}/?courses=Art")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.app.get(route).json["total"], total + 1)
+
+        res = self.app.delete(f"/api/v{API_VERSION}/students/{student.id}")
+        self.assertEqual(res.status_code, 200)
+
+    def test_xml_total(self):
+        self.app.environ_base["HTTP_ACCEPT"] = "application/xml"
+        res = self.app.get(f"/api/v{API_VERSION}/students/?limit=5&total=exact")
+        self.assertEqual(res.headers["X-Total-Count"], str(STUDENTS_QTY))
+
+    def test_wrong_total(self):
+        res = self.app.get(f"/api/v{API_VERSION}/students/?total=wrong")
+        self.assertEqual(res.status_code, 400)
+
+
+class TestSparseFieldsets(BaseTest):
+    @parameterized.expand([
+        ("students", f"/api/v{API_VERSION}/students/", "students", "last_name,id", ["id", "last_name"]),
+        ("students by course", f"/api/v{API_VERSION}/students_by_course/Art/", "students", "group", ["group"]),
+        ("groups by count", f"/api/v{API_VERSION}/groups_by_count/{GROUP_MAX_SIZE}/", "groups", "name", ["name"])
+    ])
+    def test_fields(self, name, route, root_name, fields_argument, expected):
+        res = self.app.get(f"{route}?fields={fields_argument}")
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(len(res.json[root_name]) > 0)
+        for item in res.json[root_name]:
+            self.assertEqual(list(item.keys()), expected)
+
+        # the same values as in the complete representation
+        complete = self.app.get(route).json[root_name]
+        self.assertEqual(res.json[root_name], list({key: item[key] for key in expected} for item in complete))
+
+    def test_statements(self):
+        route = f"/api/v{API_VERSION}/students/?fields=id,first_name,last_name"
+        self.app.get(route)
+
+        with StatementCounter() as counter:
+            res = self.app.get(route)
+        self.assertEqual(res.status_code, 200)
+        # data versions and students without group_id, groups and courses are not read
+        self.assertEqual(len(counter.statements), 2)
+        self.assertNotIn("group_id", counter.statements[1])
+
+    def test_fields_with_cursor(self):
+        res = self.app.get(f"/api/v{API_VERSION}/students/?fields=first_name&limit=5&cursor=")
+        self.assertEqual(res.status_code, 200)
+        res = self.app.get(f"/api/v{API_VERSION}/students/?fields=id&limit=5&cursor={res.json['next_cursor']}")
+        self.assertEqual(res.json["students"][0], {"id": 6})
+
+    def test_xml_fields(self):
+        self.app.environ_base["HTTP_ACCEPT"] = "application/xml"
+        res = self.app.get(f"/api/v{API_VERSION}/students/?fields=id&limit=0")
+        self.assertEqual(res.status_code, 200)
+        root = ElementTree.fromstring(res.text)
+        self.assertEqual(set(element.tag for item in root for element in item), {"id"})
+
+    @parameterized.expand([
+        ("unknown", "id,wrong_field"),
+        ("empty", ","),
+        ("not the entity field", "student_count")
+    ])
+    def test_wrong_fields(self, name, fields_argument):
+        res = self.app.get(f"/api/v{API_VERSION}/groups_by_count/{GROUP_MAX_SIZE}/?fields={fields_argument}")
+        self.assertEqual(res.status_code, 400)
+
+
+class TestSerializers(BaseTest):
+    @parameterized.expand([
+        ("students", Student),
+        ("groups", Group),
+        ("courses", Course)
+    ])
+    def test_same_as_marshal(self, name, entity):
+        rows = self.db.Session.execute(select(entity)).scalars().all()
+        serializer = get_serializer(entity)
+        self.assertEqual(list(map(serializer, rows)), marshal(rows, serializer.fields))
+
+    def test_core_rows(self):
+        rows = self.db.Session.execute(select(Student.id, Student.first_name, Student.last_name)).all()
+        serializer = get_serializer(Student, complete=False)
+        self.assertEqual(list(map(serializer, rows)), marshal(rows, Student.get_fields()))
+
+    def test_compiled_once(self):
+        self.assertIs(get_serializer(Student), get_serializer(Student))
+
+    def test_defaults(self):
+        student = Student(first_name="test student", last_name=None, group=None, courses=[])
+        self.assertEqual(get_serializer(Student)(student), marshal(student, Student.get_complete_fields()))
+        self.assertEqual(get_serializer(Student)(student)["group"], {"id": 0, "name": None})
+
+    def test_not_compiled_fields(self):
+        data_fields = {
+            "id": fields.Integer(default=-1),
+            "first_name": fields.String(attribute=lambda student: student.first_name.upper()),
+            "courses": fields.List(fields.String(attribute="name")),
+            "group": fields.Nested(Group.get_fields(), allow_null=True),
+            "names": {"first": fields.String(attribute="first_name"), "last": fields.String(attribute="last_name")},
+            "flag": fields.Boolean(attribute="id")
+        }
+        student = Student(first_name="test student", last_name="last name", courses=[Course(name="Art")])
+        self.assertEqual(compile_serializer(data_fields)(student), marshal(student, data_fields))
+
+
+class TestQueryPlans(BaseTest):
+    """
+    Runs EXPLAIN for all statements of DataAccessLayer queries.
+    Sequential scans are disabled, so a sequential scan remains in a plan only when no index can serve the query
+
+    """
+    def setUp(self):
+        super().setUp()
+        self.statements = []
+        event.listen(self.db.engine, "before_cursor_execute", self.save_statement)
+
+    def tearDown(self):
+        event.remove(self.db.engine, "before_cursor_execute", self.save_statement)
+        super().tearDown()
+
+    def save_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append((statement, parameters))
+
+    def test_indexes_are_valid(self):
+        self.assertEqual(self.db.validate_indexes(), {"missing": [], "unexpected": []})
+
+    def test_create_missing_index(self):
+        with self.db.engine.begin() as connection:
+            connection.execute(text("DROP INDEX ix_students_last_name_first_name"))
+        self.assertEqual(self.db.validate_indexes()["missing"], ["ix_students_last_name_first_name"])
+
+        with StatementCounter() as counter:
+            self.assertEqual(self.db.create_indexes(), ["ix_students_last_name_first_name"])
+        self.assertTrue(any(statement.startswith("CREATE INDEX CONCURRENTLY ix_students_last_name_first_name")
+                            for statement in counter.statements))
+        self.assertEqual(self.db.validate_indexes(), {"missing": [], "unexpected": []})
+        self.assertEqual(self.db.create_indexes(), [])
+
+    @parameterized.expand([
+        ("get_students", lambda db: db.get_students(
+            limit=50, offset=100, loading=get_loading_plan(Student, Student.get_complete_fields()))),
+        ("get_students_cursor", lambda db: db.get_students(
+            limit=50, after=100, loading=get_loading_plan(Student, Student.get_complete_fields()))),
+        ("get_students_by_course", lambda db: db.get_students_by_course(
+            "Art", limit=50, loading=get_loading_plan(Student, Student.get_complete_fields()))),
+        ("get_groups_with_less_equals_students", lambda db: db.get_groups_with_less_equals_students(
+            GROUP_MIN_SIZE, limit=50, loading=get_loading_plan(Group, Group.get_complete_fields()))),
+        ("get_group_by_name", lambda db: db.get_group_by_name("non-existing group")),
+        ("get_course_by_name", lambda db: db.get_course_by_name("Art")),
+        ("get_student_by_id", lambda db: db.get_student_by_id(1)),
+    ])
+    def test_no_sequential_scans(self, name, query):
+        try:
+            query(self.db)
+        except NoResultFound:
+            pass
+        self.assertTrue(len(self.statements) > 0)
+
+        connection = self.db.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SET enable_seqscan = off")
+            for statement, parameters in self.statements:
+                cursor.execute(f"EXPLAIN {statement}", parameters)
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+                self.assertNotIn("Seq Scan", plan, f"{statement}\n{plan}")
+        finally:
+            connection.rollback()
+            connection.close()
+
+
+class TestConditionalGet(BaseTest):
+    route = f"/api/v{API_VERSION}/students/?limit=10"
+
+    def test_not_modified(self):
+        res = self.app.get(self.route)
+        self.assertEqual(res.status_code, 200)
+        etag = res.headers["ETag"]
+
+        res = self.app.get(self.route, headers={"If-None-Match": etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers["ETag"], etag)
+        self.assertEqual(res.data, b"")
+
+    def test_etag_depends_on_request(self):
+        etag = self.app.get(self.route).headers["ETag"]
+        self.assertNotEqual(etag, self.app.get(f"{self.route}&offset=10").headers["ETag"])
+        self.assertNotEqual(etag, self.app.get(self.route, headers={"Accept": "application/xml"}).headers["ETag"])
+
+    def test_modified_after_write(self):
+        etag = self.app.get(self.route).headers["ETag"]
+
+        res = self.app.post(f"/api/v{API_VERSION}/students/",
+                            data='{"first_name": "Chuck","last_name": "Norris"}',
+                            content_type="application/json")
+        student_id = res.get_json()["student"]["id"]
+
+        res = self.app.get(self.route, headers={"If-None-Match": etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers["ETag"], etag)
+
+        self.app.delete(f"/api/v{API_VERSION}/students/{student_id}")
+
+    @parameterized.expand([
+        ("commit", True),
+        ("rollback", False),
+    ])
+    def test_sql_write(self, name, commit):
+        # versions are changed by the database triggers, not by the application write methods
+        etag = self.app.get(self.route).headers["ETag"]
+        versions = self.db.get_data_versions(("students", "groups", "courses"))
+        self.db.Session.commit()
+
+        with self.db.engine.connect() as connection:
+            transaction = connection.begin()
+            connection.execute(text("UPDATE students SET last_name = last_name WHERE id = 1"))
+            connection.execute(text("UPDATE students SET first_name = first_name WHERE id = 2"))
+            if commit:
+                transaction.commit()
+            else:
+                transaction.rollback()
+
+        res = self.app.get(self.route, headers={"If-None-Match": etag})
+        self.assertEqual(res.status_code, 200 if commit else 304)
+        expected = dict(versions, students=versions["students"] + 1) if commit else versions
+        self.assertEqual(self.db.get_data_versions(("students", "groups", "courses")), expected)
+        self.db.Session.commit()
+
+
+class TestInstrumentation(BaseTest):
+    def get_log_record(self, logs) -> dict:
+        return json.loads(logs.records[-1].getMessage())
+
+    def test_server_timing(self):
+        with self.assertLogs("school_management.requests", "INFO") as logs:
+            res = self.app.get(f"/api/v{API_VERSION}/students/?limit=10")
+        self.assertEqual(res.status_code, 200)
+
+        timing = {metric.split(";")[0]: metric for metric in res.headers["Server-Timing"].split(", ")}
+        self.assertEqual(set(timing), {"db", "serialize", "total"})
+
+        record = self.get_log_record(logs)
+        self.assertEqual(record["endpoint"], "students")
+        self.assertEqual(record["status"], 200)
+        self.assertIn(f'desc="{record["statements"]} statements"', timing["db"])
+        self.assertGreater(record["statements"], 0)
+        self.assertNotIn("repeated", record)
+
+    def test_streamed_statements_are_logged(self):
+        with self.assertLogs("school_management.requests", "INFO") as logs:
+            res = self.app.get(f"/api/v{API_VERSION}/students/?limit=0")
+            self.assertEqual(res.status_code, 200)
+            res.get_data()
+            res.close()
+        # the rows are fetched while the response is streamed
+        self.assertGreaterEqual(self.get_log_record(logs)["statements"], 2)
+
+    def test_repeated_statements(self):
+        # without the loading plan relationships are lazy loaded for each student
+        with patch("school_management.api.get_fields_loading_plan", return_value=[]), \
+                patch.object(app.extensions["instrumentation"], "repeated_threshold", 5), \
+                self.assertLogs("school_management.requests", "WARNING") as logs:
+            res = self.app.get(f"/api/v{API_VERSION}/students/?limit=20")
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('repeated;desc="statement executed 20 times"', res.headers["Server-Timing"])
+
+        repeated = self.get_log_record(logs)["repeated"]
+        self.assertEqual(repeated[0]["count"], 20)
+        self.assertIn("FROM courses", repeated[0]["statement"])
+
+
+class TestMetrics(BaseTest):
+    def get_samples(self) -> dict:
+        res = self.app.get("/metrics")
+        self.assertEqual(res.status_code, 200)
+        return {(sample.name, tuple(sorted(sample.labels.items()))): sample.value
+                for family in text_string_to_metric_families(res.get_data(as_text=True))
+                for sample in family.samples}
+
+    @parameterized.expand([
+        ("found", "GET", "/groups_by_count/5/", "GroupsByCount", "200"),
+        ("not found", "DELETE", "/students/999999", "StudentsDelete", "404")
+    ])
+    def test_requests(self, name, method, path, resource, status):
+        requests_key = ("http_requests_total", (("method", method), ("resource", resource), ("status", status)))
+        duration_key = ("http_request_duration_seconds_count", (("method", method), ("resource", resource)))
+        size_key = ("http_response_size_bytes_count", (("resource", resource),))
+
+        before = self.get_samples()
+        res = self.app.open(f"/api/v{API_VERSION}{path}", method=method)
+        self.assertEqual(str(res.status_code), status)
+        after = self.get_samples()
+
+        for key in (requests_key, duration_key, size_key):
+            self.assertEqual(after[key] - before.get(key, 0), 1)
+
+    def test_pool(self):
+        self.app.get(f"/api/v{API_VERSION}/groups_by_count/5/")
+        samples = self.get_samples()
+        self.assertEqual(samples[("db_pool_size", ())], app.database.get_pool_status()["size"])
+        self.assertIn(("db_pool_checked_out", ()), samples)
+
+
+class TestHealthChecks(BaseTest):
+    def setUp(self):
+        super().setUp()
+        self.health = app.extensions["health"]
+        self.health.result = None
+
+    def test_healthz(self):
+        res = self.app.get("/healthz")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json, {"status": "ok"})
+        self.assertIn('desc="0 statements"', res.headers["Server-Timing"])
+
+    def test_readyz(self):
+        with patch.object(app.database, "ping", wraps=app.database.ping) as ping:
+            for _ in range(3):
+                res = self.app.get("/readyz")
+                self.assertEqual(res.status_code, 200)
+                self.assertEqual(res.json, {"status": "ready"})
+        # the result is cached
+        self.assertEqual(ping.call_count, 1)
+
+    def test_database_error(self):
+        with patch.object(app.database, "ping", side_effect=OperationalError("SELECT 1", {}, Exception())):
+            res = self.app.get("/readyz")
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.json["status"], "unavailable")
+        self.assertIn("OperationalError", res.json["error"])
+
+    def test_timeout(self):
+        with patch.object(app.database, "ping", side_effect=lambda timeout: time.sleep(0.3)), \
+                patch.object(self.health, "timeout", 0.05):
+            res = self.app.get("/readyz")
+        self.assertEqual(res.status_code, 503)
+        self.assertIn("did not answer", res.json["error"])
+        # the slow check is finished before other tests
+        self.health.future.result()
+
+    def test_ping(self):
+        self.db.ping(1)
+        self.db.ping()
+
+
+class TestCreateApp(unittest.TestCase):
+    def create_app(self, **config) -> None:
+        self.created = create_app(dict(config, PG_DATABASE=TEST_DATABASE))
+        self.addCleanup(self.created.database.engine.dispose)
+
+    def test_warm_up(self):
+        with self.assertLogs("school_management.startup", "INFO") as logs:
+            self.create_app(PG_POOL_SIZE=3)
+
+        # the pool is opened before the first request
+        status = self.created.database.get_pool_status()
+        self.assertEqual(status["checked_in"], 3)
+        self.assertEqual(set(self.created.startup_timings),
+                         {"config", "routes", "database", "serializers", "api_docs", "total"})
+        self.assertIn('"startup_seconds"', logs.output[0])
+
+        res = self.created.test_client().get("/specifications.json")
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(f"/api/v{API_VERSION}/students/", res.json["paths"])
+
+    def test_without_api_docs(self):
+        self.create_app(API_DOCS=False, PG_POOL_WARM_UP=0)
+        self.assertNotIn("api_docs", self.created.startup_timings)
+        self.assertEqual(self.created.database.get_pool_status()["checked_in"], 0)
+
+        client = self.created.test_client()
+        self.assertEqual(client.get("/specifications.json").status_code, 404)
+        self.assertEqual(client.get(f"/api/v{API_VERSION}/groups_by_count/5/").status_code, 200)
+
+    def test_docker_config(self):
+        # in docker the options are read from the environment, the given values override them
+        environment = {"PG_USER": config["PG_USER"], "PG_PASSWD": config["PG_PASSWD"],
+                       "PG_DATABASE_ADDRESS": config["DATABASE_ADDRESS"], "PG_DATABASE": "wrong database",
+                       "PG_POOL_SIZE": "2"}
+        with patch.dict(os.environ, environment), patch("school_management.run.IS_DOCKER", True):
+            self.create_app(API_DOCS=False)
+
+        self.assertEqual(self.created.database.get_pool_status()["size"], 2)
+        self.assertEqual(self.created.test_client().get("/readyz").status_code, 200)
+
+    def test_startup_time_budget(self):
+        with self.assertLogs("school_management.startup", "WARNING"):
+            self.create_app(STARTUP_TIME_BUDGET=0)
+
+    def test_database_unavailable(self):
+        # the application starts, /readyz reports the database error
+        with self.assertLogs("school_management.startup", "WARNING"):
+            self.create_app(PG_DATABASE_ADDRESS="", DATABASE_ADDRESS="127.0.0.1:1", PG_PASSWD="none")
+        self.assertEqual(self.created.test_client().get("/readyz").status_code, 503)
+
+
+class TestStreaming(BaseTest):
+    def test_streamed_full_list(self):
+        res = self.app.get(f"/api/v{API_VERSION}/students/?limit=0")
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.is_streamed)
+
+        # the same data as the pages have
+        students = []
+        for offset in range(0, STUDENTS_QTY, 50):
+            students.extend(self.app.get(f"/api/v{API_VERSION}/students/?limit=50&offset={offset}").json["students"])
+        self.assertEqual(res.json["students"], students)
+
+    def test_streamed_with_cursor(self):
+        res = self.app.get(f"/api/v{API_VERSION}/students/?limit=0&cursor=")
+        self.assertEqual(len(res.json["students"]), STUDENTS_QTY)
+        self.assertIsNone(res.json["next_cursor"])
+
+    def test_streamed_xml(self):
+        self.app.environ_base["HTTP_ACCEPT"] = "application/xml"
+        res = self.app.get(f"/api/v{API_VERSION}/students/?limit=0")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(ElementTree.fromstring(res.text)), STUDENTS_QTY)
+
+    def test_streamed_xml_same_as_pages(self):
+        self.app.environ_base["HTTP_ACCEPT"] = "application/xml"
+        res = self.app.get(f"/api/v{API_VERSION}/students/?limit=0")
+        self.assertTrue(res.is_streamed)
+        streamed = res.data
+
+        page = self.app.get(f"/api/v{API_VERSION}/students/?limit={STUDENTS_QTY}")
+        self.assertEqual(streamed, page.data)
+
+
+class TestExport(BaseTest):
+    def get_students(self) -> list:
+        students = self.db.Session.execute(select(Student).order_by(Student.id)).scalars().all()
+        return list((student.id, student.first_name, student.last_name, student.group_id,
+                     sorted(course.id for course in student.courses)) for student in students)
+
+    @parameterized.expand([
+        ("no accept", {}),
+        ("any", {"Accept": "*/*"}),
+        ("ndjson", {"Accept": "application/x-ndjson, text/csv;q=0.5"})
+    ])
+    def test_ndjson(self, name, headers):
+        res = self.app.get(f"/api/v{API_VERSION}/students/export/", headers=headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, "application/x-ndjson")
+        self.assertTrue(res.is_streamed)
+
+        rows = list(json.loads(line) for line in res.text.splitlines())
+        self.assertEqual(len(rows), STUDENTS_QTY)
+        self.assertEqual(list(tuple(row.values()) for row in rows), self.get_students())
+
+    @parameterized.expand([
+        ("format", "?format=csv", {}),
+        ("accept", "", {"Accept": "text/csv"})
+    ])
+    def test_csv(self, name, parameter, headers):
+        res = self.app.get(f"/api/v{API_VERSION}/students/export/{parameter}", headers=headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, "text/csv")
+
+        rows = list(csv.DictReader(StringIO(res.text)))
+        self.assertEqual(
+            list((int(row["id"]), row["first_name"], row["last_name"],
+                  int(row["group_id"]) if row["group_id"] else None,
+                  list(map(int, row["course_ids"].split()))) for row in rows),
+            self.get_students())
+
+    def test_chunks(self):
+        rows = list((index, "first name", "last name", None, [1, 2]) for index in range(EXPORT_CHUNK_ROWS + 1))
+        self.assertEqual(list(len(chunk.splitlines()) for chunk in iter_ndjson(rows)), [EXPORT_CHUNK_ROWS, 1])
+        self.assertEqual(list(len(chunk.splitlines()) for chunk in iter_csv(rows)), [EXPORT_CHUNK_ROWS + 1, 1])
+
+    def test_wrong_format(self):
+        res = self.app.get(f"/api/v{API_VERSION}/students/export/?format=xml")
+        self.assertEqual(res.status_code, 400)
+
+
 class TestXMLOutput(BaseTest):
     def test_xml_output(self):
         self.app.environ_base["HTTP_ACCEPT"] = "application/xml"
@@ -145,6 +976,62 @@ class TestXMLOutput(BaseTest):
         self.assertEqual(elements[0][0].tag, "id")
 
 
+class TestXMLWriter(unittest.TestCase):
+    data = [
+        {"id": 1, "group": {"id": 0, "name": None}, "courses": [], "name": "a<&>\"'b", "empty": ""},
+        {"list": [1, [2, 3]], "dict": {}}
+    ]
+
+    def test_dict_to_xml(self):
+        self.assertEqual(
+            dict_to_xml(self.data, "students"),
+            b"<?xml version='1.0' encoding='utf-8'?>\n"
+            b"<students>\n"
+            b"\t<item>\n"
+            b"\t\t<id>1</id>\n"
+            b"\t\t<group>\n"
+            b"\t\t\t<id>0</id>\n"
+            b"\t\t\t<name>None</name>\n"
+            b"\t\t</group>\n"
+            b"\t\t<courses />\n"
+            b"\t\t<name>a&lt;&amp;&gt;\"'b</name>\n"
+            b"\t\t<empty />\n"
+            b"\t</item>\n"
+            b"\t<item>\n"
+            b"\t\t<list>\n"
+            b"\t\t\t<item>1</item>\n"
+            b"\t\t\t<item>\n"
+            b"\t\t\t\t<item>2</item>\n"
+            b"\t\t\t\t<item>3</item>\n"
+            b"\t\t\t</item>\n"
+            b"\t\t</list>\n"
+            b"\t\t<dict />\n"
+            b"\t</item>\n"
+            b"</students>")
+
+    @parameterized.expand([
+        ("empty list", [], "<?xml version='1.0' encoding='utf-8'?>\n<students />"),
+        ("dict", {"success": True},
+         "<?xml version='1.0' encoding='utf-8'?>\n<students>\n\t<success>True</success>\n</students>")
+    ])
+    def test_root(self, name, data, expected):
+        self.assertEqual(dict_to_xml(data, "students"), expected.encode("utf-8"))
+
+    def test_without_indentation(self):
+        xml = dict_to_xml(self.data, "students", indent=None)
+        self.assertNotIn(b"\t", xml)
+        self.assertEqual(ElementTree.tostring(ElementTree.fromstring(xml)),
+                         ElementTree.tostring(ElementTree.fromstring(dict_to_xml(self.data, "students")),
+                                              encoding="utf-8").replace(b"\n", b"").replace(b"\t", b"")
+                         .replace(b"<?xml version='1.0' encoding='utf-8'?>", b""))
+
+    def test_iter_xml(self):
+        parts = list(iter_xml(iter(self.data), "students"))
+        # declaration with root, one part per item, root closing
+        self.assertEqual(len(parts), len(self.data) + 2)
+        self.assertEqual("".join(parts).encode("utf-8"), dict_to_xml(self.data, "students"))
+
+
 class TestGroupsByCount(BaseTest):
     def setUp(self):
         super().setUp()
@@ -175,11 +1062,73 @@ class TestGroupsByCount(BaseTest):
         ("count from group json", f"/api/v{API_VERSION}/groups_by_group/test group 2/",)
     ])
     def test_groups_by_count(self, name, route):
-        res = self.app.get(route)
+        res = self.app.get(f"{route}?limit=0")
+        self.assertEqual(res.status_code, 200)
+        names = list(group["name"] for group in res.json["groups"])
+        self.assertEqual(names[-2:], ["test group 1", "test group 2"])
+        self.assertTrue(max(len(group["students"]) for group in res.json["groups"]) <= 2)
+
+    def test_groups_without_students(self):
+        group = Group(name="test group 3")
+        self.db.Session.add(group)
+        self.db.Session.commit()
+
+        res = self.app.get(f"/api/v{API_VERSION}/groups_by_count/0/?limit=0")
+        self.db.Session.delete(group)
+        self.db.Session.commit()
+
         self.assertEqual(res.status_code, 200)
-        self.assertEqual(len(res.json["groups"]), 2)
-        self.assertEqual(res.json["groups"][0]["name"], "test group 1")
-        self.assertEqual(res.json["groups"][1]["name"], "test group 2")
+        self.assertIn("test group 3", list(group["name"] for group in res.json["groups"]))
+        self.assertTrue(all(len(group["students"]) == 0 for group in res.json["groups"]))
+
+    def test_student_count(self):
+        # regroup and delete students, the counters are maintained by the database
+        self.test_students[0].group = self.test_groups[1]
+        self.db.Session.commit()
+        self.assertEqual([group.student_count for group in self.test_groups], [0, 3])
+
+        self.db.Session.delete(self.test_students[2])
+        self.db.Session.commit()
+        self.test_students.pop()
+        self.assertEqual([group.student_count for group in self.test_groups], [0, 2])
+
+    def test_repair_group_counts(self):
+        self.db.Session.execute(update(Group).values(student_count=100))
+        self.db.Session.commit()
+
+        self.assertEqual(self.db.repair_group_counts(), GROUPS_QTY + len(self.test_groups))
+
+        stmt = (
+            select(Group.student_count, func.count(Student.id))
+            .outerjoin(Group.students)
+            .group_by(Group.id)
+        )
+        for student_count, actual_count in self.db.Session.execute(stmt).all():
+            self.assertEqual(student_count, actual_count)
+
+    def test_upgrade_database(self):
+        # a database created before the counter has neither the column nor the triggers
+        self.db.Session.commit()
+        with self.db.engine.begin() as connection:
+            for operation in ("insert", "delete", "update"):
+                connection.execute(text(f"DROP TRIGGER students_{operation}_group_student_count ON students"))
+            connection.execute(text("ALTER TABLE groups DROP COLUMN student_count"))
+
+        self.db.create_tables()
+
+        stmt = (
+            select(Group.student_count, func.count(Student.id))
+            .outerjoin(Group.students)
+            .group_by(Group.id)
+        )
+        for student_count, actual_count in self.db.Session.execute(stmt).all():
+            self.assertEqual(student_count, actual_count)
+        self.assertEqual(self.db.validate_indexes()["missing"], [])
+
+        # the triggers maintain the counter
+        self.test_students[0].group = self.test_groups[1]
+        self.db.Session.commit()
+        self.assertEqual([group.student_count for group in self.test_groups], [0, 3])
 
     def test_group_not_found(self):
         res = self.app.get(f"/api/v{API_VERSION}/groups_by_group/non-existing group/")
@@ -212,6 +1161,309 @@ class TestAddStudent(BaseTest):
         self.assertEqual(res.status_code, 400)
 
 
+class TestAddStudentsBulk(BaseTest):
+    def setUp(self):
+        super().setUp()
+
+        self.test_group = Group(name="test group b")
+        self.test_courses = [Course(name="test course b1"), Course(name="test course b2")]
+        self.db.Session.add_all([self.test_group, *self.test_courses])
+        self.db.Session.commit()
+
+    def tearDown(self):
+        students = self.db.Session.execute(
+            select(Student).where(Student.first_name.startswith("bulk student"))).scalars().all()
+        for item in students + self.test_courses + [self.test_group]:
+            self.db.Session.delete(item)
+        self.db.Session.commit()
+        super().tearDown()
+
+    def get_students(self) -> list:
+        stmt = select(Student).where(Student.first_name.startswith("bulk student")).order_by(Student.id)
+        return self.db.Session.execute(stmt).scalars().all()
+
+    def test_add_students(self):
+        res = self.app.post(f"/api/v{API_VERSION}/students/bulk/", json=[
+            {"first_name": "bulk student 1", "last_name": "last name 1"},
+            {"first_name": "bulk student 2", "last_name": "last name 2", "group": "test group b",
+             "courses": ["test course b1", "test course b2", "test course b1"]}
+        ])
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json["result"]["errors"], [])
+
+        students = self.get_students()
+        self.assertEqual(list({"index": index, "id": student.id} for index, student in enumerate(students)),
+                         res.json["result"]["created"])
+        self.assertIsNone(students[0].group)
+        self.assertEqual(students[1].group.name, "test group b")
+        self.assertEqual(sorted(course.name for course in students[1].courses), ["test course b1", "test course b2"])
+
+        self.db.Session.refresh(self.test_group)
+        self.assertEqual(self.test_group.student_count, 1)
+
+    def test_ids_match_students(self):
+        students = list({"first_name": f"bulk student {index}", "last_name": f"last name {index}",
+                         "courses": ["test course b1"] if index % 2 else []} for index in range(50))
+        added, errors = self.db.add_students(students)
+        self.assertEqual(errors, {})
+
+        for index, student_id in added.items():
+            student = self.db.get_student_by_id(student_id)
+            self.assertEqual(student.first_name, students[index]["first_name"])
+            self.assertEqual(list(course.name for course in student.courses), students[index]["courses"])
+
+    def test_errors(self):
+        res = self.app.post(f"/api/v{API_VERSION}/students/bulk/", json=[
+            {"first_name": "bulk student 1"},
+            {"first_name": "bulk student 2", "last_name": "last name 2", "group": "wrong group"},
+            {"first_name": "bulk student 3", "last_name": "last name 3"},
+            {"first_name": "bulk student 4", "last_name": "last name 4", "courses": ["wrong course"]},
+            {"first_name": "bulk student 5", "last_name": "last name 5", "wrong_field": 1},
+            "wrong student"
+        ])
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(list(error["index"] for error in res.json["result"]["errors"]), [0, 1, 3, 4, 5])
+        self.assertEqual(list(item["index"] for item in res.json["result"]["created"]), [2])
+        self.assertEqual(list(student.first_name for student in self.get_students()), ["bulk student 3"])
+
+    def test_ndjson(self):
+        res = self.app.post(f"/api/v{API_VERSION}/students/bulk/",
+                            data='{"first_name": "bulk student 1", "last_name": "last name 1"}\n'
+                                 '\n'
+                                 '{"first_name": "bulk student 2", \n'
+                                 '{"first_name": "bulk student 3", "last_name": "last name 3", '
+                                 '"courses": ["test course b2"]}\n',
+                            content_type="application/x-ndjson")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json["result"]["errors"][0]["index"], 1)
+        self.assertIn("line 3", res.json["result"]["errors"][0]["message"])
+        self.assertEqual(list(student.first_name for student in self.get_students()),
+                         ["bulk student 1", "bulk student 3"])
+
+    @parameterized.expand([
+        ("not array", {"first_name": "bulk student 1", "last_name": "last name 1"}),
+        ("empty", []),
+        ("too many", [{"first_name": "bulk student", "last_name": "last name"}] * 10001)
+    ])
+    def test_wrong_body(self, name, body):
+        res = self.app.post(f"/api/v{API_VERSION}/students/bulk/", json=body)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(self.get_students(), [])
+
+
+class TestImport(BaseTest):
+    def setUp(self):
+        super().setUp()
+
+        self.test_group = Group(name="import g0")
+        self.test_student = Student(first_name="import student 0", last_name="last name 0")
+        self.db.Session.add_all([self.test_group, self.test_student])
+        self.db.Session.commit()
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.checkpoint = os.path.join(self.directory.name, "checkpoint.json")
+
+    def tearDown(self):
+        students = self.db.Session.execute(
+            select(Student).where(Student.first_name.startswith("import student"))).scalars().all()
+        courses = self.db.Session.execute(
+            select(Course).where(Course.name.startswith("import course"))).scalars().all()
+        groups = self.db.Session.execute(
+            select(Group).where(Group.name.startswith("import g"))).scalars().all()
+        for item in students + courses + groups:
+            self.db.Session.delete(item)
+        self.db.Session.commit()
+        self.directory.cleanup()
+        super().tearDown()
+
+    def write_file(self, name: str, rows: list) -> str:
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w", newline="", encoding="utf-8") as file:
+            if name.endswith(".csv"):
+                writer = csv.DictWriter(file, fieldnames=list(rows[0].keys()))
+                writer.writeheader()
+                writer.writerows(rows)
+            else:
+                file.writelines(json.dumps(row) + "\n" for row in rows)
+        return path
+
+    def get_students(self) -> list:
+        stmt = select(Student).where(Student.first_name.startswith("import student")).order_by(Student.id)
+        return self.db.Session.execute(stmt).scalars().all()
+
+    @parameterized.expand([
+        ("csv", "import course 1;import course 2"),
+        ("ndjson", ["import course 1", "import course 2"])
+    ])
+    def test_import(self, file_format, courses):
+        files = {
+            "groups": self.write_file(f"groups.{file_format}", [{"name": "import g0"}, {"name": "import g1"}]),
+            "courses": self.write_file(f"courses.{file_format}", [
+                {"name": "import course 1", "description": "description 1"},
+                {"name": "import course 2", "description": "description 2"}
+            ]),
+            "students": self.write_file(f"students.{file_format}", [
+                {"first_name": "import student 1", "last_name": "last name 1", "group": "import g1",
+                 "courses": courses},
+                {"first_name": "import student 2", "last_name": "last name 2", "group": "", "courses": ""}
+            ]),
+            "enrollments": self.write_file(f"enrollments.{file_format}", [
+                {"student_id": self.test_student.id, "course": "import course 2"}
+            ])
+        }
+
+        importer = Importer(self.db, batch_size=1)
+        for kind, path in files.items():
+            self.assertEqual(importer.import_file(kind, path), 2 if kind != "enrollments" else 1)
+
+        groups = self.db.Session.execute(select(Group.name).where(Group.name.startswith("import g"))).scalars()
+        self.assertEqual(sorted(groups), ["import g0", "import g1"])
+
+        student_0, student_1, student_2 = self.get_students()
+        self.assertEqual(list(course.name for course in student_0.courses), ["import course 2"])
+        self.assertEqual(student_1.group.name, "import g1")
+        self.assertEqual(student_1.group.student_count, 1)
+        self.assertEqual(sorted(course.name for course in student_1.courses), ["import course 1", "import course 2"])
+        self.assertIsNone(student_2.group)
+        self.assertEqual(student_2.courses, [])
+
+    def test_resume(self):
+        rows = [
+            {"first_name": "import student 1", "last_name": "last name 1", "group": "import g0"},
+            {"first_name": "import student 2", "last_name": "last name 2"},
+            {"first_name": "import student 3", "last_name": "last name 3", "group": "import g9"},
+            {"first_name": "import student 4", "last_name": "last name 4"}
+        ]
+        path = self.write_file("students.ndjson", rows)
+
+        with self.assertRaisesRegex(ImportDataError, r"students\.ndjson:3: group 'import g9'"):
+            Importer(self.db, batch_size=2, checkpoint_path=self.checkpoint).import_file("students", path)
+        self.assertEqual(list(student.first_name for student in self.get_students()),
+                         ["import student 0", "import student 1", "import student 2"])
+
+        rows[2]["group"] = "import g0"
+        self.write_file("students.ndjson", rows)
+        importer = Importer(self.db, batch_size=2, checkpoint_path=self.checkpoint)
+        self.assertEqual(importer.import_file("students", path), 4)
+        self.assertEqual(list(student.first_name for student in self.get_students()),
+                         ["import student 0", "import student 1", "import student 2",
+                          "import student 3", "import student 4"])
+
+        importer.remove_checkpoint()
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_existing_enrollments(self):
+        courses = self.write_file("courses.csv", [{"name": "import course 1"}, {"name": "import course 2"}])
+        importer = Importer(self.db, batch_size=2)
+        importer.import_file("courses", courses)
+        course_ids = self.db.resolve_names(Course, ["import course 1"])
+        self.db.enroll_students(list(course_ids.values()), student_ids=[self.test_student.id])
+
+        # the existing and the repeated enrollments are skipped
+        path = self.write_file("enrollments.csv", [
+            {"student_id": self.test_student.id, "course": "import course 1"},
+            {"student_id": self.test_student.id, "course": "import course 2"},
+            {"student_id": self.test_student.id, "course": "import course 2"}
+        ])
+        self.assertEqual(importer.import_file("enrollments", path), 3)
+
+        self.db.Session.refresh(self.test_student)
+        self.assertEqual(sorted(course.name for course in self.test_student.courses),
+                         ["import course 1", "import course 2"])
+
+    def test_database_error(self):
+        # the import command reports database errors of COPY and the import can be continued
+        with self.assertRaises(IntegrityError):
+            with self.db.engine.begin() as connection:
+                insert_rows(connection, Student.__table__, [
+                    {"id": self.test_student.id, "first_name": "import student 1", "last_name": "last name 1"}])
+
+    def test_id_allocator_without_sequence(self):
+        table = Table("allocated_rows", MetaData(), Column("id", Integer, primary_key=True, autoincrement=False),
+                      prefixes=["TEMPORARY"])
+        with self.db.engine.begin() as connection:
+            table.create(connection)
+            connection.execute(table.insert(), [{"id": 1}, {"id": 5}])
+            allocator = IdAllocator(connection, table.c.id)
+            self.assertEqual(allocator.allocate(2), [6, 7])
+            self.assertEqual(allocator.allocate(1), [8])
+
+            # other writers wait for the transaction end
+            locks = connection.execute(text(
+                "SELECT mode FROM pg_locks WHERE relation = 'allocated_rows'::regclass AND pid = pg_backend_pid()"
+            )).scalars().all()
+            self.assertIn("ShareRowExclusiveLock", locks)
+            table.drop(connection)
+
+    @parameterized.expand([
+        ("missing column", "students.csv", [{"first_name": "import student 1"}], "students.csv:2: missing last_name"),
+        ("unknown course", "enrollments.csv", [{"student_id": 1, "course": "import course 9"}],
+         "enrollments.csv:2: course named 'import course 9' not found"),
+        ("wrong format", "students.txt", [{"first_name": "import student 1"}], "unknown file format")
+    ])
+    def test_errors(self, name, file_name, rows, message):
+        path = self.write_file(file_name, rows)
+        kind = file_name.split(".")[0]
+        with self.assertRaisesRegex(ImportDataError, message):
+            Importer(self.db).import_file(kind, path)
+        self.assertEqual(len(self.get_students()), 1)
+
+    @parameterized.expand([
+        ("short", "import student 2"),
+        ("long", "import student 2,last name 2,import g0,,extra"),
+    ])
+    def test_csv_row_length(self, name, line):
+        path = os.path.join(self.directory.name, "students.csv")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(f"first_name,last_name,group,courses\nimport student 1,last name 1,,\n{line}\n")
+        with self.assertRaisesRegex(ImportDataError, "students.csv:3: 4 values expected by the header"):
+            Importer(self.db).import_file("students", path)
+        self.assertEqual(len(self.get_students()), 1)
+
+    def test_unknown_kind(self):
+        path = self.write_file("teachers.csv", [{"name": "import g1"}])
+        with self.assertRaisesRegex(ValueError, "Unknown data kind: 'teachers'"):
+            Importer(self.db).import_file("teachers", path)
+
+
+class TestConcurrentWrites(BaseTest):
+    def test_add_and_delete_students(self):
+        # writers of the same group lock the data versions at the commit, after the group
+        group_id = self.db.Session.execute(select(Group.id).order_by(Group.id).limit(1)).scalar()
+        self.db.Session.commit()
+        added = queue.Queue()
+        errors = []
+        deadline = time.monotonic() + 3
+
+        def write(add: bool) -> None:
+            db = create_database_connection(test_database_connection_string)
+            try:
+                while time.monotonic() < deadline:
+                    if add:
+                        added.put(db.add_student({"first_name": "test", "last_name": "test", "group_id": group_id}).id)
+                    else:
+                        try:
+                            db.delete_student_by_id(added.get(timeout=0.1))
+                        except queue.Empty:
+                            continue
+                    db.remove_session()
+            except OperationalError as error:
+                errors.append(error)
+            finally:
+                db.remove_session()
+                db.engine.dispose()
+
+        threads = list(threading.Thread(target=write, args=(add,)) for add in (True, True, False, False))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        while not added.empty():
+            self.db.delete_student_by_id(added.get())
+
+        self.assertEqual(errors, [])
+
+
 class TestDeleteStudent(BaseTest):
     def test_delete_student_by_id(self):
         student = Student(first_name="test student1", last_name="test student 1")
@@ -225,6 +1477,22 @@ class TestDeleteStudent(BaseTest):
         with self.assertRaises(NoResultFound):
             self.db.Session.execute(select(Student).where(Student.id == student.id)).one()
 
+    def test_delete_student_statements(self):
+        student = Student(first_name="test student1", last_name="test student 1",
+                          courses=self.db.Session.execute(select(Course).limit(2)).scalars().all())
+        self.db.Session.add(student)
+        self.db.Session.commit()
+
+        student_id = student.id
+
+        # enrollments and student deletes
+        with StatementCounter() as counter:
+            self.db.delete_student_by_id(student_id)
+        self.assertEqual(len(counter.statements), 2)
+
+        with self.assertRaises(NoResultFound):
+            self.db.delete_student_by_id(student_id)
+
     def test_delete_student_by_id_wrong_id(self):
         res = self.app.delete(f"/api/v{API_VERSION}/students/{STUDENTS_QTY + 50}")
         self.assertEqual(res.status_code, 404)
@@ -289,6 +1557,16 @@ class TestAddStudentToCourses(BaseTest):
         self.db.Session.refresh(student)
         self.assertEqual(len(student.courses), 2)
 
+    def test_add_student_to_courses_again(self):
+        student = self.db.Session.execute(select(Student).where(Student.first_name == "test student1")).one().Student
+
+        self.app.put(f"/api/v{API_VERSION}/students_add_to_courses/{student.id}/?courses=test course 1")
+        res = self.app.put(f"/api/v{API_VERSION}/students_add_to_courses/{student.id}/"
+                           f"?courses=test course 1&courses=test course 2")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(list(course["name"] for course in res.get_json()["student"]["courses"]),
+                         ["test course 1", "test course 2"])
+
     @parameterized.expand([
         ("wrong_id",
          f"/api/v{API_VERSION}/students_add_to_courses/{STUDENTS_QTY + 1}/?courses=test course 1&courses=test course 2",
@@ -302,6 +1580,73 @@ class TestAddStudentToCourses(BaseTest):
         self.assertIn(responce, res.text)
 
 
+class TestEnrollments(BaseTest):
+    def setUp(self):
+        super().setUp()
+
+        self.test_group = Group(name="test group e")
+        self.test_courses = [Course(name="test course e1"), Course(name="test course e2")]
+        self.test_students = [
+            Student(first_name="test student1", last_name="test student 1", group=self.test_group),
+            Student(first_name="test student2", last_name="test student 2", group=self.test_group),
+            Student(first_name="test student3", last_name="test student 3")
+        ]
+        self.db.Session.add_all([self.test_group, *self.test_courses, *self.test_students])
+        self.db.Session.commit()
+
+    def tearDown(self):
+        for item in self.test_students + self.test_courses + [self.test_group]:
+            self.db.Session.delete(item)
+        self.db.Session.commit()
+        super().tearDown()
+
+    def get_enrollments(self) -> set:
+        stmt = (
+            select(Student.first_name, Course.name)
+            .join(Student.courses)
+            .where(Course.name.in_(["test course e1", "test course e2"]))
+        )
+        return set(self.db.Session.execute(stmt).all())
+
+    def test_enrollments(self):
+        enrollment = {
+            "courses": ["test course e1", "test course e2"],
+            "students": [self.test_students[2].id, STUDENTS_QTY + 1000],
+            "groups": ["test group e"]
+        }
+        res = self.app.post(f"/api/v{API_VERSION}/enrollments/", json=enrollment)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json["result"]["enrolled"], 6)
+        self.assertEqual(self.get_enrollments(), {(student.first_name, course.name)
+                                                  for student in self.test_students for course in self.test_courses})
+
+        # existing enrollments are kept
+        res = self.app.post(f"/api/v{API_VERSION}/enrollments/", json=enrollment)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json["result"]["enrolled"], 0)
+
+    def test_enrollments_without_upsert(self):
+        self.db.enroll_students([self.test_courses[0].id], student_ids=[self.test_students[0].id])
+        with patch.dict(db_module.UPSERT_DIALECTS, clear=True):
+            enrolled = self.db.enroll_students([course.id for course in self.test_courses],
+                                               group_ids=[self.test_group.id])
+        self.assertEqual(enrolled, 3)
+        self.assertEqual(len(self.get_enrollments()), 4)
+
+    @parameterized.expand([
+        ("no courses", {"students": [1]}, 400),
+        ("no students", {"courses": ["test course e1"]}, 400),
+        ("wrong students", {"courses": ["test course e1"], "students": ["1"]}, 400),
+        ("wrong field", {"courses": ["test course e1"], "students": [1], "wrong_field": 1}, 400),
+        ("wrong course", {"courses": ["wrong course"], "students": [1]}, 404),
+        ("wrong group", {"courses": ["test course e1"], "groups": ["wrong group"]}, 404)
+    ])
+    def test_enrollments_errors(self, name, enrollment, code):
+        res = self.app.post(f"/api/v{API_VERSION}/enrollments/", json=enrollment)
+        self.assertEqual(res.status_code, code)
+        self.assertEqual(self.get_enrollments(), set())
+
+
 class TestDeleteStudentFromCourse(BaseTest):
     def setUp(self):
         super().setUp()
@@ -337,6 +1682,21 @@ class TestDeleteStudentFromCourse(BaseTest):
         self.db.Session.refresh(self.test_student)
         self.assertEqual(len(self.test_student.courses), 0)
 
+    def test_del_student_from_course_statements(self):
+        student_id, course_id = self.test_student.id, self.test_course.id
+
+        # delete and one joined select of the result
+        with StatementCounter() as counter:
+            student = self.db.delete_student_from_course(student_id, course_id)
+            data = get_serializer(Student)(student)
+        self.assertEqual(len(counter.statements), 2)
+        self.assertEqual(data["courses"], [])
+
+        with self.assertRaises(ValueError):
+            self.db.delete_student_from_course(student_id, course_id)
+        with self.assertRaises(NoResultFound):
+            self.db.delete_student_from_course(STUDENTS_QTY + 1, course_id)
+
     def test_del_student_from_course_wrong_id(self):
         res = self.app.put(f"/api/v{API_VERSION}/students_del_from_course/{STUDENTS_QTY + 1}/"
                            f"?course_name=test course 1")